@@ -0,0 +1,154 @@
+#
+# Module storing render records of all regions of a run in a few chunked array files, instead of two PNG files per
+# region. Records are accumulated in memory and written as NPZ chunks of about ARTIFACT_CHUNK_BYTES each:
+#
+#   <root>/artifacts_00000.npz, <root>/artifacts_00001.npz, ...
+#
+# Each chunk holds, for its regions: 'file_names' and 'file_id' (index into file_names), 'index' of the region in
+# its frame, 'bbox' and 'orientation', brightness profiles concatenated in 'profile_values' with 'profile_offsets',
+# and fragments of the frame surrounding the regions flattened into 'crop_values' with 'crop_offsets' and
+# 'crop_shapes'. Records can be read back with iter_artifact_records and drawn later, e.g. by RegionRenderer.
+#
+
+#importing packages for standard mathematical and data operations
+import numpy as np
+
+#importing packages supporting filesystem path walking
+import glob
+import os
+
+#importing instrumentation of stages
+import instrumentation
+from instrumentation import stage, count
+
+#constants and default values
+
+#prefix of names of chunk files
+ARTIFACT_PREFIX = 'artifacts_'
+
+#approximate size of a chunk, in bytes of profiles and crops
+ARTIFACT_CHUNK_BYTES = 64 << 20
+
+
+'''
+The function returns path of a chunk of the store
+
+Arguments:
+  root - directory of the store
+  number - ordinal number of the chunk
+'''
+def chunk_path(root, number):
+    return os.path.join(root, ARTIFACT_PREFIX + '%05d.npz' % number)
+
+
+'''
+The function lists chunks of the store, in order
+
+Arguments:
+  root - directory of the store
+
+Returns:
+  list of paths
+'''
+def list_chunks(root):
+    return sorted(glob.glob(os.path.join(root, ARTIFACT_PREFIX + '*.npz')))
+
+
+'''
+Store of render records of a run, written in chunks. Chunks of earlier runs in the same directory are kept, new
+chunks are numbered after them
+
+Arguments:
+  root - directory of the store, created if it does not exist
+  chunk_bytes - approximate size of a chunk
+'''
+class ArtifactStore:
+    def __init__(self, root, chunk_bytes=ARTIFACT_CHUNK_BYTES):
+        os.makedirs(root, exist_ok=True)
+        self.root = root
+        self.chunk_bytes = chunk_bytes
+        self.next_chunk = len(list_chunks(root))
+        self.records = []
+        self.pending_bytes = 0
+        self.stored = 0
+
+    '''
+    The method adds recorded regions of one image to the store
+
+    Arguments:
+      records - list of dicts returned by region_processing.region_render_record
+    '''
+    def add(self, records):
+        for record in records:
+            self.records.append(record)
+            self.pending_bytes += record['profile'].nbytes + record['crop'].nbytes
+        if self.pending_bytes >= self.chunk_bytes:
+            self.flush()
+
+    '''
+    The method writes accumulated records as a new chunk
+    '''
+    def flush(self):
+        if not self.records:
+            return
+        records = self.records
+        file_names, file_id = np.unique([r['filename'] for r in records], return_inverse=True)
+        profiles = [np.asarray(r['profile'], dtype=np.float64) for r in records]
+        crops = [r['crop'] for r in records]
+        path = chunk_path(self.root, self.next_chunk)
+        with stage('store_artifacts'):
+            np.savez(path,
+                     file_names=file_names,
+                     file_id=file_id,
+                     index=np.array([r['index'] for r in records], dtype=np.int64),
+                     bbox=np.array([r['bbox'] for r in records], dtype=np.int64).reshape(-1, 4),
+                     orientation=np.array([r['orientation'] for r in records], dtype=np.float64),
+                     profile_offsets=np.concatenate([[0], np.cumsum([len(p) for p in profiles])]),
+                     profile_values=np.concatenate(profiles),
+                     crop_offsets=np.concatenate([[0], np.cumsum([c.size for c in crops])]),
+                     crop_shapes=np.array([c.shape[:2] for c in crops], dtype=np.int64).reshape(-1, 2),
+                     crop_values=np.concatenate([c.ravel() for c in crops]))
+        count('artifact_chunks')
+        if instrumentation.ENABLED:
+            count('bytes_written', os.path.getsize(path))
+        self.stored += len(records)
+        self.next_chunk += 1
+        self.records = []
+        self.pending_bytes = 0
+
+    '''
+    The method writes remaining records
+
+    Returns:
+      number of stored regions
+    '''
+    def close(self):
+        self.flush()
+        return self.stored
+
+
+'''
+The function reads render records back from the store
+
+Arguments:
+  root - directory of the store
+
+Returns:
+  generator of dicts with the keys of region_processing.region_render_record
+'''
+def iter_artifact_records(root):
+    for path in list_chunks(root):
+        with np.load(path) as chunk:
+            data = {name: chunk[name] for name in chunk.files}
+        for i in range(len(data['index'])):
+            crop = data['crop_values'][data['crop_offsets'][i]:data['crop_offsets'][i + 1]]
+            shape = tuple(data['crop_shapes'][i])
+            if crop.size != shape[0] * shape[1]:
+                #fragments of multichannel frames keep their channels
+                shape += (-1,)
+            yield {'filename': str(data['file_names'][data['file_id'][i]]),
+                   'index': int(data['index'][i]),
+                   'profile': data['profile_values'][data['profile_offsets'][i]:data['profile_offsets'][i + 1]],
+                   'crop': crop.reshape(shape),
+                   'bbox': tuple(int(x) for x in data['bbox'][i]),
+                   'orientation': float(data['orientation'][i])}
@@ -0,0 +1,273 @@
+#
+# Module modelling the static part of frames: the sky background with its gradients and hot pixels of the sensor.
+#
+# The model is built from a rolling sample of frames. Streaks move from frame to frame, so the per-pixel median of the
+# sample stack keeps only what is static. Its local median (3x3) is the background; pixels brighter than the
+# background by more than HOT_PIXEL_SIGMA robust standard deviations in every frame of the sample are hot pixels.
+# Before thresholding, each frame is corrected with one pass: the background is subtracted (clipped at 0, in the
+# dtype of the frame) and hot pixels are set to 0, so neither hot pixels nor gradients reach the threshold.
+#
+# The model is cached on disk as NPZ, together with its sample, names of the sampled frames, the time it was built
+# and a digest of its background and hot pixels. Scans fill the sample up to BACKGROUND_SAMPLE_SIZE frames; a model
+# with a full sample is kept as it is until it is older than BACKGROUND_MAX_AGE, when a scan adds frames not sampled
+# before, dropping the oldest ones, or until its file is removed, when it is built again. Results of frames depend on
+# the model, so the result cache is keyed on its digest, which changes only when the model does.
+# Worker processes load the model from the cache once, without its sample, and reuse it, with its correction buffer,
+# for all frames.
+#
+
+#importing packages for standard mathematical and data operations
+import numpy as np
+
+#importing packages for hashing and time
+import hashlib
+import time
+
+#importing packages supporting filesystem path walking
+import os
+
+#importing instrumentation of stages
+from instrumentation import stage, count
+
+#constants and default values
+
+#number of frames in the rolling sample
+BACKGROUND_SAMPLE_SIZE = 16
+
+#number of frames added to the sample by one scan updating a full sample; the rest of the sample keeps older frames
+BACKGROUND_SAMPLE_UPDATE = 4
+
+#age, in seconds, after which a model with a full sample is updated with new frames
+BACKGROUND_MAX_AGE = 7 * 24 * 3600.
+
+#number of robust standard deviations above the background making a pixel hot
+HOT_PIXEL_SIGMA = 5.
+
+#number of rows of the stack reduced at once, bounding the size of temporary arrays of the median
+MEDIAN_BAND_ROWS = 256
+
+#models loaded by the current process, key - path of the cache, value - (modification time, model)
+_loaded = {}
+
+
+'''
+The function computes per-pixel median of a stack of frames, band by band
+
+Arguments:
+  stack - 3D array with frames along the first axis
+
+Returns:
+  2D array of float32
+'''
+def median_stack(stack):
+    median = np.empty(stack.shape[1:], dtype=np.float32)
+    for r0 in range(0, stack.shape[1], MEDIAN_BAND_ROWS):
+        median[r0:r0 + MEDIAN_BAND_ROWS] = np.median(stack[:, r0:r0 + MEDIAN_BAND_ROWS], axis=0)
+    return median
+
+
+'''
+Model of background and hot pixels of frames of one size
+
+Arguments:
+  sample - 3D array with the sampled frames, oldest first; models loaded by load have None, until load_sample
+  sources - list of names of the sampled frames
+'''
+class BackgroundModel:
+    def __init__(self, sample, sources):
+        from scipy import ndimage
+
+        self.sample = sample
+        self.sources = list(sources)
+        self.built_at = time.time()
+        with stage('background_model'):
+            median = median_stack(sample)
+            smooth = ndimage.median_filter(median, size=3)
+            residual = median - smooth
+            noise = 1.4826 * float(np.median(np.abs(residual - np.median(residual))))
+            if np.issubdtype(sample.dtype, np.integer):
+                #integer frames cannot resolve noise below one unit
+                noise = max(noise, 1.)
+            minimum = np.min(sample, axis=0)
+            self.hot_mask = minimum - smooth > HOT_PIXEL_SIGMA * noise
+            if np.issubdtype(sample.dtype, np.integer):
+                smooth = np.round(smooth)
+            self.background = smooth.astype(sample.dtype)
+        count('hot_pixels', int(np.count_nonzero(self.hot_mask)))
+        self.digest = model_digest(self.background, self.hot_mask)
+        #buffer reused for corrected frames
+        self.buffer = None
+
+    '''
+    The method returns shape of frames the model describes
+    '''
+    @property
+    def shape(self):
+        return self.background.shape
+
+    '''
+    The method corrects a frame: subtracts the background, clipping at 0, and sets hot pixels to 0. The result is
+    written into a buffer reused for all frames, so it is valid until the next call
+
+    Arguments:
+      image - array with pixels of the frame, of the shape of the model
+
+    Returns:
+      corrected frame, in the dtype of the model
+    '''
+    def correct(self, image):
+        if self.buffer is None:
+            self.buffer = np.empty(self.shape, dtype=self.background.dtype)
+        with stage('background_subtract'):
+            np.maximum(image, self.background, out=self.buffer, casting='unsafe')
+            np.subtract(self.buffer, self.background, out=self.buffer)
+            self.buffer[self.hot_mask] = 0
+        return self.buffer
+
+    '''
+    The method saves the model, with its sample
+
+    Arguments:
+      path - path of the NPZ file
+    '''
+    def save(self, path):
+        #written under a temporary name and renamed, so workers never load a partly written model
+        temporary = path + '.tmp.npz'
+        np.savez(temporary, sample=self.sample, sources=np.array(self.sources, dtype=str),
+                 background=self.background, hot_mask=self.hot_mask, built_at=self.built_at, digest=self.digest)
+        os.replace(temporary, path)
+
+    '''
+    The method loads a model saved by save, without its sample, which only updates of the model need; arrays of NPZ
+    files are read only when accessed, so the sample is not read at all
+    '''
+    @staticmethod
+    def load(path):
+        with np.load(path) as data:
+            model = BackgroundModel.__new__(BackgroundModel)
+            model.sample = None
+            model.sources = data['sources'].tolist()
+            model.background = data['background']
+            model.hot_mask = data['hot_mask']
+            #models saved before the time and digest were recorded are treated as stale
+            model.built_at = float(data['built_at']) if 'built_at' in data else 0.
+            model.digest = str(data['digest']) if 'digest' in data else model_digest(model.background, model.hot_mask)
+            model.buffer = None
+        return model
+
+    '''
+    The method reads the sample of a model loaded by load
+
+    Arguments:
+      path - path of the NPZ file the model was loaded from
+    '''
+    def load_sample(self, path):
+        with np.load(path) as data:
+            self.sample = data['sample']
+
+
+'''
+The function computes digest of a model, the same for models correcting frames the same way
+
+Arguments:
+  background - 2D array with the background
+  hot_mask - 2D boolean array marking hot pixels
+
+Returns:
+  hex digest of SHA-1
+'''
+def model_digest(background, hot_mask):
+    sha1 = hashlib.sha1()
+    sha1.update((str(background.dtype) + str(background.shape)).encode())
+    sha1.update(np.ascontiguousarray(background).tobytes())
+    sha1.update(np.packbits(hot_mask).tobytes())
+    return sha1.hexdigest()
+
+
+'''
+The function picks frames added to the sample, evenly spaced among the frames not sampled yet
+
+Arguments:
+  img_filenames - paths of frames of the catalog
+  sources - names of frames already in the sample
+  number - maximal number of picked frames
+
+Returns:
+  list of paths
+'''
+def pick_sample(img_filenames, sources, number):
+    sampled = set(sources)
+    candidates = [f for f in img_filenames if os.path.basename(f) not in sampled]
+    if len(candidates) <= number:
+        return candidates
+    return [candidates[int(i)] for i in np.linspace(0, len(candidates) - 1, number)]
+
+
+'''
+The function builds the background model for frames of the catalog, or fills the sample of the model cached by an
+earlier scan with frames not sampled before, and saves it. A model with a full sample is returned unchanged, without
+reading any frame, until it is older than max_age
+
+Arguments:
+  path - path of the cached model; the model is built again when the file is removed
+  img_filenames - paths of frames of the catalog
+  read - function reading a frame from its path
+  sample_size - number of frames in the rolling sample
+  sample_update - maximal number of frames added by this call, when the cached model has a full sample
+  max_age - age of a model with a full sample, in seconds, after which it is updated
+
+Returns:
+  BackgroundModel, or None if no frame can be sampled
+'''
+def prepare_background_model(path, img_filenames, read, sample_size=BACKGROUND_SAMPLE_SIZE,
+                             sample_update=BACKGROUND_SAMPLE_UPDATE, max_age=BACKGROUND_MAX_AGE):
+    model = BackgroundModel.load(path) if os.path.exists(path) else None
+    if model is not None:
+        if len(model.sources) >= sample_size and time.time() - model.built_at < max_age:
+            return model
+        added = pick_sample(img_filenames, model.sources, max(sample_update, sample_size - len(model.sources)))
+    else:
+        added = pick_sample(img_filenames, [], sample_size)
+
+    frames = []
+    names = []
+    for f in added:
+        frame = read(f)
+        #frames of another size or type than the model are not sampled
+        reference = model.background if model is not None else (frames[0] if frames else frame)
+        if frame.shape != reference.shape or frame.dtype != reference.dtype:
+            continue
+        frames.append(np.asarray(frame))
+        names.append(os.path.basename(f))
+    if not frames:
+        return model
+
+    if model is not None:
+        model.load_sample(path)
+        sample = np.concatenate([model.sample, np.stack(frames)])[-sample_size:]
+        sources = (model.sources + names)[-sample_size:]
+    else:
+        sample = np.stack(frames)
+        sources = names
+    model = BackgroundModel(sample, sources)
+    model.save(path)
+    return model
+
+
+'''
+The function returns model cached in the given file, loading it once per process and again only when the file
+changes
+
+Arguments:
+  path - path of the cached model
+
+Returns:
+  BackgroundModel
+'''
+def load_background_model(path):
+    mtime = os.stat(path).st_mtime_ns
+    cached = _loaded.get(path)
+    if cached is None or cached[0] != mtime:
+        cached = (mtime, BackgroundModel.load(path))
+        _loaded[path] = cached
+    return cached[1]
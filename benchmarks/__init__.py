@@ -0,0 +1,8 @@
+#
+# Package with benchmarks of the streak detection and a generator of synthetic frames used by them.
+# Run from the repository root:
+#
+#   python -m benchmarks.run --output bench.json --baseline baseline.json
+#
+# or with python -m smugi bench, which passes its options to benchmarks.run
+#
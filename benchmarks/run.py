@@ -0,0 +1,279 @@
+#
+# Module running benchmarks of detection stages and of the whole find_and_classify_events on synthetic frames.
+# Results are saved as JSON and can be compared with a stored baseline, e.g.
+#
+#   python -m benchmarks.run --sizes 512,2048 --workers 1,4 --output bench.json --save-baseline baseline.json
+#   python -m benchmarks.run --sizes 512,2048 --workers 1,4 --output bench.json --baseline baseline.json
+#
+# Everything runs offline, on frames generated in a temporary directory.
+#
+
+#importing packages for command line parsing, timing and saving results
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+#importing packages for standard mathematical and data operations
+import numpy as np
+
+#importing functions from custom modules
+from benchmarks.synthetic import synthetic_frame, write_synthetic_catalog
+from image_processing import threshold_image, label_image, find_regions_in_image, MIN_STREAK_AREA
+from region_processing import cut_out_strk, extract_brightness_profiles
+from postprocessing import sort_event_outliers
+from results import ScanResults, RESULT_REGION_DTYPE
+from measurement import measure_regions
+
+#constants and default values
+
+#number of repetitions of each timed call; the shortest time is reported
+DEFAULT_REPEAT = 3
+
+#relative slowdown against baseline reported as regression
+DEFAULT_TOLERANCE = 0.2
+
+#number of frames in the catalog used by the end-to-end benchmark
+CATALOG_FRAMES = 24
+
+#startup benchmarks: name, python code run in a new interpreter, and time budget in seconds
+STARTUP_COMMANDS = [
+    ('smugi --help', 'import sys, smugi; sys.argv = ["smugi", "--help"]; smugi.main()', 0.3),
+    ('import main', 'import main', 0.6),
+]
+
+#modules which should not be imported before they are needed
+HEAVY_MODULES = ('matplotlib', 'skimage', 'scipy')
+
+#directory containing modules of the repository
+REPOSITORY_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+'''
+The function measures execution time of a call
+
+Arguments:
+  fn - function to call
+  repeat - number of repetitions
+
+Returns:
+  shortest wall time of a single call, in seconds
+'''
+def time_call(fn, repeat=DEFAULT_REPEAT):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+'''
+The function times each detection stage on a synthetic frame of given size
+
+Arguments:
+  size - height and width of the frame
+  dtype - type of pixels
+  repeat - number of repetitions
+
+Returns:
+  dict where key - benchmark name, value - time in seconds
+'''
+def benchmark_stages(size, dtype=np.uint8, repeat=DEFAULT_REPEAT):
+    frame, _ = synthetic_frame(size, size, dtype, streaks=8, border_streaks=2, hot_pixels=20,
+                               length=(size // 20, size // 4), seed=size)
+    suffix = '[%d,%s]' % (size, np.dtype(dtype).name)
+    bw = threshold_image(frame)
+    labelled = label_image(bw)
+    streaks = find_regions_in_image(frame, min_area=MIN_STREAK_AREA)
+
+    results = {}
+    results['threshold' + suffix] = time_call(lambda: threshold_image(frame), repeat)
+    results['label' + suffix] = time_call(lambda: label_image(bw), repeat)
+    results['find_regions' + suffix] = time_call(lambda: find_regions_in_image(frame), repeat)
+    results['measure' + suffix] = time_call(lambda: measure_regions(labelled, MIN_STREAK_AREA), repeat)
+    results['find_regions_tiled' + suffix] = time_call(lambda: find_regions_in_image(frame, tile_size=size // 4),
+                                                       repeat)
+    #frame without streaks, which prescreening should reject before the full resolution detection
+    empty, _ = synthetic_frame(size, size, dtype, streaks=0, border_streaks=0, hot_pixels=20, seed=size + 1)
+    results['find_regions_empty' + suffix] = time_call(lambda: find_regions_in_image(empty, min_area=MIN_STREAK_AREA),
+                                                       repeat)
+    results['find_regions_empty_prescreened' + suffix] = time_call(
+        lambda: find_regions_in_image(empty, min_area=MIN_STREAK_AREA, prescreen='exact'), repeat)
+    results['cut_out_strk' + suffix] = time_call(lambda: [cut_out_strk(frame, r).sum(0) for r in streaks], repeat)
+    results['extract_profiles' + suffix] = time_call(lambda: extract_brightness_profiles(frame, streaks), repeat)
+    return results
+
+
+'''
+The function times classification of streak lengths
+
+Arguments:
+  count - number of streaks
+  repeat - number of repetitions
+
+Returns:
+  dict where key - benchmark name, value - time in seconds
+'''
+def benchmark_outliers(count, repeat=DEFAULT_REPEAT):
+    rng = np.random.default_rng(count)
+    files_count = max(1, count // 3)
+    results = ScanResults()
+    for i in range(files_count):
+        results.intern('f%d' % i)
+    rows = np.zeros(count, dtype=RESULT_REGION_DTYPE)
+    rows['file_id'] = rng.integers(0, files_count, count)
+    rows['length'] = rng.gamma(3., 20., count)
+    results.append_rows(rows)
+
+    #classification overwrites classes and counts of outliers, so it can be repeated on the same results
+    return {'sort_event_outliers[%d]' % count: time_call(lambda: sort_event_outliers(results), repeat)}
+
+
+'''
+The function times find_and_classify_events on a catalog of synthetic frames, for each number of workers.
+Plots, cache and tables are disabled, so nothing is written outside of the temporary directory
+
+Arguments:
+  size - height and width of frames
+  workers_list - list of numbers of workers
+  repeat - number of repetitions
+
+Returns:
+  dict where key - benchmark name, value - time in seconds
+'''
+def benchmark_end_to_end(size, workers_list, repeat=DEFAULT_REPEAT):
+    from main import find_and_classify_events
+
+    results = {}
+    with tempfile.TemporaryDirectory() as catalog:
+        write_synthetic_catalog(catalog, CATALOG_FRAMES, seed=size, height=size, width=size, streaks=4,
+                                length=(size // 20, size // 4))
+        output_filename = os.path.join(catalog, 'analytics.txt')
+        for workers in workers_list:
+            results['find_and_classify_events[%d,workers=%d]' % (size, workers)] = time_call(
+                lambda: find_and_classify_events(catalog, output_filename, workers, plots=False), repeat)
+    return results
+
+
+'''
+The function times startup of the command line and import of main in new interpreters, and checks that heavy
+packages are not imported by them
+
+Arguments:
+  repeat - number of repetitions
+
+Returns:
+  results - dict where key - benchmark name, value - time in seconds
+  problems - list of descriptions of exceeded budgets and heavy packages imported too early
+'''
+def benchmark_startup(repeat=DEFAULT_REPEAT):
+    results = {}
+    problems = []
+
+    def run(code):
+        subprocess.run([sys.executable, '-c', code], cwd=REPOSITORY_ROOT, check=True, stdout=subprocess.DEVNULL)
+
+    for name, code, budget in STARTUP_COMMANDS:
+        results['startup[' + name + ']'] = time_call(lambda: run(code), repeat)
+        if results['startup[' + name + ']'] > budget:
+            problems.append('startup of %s took %.3f s, budget is %.3f s' % (name, results['startup[' + name + ']'],
+                                                                             budget))
+
+    check = ('import sys, main; print(",".join(m for m in %r if m in sys.modules))' % (HEAVY_MODULES,))
+    loaded = subprocess.run([sys.executable, '-c', check], cwd=REPOSITORY_ROOT, check=True, stdout=subprocess.PIPE,
+                            universal_newlines=True).stdout.strip()
+    if loaded:
+        problems.append('import main loads ' + loaded)
+    return results, problems
+
+
+'''
+The function compares results with baseline
+
+Arguments:
+  results - dict with times of benchmarks
+  baseline - dict with times of benchmarks of the baseline
+  tolerance - relative slowdown reported as regression
+
+Returns:
+  list of names of benchmarks slower than baseline by more than tolerance
+'''
+def compare_with_baseline(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    regressions = []
+    print('%-50s %12s %12s %8s' % ('benchmark', 'baseline [s]', 'current [s]', 'ratio'))
+    for name in sorted(results):
+        if name not in baseline:
+            print('%-50s %12s %12.6f %8s' % (name, '-', results[name], '-'))
+            continue
+        ratio = results[name] / baseline[name] if baseline[name] > 0 else float('inf')
+        flag = ''
+        if ratio > 1 + tolerance:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print('%-50s %12.6f %12.6f %8.2f%s' % (name, baseline[name], results[name], ratio, flag))
+    return regressions
+
+
+'''
+The function returns description of the machine, saved together with results
+'''
+def environment():
+    return {'python': platform.python_version(), 'numpy': np.__version__, 'machine': platform.machine(),
+            'processor': platform.processor(), 'cpus': os.cpu_count(), 'system': platform.system()}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks of streak detection on synthetic frames')
+    parser.add_argument('--sizes', default='512,2048', help='comma separated sizes of frames')
+    parser.add_argument('--workers', default='1,4', help='comma separated numbers of workers for end-to-end runs')
+    parser.add_argument('--dtypes', default='uint8,uint16', help='comma separated types of pixels of frames')
+    parser.add_argument('--streak-counts', default='100000,1000000',
+                        help='comma separated numbers of streaks for outlier classification')
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help='repetitions of each measurement')
+    parser.add_argument('--no-end-to-end', action='store_true', help='skip find_and_classify_events benchmarks')
+    parser.add_argument('--no-startup', action='store_true', help='skip startup time benchmarks')
+    parser.add_argument('--output', default='bench.json', help='JSON file where results are saved')
+    parser.add_argument('--baseline', help='JSON file with baseline results to compare with')
+    parser.add_argument('--save-baseline', help='JSON file where results are also saved as new baseline')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='relative slowdown against baseline reported as regression')
+    args = parser.parse_args(argv)
+
+    sizes = [int(x) for x in args.sizes.split(',')]
+    results = {}
+    problems = []
+    if not args.no_startup:
+        startup_results, problems = benchmark_startup(args.repeat)
+        results.update(startup_results)
+    for size in sizes:
+        for dtype in args.dtypes.split(','):
+            results.update(benchmark_stages(size, np.dtype(dtype).type, args.repeat))
+    for count in args.streak_counts.split(','):
+        results.update(benchmark_outliers(int(count), args.repeat))
+    if not args.no_end_to_end:
+        for size in sizes:
+            results.update(benchmark_end_to_end(size, [int(x) for x in args.workers.split(',')], args.repeat))
+
+    report = {'environment': environment(), 'results': results, 'problems': problems}
+    for path in [args.output, args.save_baseline]:
+        if path:
+            with open(path, 'w') as f:
+                json.dump(report, f, indent=2, sort_keys=True)
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+    regressions = compare_with_baseline(results, baseline, args.tolerance)
+    for problem in problems:
+        print('STARTUP: ' + problem)
+    return 1 if regressions or problems else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
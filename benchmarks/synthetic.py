@@ -0,0 +1,128 @@
+#
+# Module generating deterministic synthetic frames with streaks, for benchmarks.
+# The same parameters and seed always give the same frame.
+#
+
+#importing packages for standard mathematical and data operations
+import math
+import numpy as np
+
+#importing packages used in image processing
+from skimage import draw, io
+
+#importing packages supporting filesystem path walking
+import os
+
+#constants and default values
+
+#half width of drawn streaks, in pixels
+STREAK_HALF_WIDTH = 2
+
+
+'''
+The function draws single streak into the frame, as an anti-aliased line widened across its direction
+
+Arguments:
+  frame - float array, modified in place
+  r0, c0, r1, c1 - end points of the streak
+  brightness - value added to pixels on the streak axis
+'''
+def draw_streak(frame, r0, c0, r1, c1, brightness):
+    height, width = frame.shape
+    rr, cc, val = draw.line_aa(int(r0), int(c0), int(r1), int(c1))
+    #widen across the dominant direction of the line
+    vertical = abs(r1 - r0) > abs(c1 - c0)
+    for d in range(-STREAK_HALF_WIDTH, STREAK_HALF_WIDTH + 1):
+        if vertical:
+            r, c = rr, cc + d
+        else:
+            r, c = rr + d, cc
+        inside = (r >= 0) & (r < height) & (c >= 0) & (c < width)
+        frame[r[inside], c[inside]] += brightness * val[inside]
+
+
+'''
+The function generates synthetic frame with streaks
+
+Arguments:
+  height, width - size of the frame
+  dtype - type of pixels, np.uint8 or np.uint16
+  background - mean background level, as a fraction of maximal pixel value
+  noise - standard deviation of gaussian noise, as a fraction of maximal pixel value
+  hot_pixels - number of single saturated pixels
+  streaks - number of streaks lying inside the frame
+  length - (min, max) range of streak lengths, in pixels
+  angle - angle of streaks in degrees, None means random angles
+  border_streaks - number of additional streaks touching the frame border
+  brightness - brightness of streaks, as a fraction of maximal pixel value
+  seed - seed of random generator
+
+Returns:
+  frame - array of given type
+  specs - list of dicts with end points ('r0', 'c0', 'r1', 'c1') and 'border' flag of each streak
+'''
+def synthetic_frame(height=512, width=512, dtype=np.uint8, background=0.04, noise=0.012, hot_pixels=0, streaks=3,
+                    length=(20, 120), angle=None, border_streaks=0, brightness=0.8, seed=0):
+    rng = np.random.default_rng(seed)
+    max_value = np.iinfo(dtype).max
+    frame = rng.normal(background * max_value, noise * max_value, (height, width))
+
+    specs = []
+    margin = STREAK_HALF_WIDTH + 3
+    for i in range(streaks + border_streaks):
+        border = i >= streaks
+        l = rng.uniform(*length)
+        a = math.radians(angle) if angle is not None else rng.uniform(0, math.pi)
+        dr, dc = l * math.sin(a), l * math.cos(a)
+        if border:
+            #start on a random side of the frame and go inwards
+            side = rng.integers(4)
+            if side == 0:
+                r0, c0, dr = 0, rng.uniform(0, width - 1), abs(dr)
+            elif side == 1:
+                r0, c0, dr = height - 1, rng.uniform(0, width - 1), -abs(dr)
+            elif side == 2:
+                r0, c0, dc = rng.uniform(0, height - 1), 0, abs(dc)
+            else:
+                r0, c0, dc = rng.uniform(0, height - 1), width - 1, -abs(dc)
+        else:
+            #whole streak with its width inside the frame
+            r0 = rng.uniform(margin + max(0, -dr), height - margin - max(0, dr))
+            c0 = rng.uniform(margin + max(0, -dc), width - margin - max(0, dc))
+        r1 = min(max(r0 + dr, 0), height - 1)
+        c1 = min(max(c0 + dc, 0), width - 1)
+        draw_streak(frame, r0, c0, r1, c1, brightness * max_value)
+        specs.append({'r0': r0, 'c0': c0, 'r1': r1, 'c1': c1, 'border': border})
+
+    if hot_pixels:
+        frame[rng.integers(0, height, hot_pixels), rng.integers(0, width, hot_pixels)] = max_value
+
+    return np.clip(frame, 0, max_value).astype(dtype), specs
+
+
+'''
+The function writes catalog of synthetic PNG frames
+
+Arguments:
+  directory - directory where frames are written, created if needed
+  count - number of frames
+  seed - seed of the first frame, following frames use consecutive seeds
+  empty_fraction - fraction of frames without streaks
+  frame_params - parameters passed to synthetic_frame
+
+Returns:
+  list of paths of written frames
+'''
+def write_synthetic_catalog(directory, count, seed=0, empty_fraction=0.5, **frame_params):
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for i in range(count):
+        params = dict(frame_params)
+        if i < int(round(count * empty_fraction)):
+            params['streaks'] = 0
+            params['border_streaks'] = 0
+        frame, _ = synthetic_frame(seed=seed + i, **params)
+        path = os.path.join(directory, 'synthetic_%06d.png' % i)
+        io.imsave(path, frame, check_contrast=False)
+        paths.append(path)
+    return paths
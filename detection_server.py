@@ -0,0 +1,399 @@
+#
+# Module implementing a long-running detection server, giving a verdict for single frames right after they are
+# written, without starting Python, importing skimage and listing the catalog for each frame.
+#
+# The server listens on a Unix domain socket, or on a port of localhost, and speaks JSON lines: each request is one
+# JSON object in a line, and each response is one JSON object in a line, in the order of requests of the connection.
+# Requests:
+#
+#   {"id": 1, "path": "/data/frame.png"}                     frame read from the file, see frame_readers module
+#   {"id": 2, "raw": "<base64>", "shape": [H, W], "dtype": "uint16", "name": "frame"}
+#                                                            pixels sent in the request, in C order
+#   {"id": 3, "op": "stats"}                                 latency percentiles of requests served so far
+#   {"id": 4, "op": "ping"}
+#
+# Adding "profiles": true to a frame request returns brightness profiles of the streaks too. Responses to frames:
+#
+#   {"id": 1, "filename": "frame.png", "streak": true, "count": 2, "regions": [...], "latency_ms": 12.5}
+#
+# where each region has 'label', 'area', 'length', 'minor_length', 'orientation', 'centroid' and 'bbox'. A request
+# which cannot be served is answered with {"id": ..., "error": "..."}. A request line longer than MAX_REQUEST_BYTES
+# is answered with one error, with "id" null, and the connection is closed.
+#
+# Frames are processed by a pool of worker processes, started once with detection modules imported and a first
+# frame processed, so requests do not pay for imports. Each connection is handled by its own thread, so requests of
+# several clients are processed concurrently. Latency of each request, from receiving its line to sending the
+# response, is recorded; percentiles of the last LATENCY_WINDOW requests are returned by the stats request and
+# printed when the server stops.
+#
+
+#importing packages for standard mathematical and data operations
+import numpy as np
+
+#importing packages for serialization, sockets and parallel processing
+import base64
+import json
+import socket
+import socketserver
+import threading
+import time
+import collections
+from concurrent.futures import ProcessPoolExecutor
+
+#importing packages supporting filesystem path walking
+import os
+
+#importing functions from custom modules
+from image_processing import find_events_in_file, MIN_STREAK_AREA
+from thresholds import DEFAULT_THRESHOLD_STRATEGY
+from instrumentation import count
+
+#constants and default values
+
+#number of latest requests whose latencies are kept for percentiles
+LATENCY_WINDOW = 10000
+
+#percentiles of latency reported by the server
+LATENCY_PERCENTILES = (50, 90, 99)
+
+#maximal length of a request line, in bytes; raw frames are sent in a single line
+MAX_REQUEST_BYTES = 256 << 20
+
+#settings of detection in the worker process, set by init_worker
+_settings = None
+
+
+'''
+The function prepares a worker process: stores settings of detection and processes a small synthetic frame, written
+to a temporary PNG file so the image decoder is loaded too, so modules used by detection are imported and initialized
+before the first request
+
+Arguments:
+  settings - dict with keyword arguments of find_events_in_file: 'threshold_strategy', 'min_area', 'tile_size',
+  'raw_format', 'prescreen' and 'background'
+'''
+def init_worker(settings):
+    global _settings
+    _settings = settings
+    from skimage import io
+    import tempfile
+    import signal
+
+    #Ctrl-C in the terminal reaches workers too; the server stops them itself
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    frame = np.zeros((64, 64), dtype=np.uint16)
+    frame[30:33, 10:50] = 1000
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'warmup.png')
+        io.imsave(path, frame, check_contrast=False)
+        find_events_in_file(path, **dict(settings, render=False, background=None))
+
+
+'''
+The function describes regions of a file result as a list of dicts
+
+Arguments:
+  file_result - dict returned by find_events_in_file
+  profiles - whether brightness profiles should be included
+
+Returns:
+  list of dicts, one for each region
+'''
+def describe_regions(file_result, profiles=False):
+    regions = []
+    for i in range(len(file_result['lengths'])):
+        region = {'label': file_result['labels'][i],
+                  'area': file_result['areas'][i],
+                  'length': file_result['lengths'][i],
+                  'minor_length': file_result['minor_lengths'][i],
+                  'orientation': file_result['orientations'][i],
+                  'centroid': file_result['centroids'][i],
+                  'bbox': file_result['bboxes'][i]}
+        if profiles:
+            region['profile'] = file_result['profiles'][i]
+        regions.append(region)
+    return regions
+
+
+'''
+The function detects streaks in the frame of a request, in a worker process
+
+Arguments:
+  request - dict decoded from the request line, with 'path' or 'raw', 'shape' and 'dtype'
+
+Returns:
+  dict with the response, without 'id' and 'latency_ms'
+'''
+def detect_frame(request):
+    settings = dict(_settings, render=False)
+    if 'path' in request:
+        file_result = find_events_in_file(request['path'], **settings)
+    else:
+        image = np.frombuffer(base64.b64decode(request['raw']), dtype=np.dtype(request['dtype']))
+        image = image.reshape(request['shape'])
+        file_result = find_events_in_file(request.get('name', 'buffer'), **dict(settings, image=image))
+    count_streaks = len(file_result['lengths'])
+    return {'filename': file_result['filename'], 'streak': count_streaks > 0, 'count': count_streaks,
+            'regions': describe_regions(file_result, request.get('profiles', False))}
+
+
+'''
+Recorder of latencies of requests, keeping the latest LATENCY_WINDOW of them
+'''
+class LatencyRecorder:
+    def __init__(self, window=LATENCY_WINDOW):
+        self.latencies = collections.deque(maxlen=window)
+        self.total = 0
+        self.errors = 0
+        self.lock = threading.Lock()
+
+    '''
+    The method records latency of a request
+
+    Arguments:
+      seconds - latency of the request
+      error - whether the request failed
+    '''
+    def record(self, seconds, error=False):
+        with self.lock:
+            self.latencies.append(seconds)
+            self.total += 1
+            if error:
+                self.errors += 1
+
+    '''
+    The method returns statistics of latencies
+
+    Returns:
+      dict with number of 'requests' and 'errors', and latency percentiles in milliseconds, e.g. 'p50_ms'
+    '''
+    def summary(self):
+        with self.lock:
+            latencies = np.array(self.latencies, dtype=np.float64) * 1000
+            summary = {'requests': self.total, 'errors': self.errors}
+        for p in LATENCY_PERCENTILES:
+            summary['p%d_ms' % p] = float(np.percentile(latencies, p)) if len(latencies) else None
+        return summary
+
+
+'''
+Handler of one connection: reads request lines and writes response lines, in order
+'''
+class DetectionRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        while True:
+            line = self.rfile.readline(MAX_REQUEST_BYTES)
+            if not line:
+                return
+            received = time.perf_counter()
+            if len(line) >= MAX_REQUEST_BYTES and not line.endswith(b'\n'):
+                #the rest of the line cannot be told from the next request, so the connection is closed
+                count('requests_failed')
+                self.server.latency.record(time.perf_counter() - received, True)
+                self.send({'id': None, 'error': 'request longer than %d bytes' % MAX_REQUEST_BYTES})
+                return
+            response, error = self.server.respond(line)
+            latency = time.perf_counter() - received
+            if 'op' not in response:
+                response['latency_ms'] = latency * 1000
+                self.server.latency.record(latency, error)
+            else:
+                del response['op']
+            if not self.send(response):
+                return
+
+    '''
+    The method writes a response line
+
+    Arguments:
+      response - dict of the response
+
+    Returns:
+      False if the client has closed the connection, True otherwise
+    '''
+    def send(self, response):
+        try:
+            self.wfile.write((json.dumps(response) + '\n').encode('utf-8'))
+            self.wfile.flush()
+            return True
+        except (BrokenPipeError, ConnectionResetError):
+            return False
+
+
+'''
+Functionality shared by servers on Unix socket and on TCP port: the worker pool and answering requests
+'''
+class DetectionServerMixin:
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def start_workers(self, workers, settings):
+        self.pool = ProcessPoolExecutor(max(workers, 1), initializer=init_worker, initargs=(settings,))
+        #workers are started and warmed up before the first request
+        for future in [self.pool.submit(time.sleep, 0) for _ in range(max(workers, 1))]:
+            future.result()
+        self.latency = LatencyRecorder()
+
+    '''
+    The method answers one request line
+
+    Arguments:
+      line - bytes of the request line
+
+    Returns:
+      response dict, and whether the request failed
+    '''
+    def respond(self, line):
+        request_id = None
+        try:
+            request = json.loads(line)
+            request_id = request.get('id')
+            op = request.get('op', 'detect')
+            if op == 'ping':
+                return {'id': request_id, 'op': op, 'ok': True}, False
+            if op == 'stats':
+                return dict(self.latency.summary(), id=request_id, op=op), False
+            if op != 'detect' or ('path' not in request and 'raw' not in request):
+                raise ValueError('request should have "path" or "raw", or "op" equal to "ping" or "stats"')
+            response = self.pool.submit(detect_frame, request).result()
+            count('frames_served')
+            return dict(response, id=request_id), False
+        except Exception as e:
+            count('requests_failed')
+            return {'id': request_id, 'error': type(e).__name__ + ': ' + str(e)}, True
+
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown(wait=True)
+
+
+class UnixDetectionServer(DetectionServerMixin, socketserver.ThreadingUnixStreamServer):
+    pass
+
+
+class TcpDetectionServer(DetectionServerMixin, socketserver.ThreadingTCPServer):
+    pass
+
+
+'''
+The function creates the detection server with a warm pool of workers
+
+Arguments:
+  socket_path - path of the Unix domain socket; an existing socket file is replaced
+  port - port of localhost, used when socket_path is None
+  workers - number of worker processes
+  threshold_strategy - threshold specification, see thresholds.parse_threshold_spec
+  min_area - minimal area of region to be counted as streak
+  tile_size - if given, frames are processed in tiles of this size
+  raw_format - shape and type of pixels of raw files, see frame_readers.parse_raw_format
+  prescreen - 'exact' or 'fast' to reject frames without streaks early, None processes every frame
+  background - path of background model cached by a scan, None processes frames without correction
+
+Returns:
+  UnixDetectionServer or TcpDetectionServer, to be run with serve_forever
+'''
+def create_server(socket_path=None, port=None, workers=2, threshold_strategy=DEFAULT_THRESHOLD_STRATEGY,
+                  min_area=MIN_STREAK_AREA, tile_size=None, raw_format=None, prescreen=None, background=None):
+    settings = {'threshold_strategy': threshold_strategy, 'min_area': min_area, 'tile_size': tile_size,
+                'raw_format': raw_format, 'prescreen': prescreen, 'background': background}
+    if socket_path is not None:
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        server = UnixDetectionServer(socket_path, DetectionRequestHandler)
+    else:
+        server = TcpDetectionServer(('127.0.0.1', port), DetectionRequestHandler)
+    try:
+        server.start_workers(workers, settings)
+    except BaseException:
+        socketserver.BaseServer.server_close(server)
+        raise
+    return server
+
+
+'''
+Client of the detection server, sending requests over one connection
+
+Arguments:
+  socket_path - path of the Unix domain socket of the server
+  port - port of the server on localhost, used when socket_path is None
+'''
+class DetectionClient:
+    def __init__(self, socket_path=None, port=None):
+        if socket_path is not None:
+            self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.socket.connect(socket_path)
+        else:
+            self.socket = socket.create_connection(('127.0.0.1', port))
+        self.file = self.socket.makefile('rwb')
+        self.next_id = 0
+
+    '''
+    The method sends a request and waits for the response
+
+    Arguments:
+      request - dict of the request, 'id' is added when missing
+
+    Returns:
+      response dict
+    '''
+    def request(self, request):
+        if 'id' not in request:
+            request = dict(request, id=self.next_id)
+            self.next_id += 1
+        self.file.write((json.dumps(request) + '\n').encode('utf-8'))
+        self.file.flush()
+        return json.loads(self.file.readline())
+
+    '''
+    The method asks for detection in a frame file
+    '''
+    def detect(self, path, profiles=False):
+        return self.request({'path': path, 'profiles': profiles})
+
+    '''
+    The method asks for detection in a frame sent as array
+    '''
+    def detect_array(self, image, name='buffer', profiles=False):
+        image = np.ascontiguousarray(image)
+        return self.request({'raw': base64.b64encode(image.tobytes()).decode('ascii'), 'shape': list(image.shape),
+                             'dtype': image.dtype.str, 'name': name, 'profiles': profiles})
+
+    '''
+    The method asks for latency statistics of the server
+    '''
+    def stats(self):
+        return self.request({'op': 'stats'})
+
+    def close(self):
+        self.file.close()
+        self.socket.close()
+
+
+'''
+The function serves requests until the server is interrupted with SIGINT or SIGTERM, then stops workers, removes the
+socket file and prints latency percentiles of served requests
+
+Arguments:
+  server - server returned by create_server
+'''
+def run_server(server):
+    import signal
+
+    def stop(signum, frame):
+        #shutdown waits for serve_forever to return, so it is called from another thread
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, stop)
+    address = server.server_address
+    print('serving streak detection on ' + (address if isinstance(address, str) else '%s:%d' % address), flush=True)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if isinstance(address, str) and os.path.exists(address):
+            os.unlink(address)
+    summary = server.latency.summary()
+    print('served ' + str(summary['requests']) + ' requests (' + str(summary['errors']) + ' failed)' +
+          ''.join(', p%d %s' % (p, 'n/a' if summary['p%d_ms' % p] is None else '%.1f ms' % summary['p%d_ms' % p])
+                  for p in LATENCY_PERCENTILES))
@@ -0,0 +1,242 @@
+#
+# Module reading frames of different formats. Uncompressed formats are memory mapped, so the frame is not copied
+# into memory when it is read - pages are read from the file when thresholding or tiling reaches them:
+#
+#   .npy          - numpy array, memory mapped
+#   .raw          - raw binary data, memory mapped; shape and type of pixels are declared with a raw format
+#                   specification, e.g. '4096x4096:uint16' or '2048x2048:>u2:offset=512'
+#   .fits, .fit   - FITS primary image, memory mapped unless pixels are scaled with BZERO/BSCALE
+#   .png, .tif... - decoded with skimage.io.imread
+#
+
+#importing packages for standard mathematical and data operations
+import numpy as np
+
+#importing packages supporting filesystem path walking
+import os
+
+#constants and default values
+
+#extensions of files read by read_frame, in the order in which they are listed
+FRAME_EXTENSIONS = ('.png', '.tif', '.tiff', '.npy', '.raw', '.fits', '.fit')
+
+#extensions of files read only when raw format is declared
+RAW_EXTENSIONS = ('.raw',)
+
+#size of FITS header block and of a single header card, in bytes
+FITS_BLOCK_SIZE = 2880
+FITS_CARD_SIZE = 80
+
+#types of FITS pixels for BITPIX values; FITS data is big endian
+FITS_DTYPES = {8: np.dtype('u1'), 16: np.dtype('>i2'), 32: np.dtype('>i4'), 64: np.dtype('>i8'),
+               -32: np.dtype('>f4'), -64: np.dtype('>f8')}
+
+
+'''
+The function splits raw format specification into shape, type of pixels and offset of data in the file.
+Specification has form HEIGHTxWIDTH:DTYPE, optionally followed by :offset=BYTES
+
+Arguments:
+  spec - raw format specification
+
+Returns:
+  shape - tuple (height, width)
+  dtype - numpy dtype of pixels
+  offset - number of bytes preceding the pixels in the file
+'''
+def parse_raw_format(spec):
+    parts = spec.split(':')
+    if len(parts) not in (2, 3):
+        raise ValueError('raw format ' + repr(spec) + ' should have form HEIGHTxWIDTH:DTYPE[:offset=BYTES]')
+    try:
+        height, width = [int(x) for x in parts[0].lower().split('x')]
+    except ValueError:
+        raise ValueError('shape ' + repr(parts[0]) + ' in raw format ' + repr(spec) + ' should have form HEIGHTxWIDTH')
+    try:
+        dtype = np.dtype(parts[1])
+    except TypeError:
+        raise ValueError('unknown type of pixels ' + repr(parts[1]) + ' in raw format ' + repr(spec))
+    offset = 0
+    if len(parts) == 3:
+        name, _, value = parts[2].partition('=')
+        if name.strip() != 'offset' or not value.strip().isdigit():
+            raise ValueError('raw format parameter ' + repr(parts[2]) + ' should have form offset=BYTES')
+        offset = int(value)
+    return (height, width), dtype, offset
+
+
+'''
+The function reads .npy frame, memory mapped
+
+Arguments:
+  path - path of the file
+
+Returns:
+  2D array
+'''
+def read_npy(path):
+    frame = np.load(path, mmap_mode='r')
+    if frame.ndim != 2:
+        raise ValueError(path + ' holds array of ' + str(frame.ndim) + ' dimensions, expected a single frame')
+    return frame
+
+
+'''
+The function reads raw binary frame, memory mapped
+
+Arguments:
+  path - path of the file
+  raw_format - raw format specification, see parse_raw_format
+
+Returns:
+  2D array
+'''
+def read_raw(path, raw_format):
+    if raw_format is None:
+        raise ValueError('shape and type of pixels of raw frame ' + path + ' are not declared')
+    shape, dtype, offset = parse_raw_format(raw_format)
+    expected = offset + shape[0] * shape[1] * dtype.itemsize
+    if os.path.getsize(path) < expected:
+        raise ValueError(path + ' is smaller than frame of raw format ' + raw_format)
+    return np.memmap(path, dtype, 'r', offset, shape)
+
+
+'''
+The function reads header of FITS primary unit
+
+Arguments:
+  f - file opened in binary mode, at the beginning
+
+Returns:
+  header - dict where key - keyword, value - value as string
+  data_offset - position of data in the file
+'''
+def read_fits_header(f):
+    header = {}
+    offset = 0
+    while True:
+        block = f.read(FITS_BLOCK_SIZE)
+        if len(block) < FITS_BLOCK_SIZE:
+            raise ValueError('FITS header is not terminated with END')
+        offset += FITS_BLOCK_SIZE
+        for i in range(0, FITS_BLOCK_SIZE, FITS_CARD_SIZE):
+            card = block[i:i + FITS_CARD_SIZE].decode('ascii', 'replace')
+            keyword = card[:8].strip()
+            if keyword == 'END':
+                return header, offset
+            if card[8:10] == '= ':
+                header[keyword] = card[10:].split('/')[0].strip()
+
+
+'''
+The function reads primary image of FITS file. Pixels are memory mapped, unless they are scaled with BZERO or
+BSCALE; unsigned 16 bit pixels stored with BZERO = 32768 are converted to uint16
+
+Arguments:
+  path - path of the file
+
+Returns:
+  2D array
+'''
+def read_fits(path):
+    with open(path, 'rb') as f:
+        header, data_offset = read_fits_header(f)
+    if header.get('SIMPLE') != 'T' or int(header.get('NAXIS', 0)) != 2:
+        raise ValueError(path + ' is not a FITS file with a single frame')
+    dtype = FITS_DTYPES[int(header['BITPIX'])]
+    shape = (int(header['NAXIS2']), int(header['NAXIS1']))
+    frame = np.memmap(path, dtype, 'r', data_offset, shape)
+
+    bzero = float(header.get('BZERO', 0))
+    bscale = float(header.get('BSCALE', 1))
+    if bscale == 1 and bzero == 0:
+        return frame
+    if bscale == 1 and dtype == np.dtype('>i2') and bzero == 32768:
+        return (frame.view('>u2') ^ np.uint16(0x8000)).astype(np.uint16)
+    return frame * bscale + bzero
+
+
+'''
+The function reads frame with decoder of skimage, used for compressed formats like PNG and TIFF
+
+Arguments:
+  path - path of the file
+
+Returns:
+  2D array
+'''
+def read_decoded(path):
+    from skimage import io
+
+    return io.imread(path)
+
+
+'''
+The function reads frame with the reader matching extension of the file
+
+Arguments:
+  path - path of the file
+  raw_format - raw format specification, needed for .raw files
+
+Returns:
+  2D array, memory mapped for .npy, .raw and unscaled FITS files
+'''
+def read_frame(path, raw_format=None):
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.npy':
+        return read_npy(path)
+    if extension in RAW_EXTENSIONS:
+        return read_raw(path, raw_format)
+    if extension in ('.fits', '.fit'):
+        return read_fits(path)
+    return read_decoded(path)
+
+
+'''
+The function tells whether file is a frame which can be read
+
+Arguments:
+  path - path of the file
+  raw_format - raw format specification, raw files are frames only when it is given
+
+Returns:
+  bool
+'''
+def is_frame_file(path, raw_format=None):
+    extension = os.path.splitext(path)[1].lower()
+    if extension in RAW_EXTENSIONS:
+        return raw_format is not None
+    return extension in FRAME_EXTENSIONS
+
+
+'''
+The function lists frames in the catalog, i.e. files accepted by is_frame_file, so extensions are matched regardless
+of case, as in watch mode. Formats are listed in the order of FRAME_EXTENSIONS, files of each format in the order of
+the directory listing; hidden files are skipped
+
+Arguments:
+  catalog - directory to catalog containing images
+  raw_format - raw format specification, raw files are listed only when it is given
+
+Returns:
+  list of paths
+'''
+def list_frames(catalog, raw_format=None):
+    with os.scandir(catalog) as entries:
+        paths = [entry.path for entry in entries
+                 if not entry.name.startswith('.') and is_frame_file(entry.name, raw_format) and entry.is_file()]
+    order = {extension: index for index, extension in enumerate(FRAME_EXTENSIONS)}
+    return sorted(paths, key=lambda path: order[os.path.splitext(path)[1].lower()])
+
+
+'''
+The function returns name of the frame file without extension
+
+Arguments:
+  filename - name of the frame file
+
+Returns:
+  string
+'''
+def frame_name(filename):
+    return os.path.splitext(filename)[0]
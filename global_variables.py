@@ -10,3 +10,32 @@ DATA_LOCATION_CATALOG = '/home/ula/hackathon/obrazy'
 DATA_LOCATION_CATALOG = DATA_LOCATION_CATALOG.strip()
 DATA_LOCATION_CATALOG = DATA_LOCATION_CATALOG.strip(os.sep)
 DATA_LOCATION_CATALOG = os.sep + DATA_LOCATION_CATALOG
+
+#min size of streak to inspect
+MIN_STREAK_AREA = 100
+
+#name of output file with statistics of each image. The file is created in current location
+OUTPUT_FILENAME = 'analytics.txt'
+
+#name of file storing results of processed images. The file is created in current location
+CACHE_FILENAME = 'results_cache.jsonl'
+
+#base name of tables with one row per streak, extensions are added for each format. The files are created in current location
+TABLE_BASENAME = 'regions'
+
+#name of SQLite database indexing all found streaks. The file is created in current location
+INDEX_FILENAME = 'streaks.sqlite'
+
+#name of file caching the background and hot pixel model of frames. The file is created in current location
+BACKGROUND_FILENAME = 'background_model.npz'
+
+#name of partial result file written by a node scanning one shard of the catalog, formatted with index of the shard
+#and number of shards. The file is created in current location
+PARTIAL_FILENAME = 'partial_%d_of_%d.jsonl'
+
+#name of file listing images without streaks, written when partial results of shards are merged. The file is created
+#in current location
+NO_EVENTS_FILENAME = 'no_events.txt'
+
+#name of Unix domain socket on which the detection server listens. The socket is created in current location
+SERVER_SOCKET_FILENAME = 'smugi.sock'
@@ -4,95 +4,293 @@
 
 import numpy as np
 
-#importing packages used in image processing 
-from skimage import data
-from skimage.filters import threshold_otsu
-from skimage.segmentation import clear_border
-from skimage.measure import label, regionprops
-from skimage.morphology import closing, square, opening
-from skimage.color import label2rgb
-from skimage import data, io, filters, feature
-
+#packages used in image processing (skimage) are imported in the functions using them,
+#so importing this module, e.g. by the command line entry point, stays fast
 
 #importing packages supporting filesystem path walking
 import os
 
 #importing functions from custom modules
-from region_processing import draw_brightness_profile, draw_rotation_angle
-from global_variables import DATA_LOCATION_CATALOG
+from region_processing import region_render_record, render_records, extract_brightness_profiles
+from global_variables import DATA_LOCATION_CATALOG, MIN_STREAK_AREA
+from thresholds import compute_threshold, DEFAULT_THRESHOLD_STRATEGY
+from instrumentation import stage, count
+from tiling import find_regions_tiled
+from measurement import measure_regions, empty_regions
+from prescreen import prescreen_frame
+from frame_readers import read_frame, frame_name
+from background_model import load_background_model
 
 #constants
 
-#min size of streak to inspect
-MIN_STREAK_AREA = 100
 
 
+'''
+   The function reads image file with the reader matching its format, see frame_readers module
+
+   Arguments:
+     img_filename - string containing filename to read
+     raw_format - shape and type of pixels of raw files, see frame_readers.parse_raw_format
 
+   Returns:
+     array with pixels of the image, memory mapped for uncompressed formats
 '''
-   The function finds region containing streaks for imgage
+def read_image(img_filename, raw_format=None):
+  with stage('imread'):
+    image = read_frame(img_filename, raw_format)
+  count('bytes_read', os.path.getsize(img_filename))
+  count('frames_read')
+  return image
+
+
+'''
+   The function applies threshold to the image and closes small gaps in the resulting binary mask
 
    Arguments:
-     img-filename - string containing filename to inspect
+     image - array with pixels of the image
+     threshold_strategy - name of threshold strategy from thresholds module
+     thresh - threshold already computed with threshold_strategy, None computes it
 
    Returns:
-     list of RegionProperties objects 
+     binary mask of pixels brighter than the threshold
 '''
-def find_regions_in_file(img_filename):
-  image = io.imread(img_filename)
+def threshold_image(image, threshold_strategy=DEFAULT_THRESHOLD_STRATEGY, thresh=None):
+  from skimage.morphology import closing, square
+
   # apply threshold
-  #thresh = threshold_otsu(image)
+  with stage('threshold'):
+    if thresh is None:
+      thresh = compute_threshold(image, threshold_strategy)
+    bw = image > thresh
 
-  flat_image = np.ndarray.flatten(image)
+  with stage('closing'):
+    return closing(bw, square(3))
 
-  sorted_flat = np.sort(np.unique(flat_image))
 
-  thresh = sorted_flat[-1]*0.085
+'''
+   The function labels connected regions of binary mask, skipping the ones touching image border
+
+   Arguments:
+     bw - binary mask returned by threshold_image
 
-  bw = closing(image > thresh, square(3))
+   Returns:
+     array of region labels, 0 marks background
+'''
+def label_image(bw):
+  from skimage.segmentation import clear_border
+  from skimage.measure import label
 
   # remove artifacts connected to image border
-  cleared = clear_border(bw)
+  with stage('clear_border'):
+    cleared = clear_border(bw)
 
   # label image regions
-  labelled_regions = label(cleared)
-  return regionprops(labelled_regions)
+  with stage('label'):
+    return label(cleared)
+
+
+'''
+   The function finds region containing streaks for already decoded image
+
+   Arguments:
+     image - array with pixels of the image
+     threshold_strategy - name of threshold strategy from thresholds module
+     tile_size - if given, the image is processed in tiles of this size, see tiling module; regions are the same
+     min_area - minimal area of returned region; smaller regions are counted, but not measured
+     prescreen - 'exact' or 'fast' to reject frames without regions of min_area pixels before the full resolution
+     processing, see prescreen module; None processes every frame
+
+   Returns:
+     record array of regions, see measurement module, with fields named like properties of RegionProperties
+'''
+def find_regions_in_image(image, threshold_strategy=DEFAULT_THRESHOLD_STRATEGY, tile_size=None, min_area=0,
+                          prescreen=None):
+  return find_regions_prescreened(image, threshold_strategy, tile_size, min_area, prescreen)[0]
+
+
+'''
+   The function finds region containing streaks for already decoded image, like find_regions_in_image, telling also
+   whether the image was rejected by prescreening
+
+   Arguments:
+     as of find_regions_in_image
+
+   Returns:
+     record array of regions, see measurement module, and True if the image was rejected by prescreening, False if
+     it passed, None if it was not prescreened
+'''
+def find_regions_prescreened(image, threshold_strategy=DEFAULT_THRESHOLD_STRATEGY, tile_size=None, min_area=0,
+                             prescreen=None):
+  thresh = None
+  if tile_size is not None or prescreen is not None:
+    with stage('threshold'):
+      thresh = compute_threshold(image, threshold_strategy)
+
+  rejected = None
+  if prescreen is not None:
+    rejected = not prescreen_frame(image, thresh, min_area, prescreen)
+    if rejected:
+      return empty_regions(), rejected
+
+  if tile_size is not None:
+    return find_regions_tiled(image, thresh, tile_size, min_area), rejected
+
+  labelled_regions = label_image(threshold_image(image, threshold_strategy, thresh))
+  with stage('measure'):
+    return measure_regions(labelled_regions, min_area), rejected
 
 
 '''
+   The function finds region containing streaks for imgage
+
+   Arguments:
+     img-filename - string containing filename to inspect
+     threshold_strategy - name of threshold strategy from thresholds module
+     tile_size - if given, the image is processed in tiles of this size
+     raw_format - shape and type of pixels of raw files
 
-The function does all region processing for single image from catalog: it iterates over each found region containing streak
-and updates global statistics. It also adds the filename to correct array, so it can be processed according to whether there
-have been any events in this file
+   Returns:
+     record array of regions, see measurement module
+'''
+def find_regions_in_file(img_filename, threshold_strategy=DEFAULT_THRESHOLD_STRATEGY, tile_size=None, raw_format=None):
+  return find_regions_in_image(read_image(img_filename, raw_format), threshold_strategy, tile_size)
+
+
+'''
+
+The function describes streaks found in a single image file, in the form merged into global statistics
+by merge_file_result and stored in the result cache
+
+Arguments:
+  filename - base name of the image file
+  streaks - record array of regions large enough to be streaks, see measurement module
+  profiles - list of brightness profiles of these regions
+Returns:
+  dict with the following keys, each list holding one value per streak, in the order in which they were found:
+    'filename' - base name of the image file
+    'lengths' - list of lengths (major axis lengths) of streaks
+    'areas' - list of areas of these streaks, in pixels
+    'orientations' - list of orientations of these streaks, in radians
+    'labels' - list of labels of the regions in the labelled image
+    'bboxes' - list of bounding boxes (min_row, min_col, max_row, max_col)
+    'centroids' - list of centroids (row, col)
+    'minor_lengths' - list of minor axis lengths
+    'profiles' - list of brightness profiles, as lists of floats
+
+'''
+def describe_streaks(filename, streaks, profiles):
+  return {'filename': filename,
+          'lengths': streaks.major_axis_length.tolist(),
+          'areas': streaks.area.tolist(),
+          'orientations': streaks.orientation.tolist(),
+          'labels': streaks.label.tolist(),
+          'bboxes': streaks.bbox.tolist(),
+          'centroids': streaks.centroid.tolist(),
+          'minor_lengths': streaks.minor_axis_length.tolist(),
+          'profiles': [profile.tolist() for profile in profiles]}
+
+
+'''
+
+The function does all region processing for single image from catalog, without touching any statistics shared
+between files. It can therefore be run in a separate worker process, with its result merged afterwards by
+merge_file_result
 
 Arguments:
   img_filename - the name of image filename
-  streak_length_array - array of streak lengths that have been found
-  filename_for_strk_length - dict of filenames for streak lengths
-  file_stats_dict - doct of statistics of regions for each filename
-  events - array of filenames with identified events
-  no_events - array of filenames, for which no events have been found
+  threshold_strategy - name of threshold strategy from thresholds module
+  render - whether data needed to draw plots of the streaks should be recorded
+  min_area - minimal area of region to be counted as streak
+  tile_size - if given, the image is processed in tiles of this size
+  raw_format - shape and type of pixels of raw files
+  prescreen - 'exact' or 'fast' to reject frames without streaks early, None processes every frame at full resolution
+  background - path of background model cached by background_model.prepare_background_model; the background is
+  subtracted and hot pixels are masked before thresholding; brightness profiles are taken from the original image
+  image - pixels of the image already read, e.g. by prefetch.FramePrefetcher; None reads img_filename
 Returns:
-  void
+  dict returned by describe_streaks, with additional key:
+    'render_records' - list of dicts returned by region_render_record, to be drawn by the rendering stage;
+    empty when render is False
+    'prescreen_rejected' - True if the image was rejected by prescreening, False if it passed, None if it was not
+    prescreened
 
 '''
-def process_regions_for_file(img_filename, streak_length_array, filename_for_strk_length, file_stats_dict, events, no_events):
-  image = io.imread(img_filename)
+def find_events_in_file(img_filename, threshold_strategy=DEFAULT_THRESHOLD_STRATEGY, render=True, min_area=MIN_STREAK_AREA,
+                        tile_size=None, raw_format=None, prescreen=None, background=None, image=None):
+  if image is None:
+    image = read_image(img_filename, raw_format)
   filename = os.path.basename(img_filename)     
-  regions_found = find_regions_in_file(img_filename)
-  counter = 0 
-  for region in regions_found:
-    #only take regions with large enough areas
-    if region.area >= MIN_STREAK_AREA:
-      l = region.major_axis_length
-      streak_length_array.append(l)
-      counter += 1
-      filename_for_strk_length[l] = filename
-      draw_brightness_profile(image, region, filename.replace('.png', ''), counter)
-      draw_rotation_angle(image, region, filename.replace('.png', ''), counter)
-
-      file_stats_dict[filename] = [counter, 0, 0]        
-            
-  if counter > 0:
-    events += [filename]
-  else:
-    no_events += [filename]
+  detected = image
+  if background is not None:
+    model = load_background_model(background)
+    #frames of other size than the model are processed without correction
+    if model.shape == image.shape:
+      detected = model.correct(image)
+  #only take regions with large enough areas
+  streaks, rejected = find_regions_prescreened(detected, threshold_strategy, tile_size, min_area, prescreen)
+  file_result = describe_image_events(image, filename, streaks, render)
+  file_result['prescreen_rejected'] = rejected
+  return file_result
+
+
+'''
+
+The function describes streaks found in an image, with their brightness profiles and, if needed, data recorded
+for rendering
+
+Arguments:
+  image - array with pixels of the image, profiles are taken from it
+  filename - base name of the image file
+  streaks - record array of regions large enough to be streaks, see measurement module
+  render - whether data needed to draw plots of the streaks should be recorded
+Returns:
+  dict returned by find_events_in_file
+
+'''
+def describe_image_events(image, filename, streaks, render=True):
+  count('regions_kept', len(streaks))
+  profiles = extract_brightness_profiles(image, streaks)
+
+  records = []
+  if render:
+    for index, (region, profile) in enumerate(zip(streaks, profiles), 1):
+      records.append(region_render_record(image, region, frame_name(filename), index, profile))
+
+  file_result = describe_streaks(filename, streaks, profiles)
+  file_result['render_records'] = records
+  return file_result
+
+
+'''
+
+The function merges result of find_events_in_file into results of the scan. The file gets its id, and its streaks
+are appended, so it can be processed according to whether there have been any events in this file
+
+Arguments:
+  file_result - dict returned by find_events_in_file
+  results - results.ScanResults of the scan
+Returns:
+  void
+
+'''
+def merge_file_result(file_result, results):
+  results.add_file(file_result)
+
+
+'''
+
+The function does all region processing for single image from catalog: it iterates over each found region containing streak,
+draws its plots and adds the image with its streaks to results of the scan
+
+Arguments:
+  img_filename - the name of image filename
+  results - results.ScanResults of the scan
+  threshold_strategy - name of threshold strategy from thresholds module
+Returns:
+  void
+
+'''
+def process_regions_for_file(img_filename, results, threshold_strategy=DEFAULT_THRESHOLD_STRATEGY):
+  file_result = find_events_in_file(img_filename, threshold_strategy)
+  render_records(file_result['render_records'])
+  merge_file_result(file_result, results)
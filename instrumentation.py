@@ -0,0 +1,217 @@
+#
+# Module with timing and counter instrumentation of detection stages.
+#
+# Stages are wrapped with
+#
+#   with stage('label'):
+#       ...
+#
+# which records number of calls, wall time and CPU time (of the calling thread) of the stage, and
+# count('regions_found', n) adds to a named counter. Instrumentation is disabled by default; then stage() returns
+# a shared object doing nothing and count() returns immediately, so the cost is a function call.
+# Worker processes have their own records; snapshot() returns them so they can be merged into the parent with merge().
+#
+
+#importing packages for timing and output formats
+import json
+import threading
+import time
+
+#constants and default values
+
+#prefix of metric names in Prometheus text format
+PROMETHEUS_PREFIX = 'smugi'
+
+#whether instrumentation is enabled in this process
+ENABLED = False
+
+#dict where key - stage name, value - list: number of calls, total wall time, total CPU time
+_stages = {}
+
+#dict where key - counter name, value - total
+_counters = {}
+
+_lock = threading.Lock()
+
+
+'''
+Context manager used when instrumentation is disabled
+'''
+class _NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+'''
+Context manager measuring single execution of a stage
+'''
+class _StageTimer:
+    __slots__ = ('name', 'wall', 'cpu')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.wall = time.perf_counter()
+        self.cpu = time.thread_time()
+        return self
+
+    def __exit__(self, *exc):
+        wall = time.perf_counter() - self.wall
+        cpu = time.thread_time() - self.cpu
+        with _lock:
+            record = _stages.get(self.name)
+            if record is None:
+                _stages[self.name] = [1, wall, cpu]
+            else:
+                record[0] += 1
+                record[1] += wall
+                record[2] += cpu
+        return False
+
+
+'''
+The function enables instrumentation in the current process
+'''
+def enable():
+    global ENABLED
+    ENABLED = True
+
+
+'''
+The function disables instrumentation in the current process
+'''
+def disable():
+    global ENABLED
+    ENABLED = False
+
+
+'''
+The function clears all recorded stages and counters
+'''
+def reset():
+    with _lock:
+        _stages.clear()
+        _counters.clear()
+
+
+'''
+The function returns context manager measuring a stage
+
+Arguments:
+  name - name of the stage
+
+Returns:
+  context manager
+'''
+def stage(name):
+    if not ENABLED:
+        return _NULL_STAGE
+    return _StageTimer(name)
+
+
+'''
+The function adds value to a counter
+
+Arguments:
+  name - name of the counter
+  value - number added to the counter
+'''
+def count(name, value=1):
+    if not ENABLED:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+'''
+The function returns copy of recorded stages and counters, e.g. to be sent from a worker process to the parent
+
+Returns:
+  dict with keys 'stages' and 'counters'
+'''
+def snapshot():
+    with _lock:
+        return {'stages': {name: list(record) for name, record in _stages.items()}, 'counters': dict(_counters)}
+
+
+'''
+The function adds stages and counters recorded elsewhere (e.g. in a worker process) to the records of this process
+
+Arguments:
+  other - dict returned by snapshot
+'''
+def merge(other):
+    with _lock:
+        for name, (calls, wall, cpu) in other['stages'].items():
+            record = _stages.setdefault(name, [0, 0., 0.])
+            record[0] += calls
+            record[1] += wall
+            record[2] += cpu
+        for name, value in other['counters'].items():
+            _counters[name] = _counters.get(name, 0) + value
+
+
+'''
+The function formats recorded stages and counters as a table, stages sorted by total wall time
+
+Returns:
+  string with the table
+'''
+def summary_table():
+    data = snapshot()
+    lines = ['%-22s %8s %12s %12s %12s' % ('stage', 'calls', 'wall [s]', 'cpu [s]', 'mean [ms]')]
+    for name, (calls, wall, cpu) in sorted(data['stages'].items(), key=lambda item: -item[1][1]):
+        lines.append('%-22s %8d %12.3f %12.3f %12.3f' % (name, calls, wall, cpu, 1000. * wall / calls))
+    if data['counters']:
+        lines.append('')
+        lines.append('%-22s %12s' % ('counter', 'value'))
+        for name, value in sorted(data['counters'].items()):
+            lines.append('%-22s %12d' % (name, value))
+    return '\n'.join(lines)
+
+
+'''
+The function formats recorded stages and counters in Prometheus text exposition format
+
+Returns:
+  string with metrics
+'''
+def prometheus_text():
+    data = snapshot()
+    lines = []
+    for metric, index, help_text in [('stage_calls_total', 0, 'Number of executions of the stage'),
+                                     ('stage_wall_seconds_total', 1, 'Wall time spent in the stage'),
+                                     ('stage_cpu_seconds_total', 2, 'CPU time spent in the stage')]:
+        name = PROMETHEUS_PREFIX + '_' + metric
+        lines.append('# HELP ' + name + ' ' + help_text)
+        lines.append('# TYPE ' + name + ' counter')
+        for stage_name, record in sorted(data['stages'].items()):
+            lines.append('%s{stage="%s"} %r' % (name, stage_name, record[index]))
+    for counter_name, value in sorted(data['counters'].items()):
+        name = PROMETHEUS_PREFIX + '_' + counter_name + '_total'
+        lines.append('# TYPE ' + name + ' counter')
+        lines.append('%s %r' % (name, value))
+    return '\n'.join(lines) + '\n'
+
+
+'''
+The function writes recorded stages and counters to files
+
+Arguments:
+  json_filename - path of JSON file, None skips it
+  prometheus_filename - path of file in Prometheus text format, None skips it
+'''
+def write_report(json_filename=None, prometheus_filename=None):
+    if json_filename is not None:
+        with open(json_filename, 'w') as f:
+            json.dump(snapshot(), f, indent=2, sort_keys=True)
+    if prometheus_filename is not None:
+        with open(prometheus_filename, 'w') as f:
+            f.write(prometheus_text())
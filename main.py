@@ -1,61 +1,343 @@
+#importing packages for parallel processing
+import functools
+import multiprocessing
+
 #importing packages supporting filesystem path walking
-import glob
+import os
 
 #importing functions from custom modules
-from image_processing import find_regions_in_file, process_regions_for_file
-from global_variables import DATA_LOCATION_CATALOG
-from postprocessing import sort_event_outliers, sort_files
+from image_processing import find_events_in_file, merge_file_result, read_image, MIN_STREAK_AREA
+from global_variables import OUTPUT_FILENAME
+from postprocessing import sort_event_outliers, write_analytics
+from results import ScanResults
+from thresholds import DEFAULT_THRESHOLD_STRATEGY
+from result_cache import ResultCache, find_events_with_key, find_stack_events_with_keys, file_key
+from region_processing import RenderPool, default_profiles_root
+from results_table import RegionTableWriter, DEFAULT_TABLE_FORMATS
+from streak_index import StreakIndexWriter, frame_timestamp
+from frame_readers import list_frames, read_frame
+from prefetch import FramePrefetcher, AsyncWriter, DEFAULT_PREFETCH_DEPTH, DEFAULT_PREFETCH_BUDGET
+from background_model import prepare_background_model
+from sharding import select_shard, default_partial_filename, PartialResultWriter
+from stack_processing import find_events_in_stack, TrackLinker
+from prescreen import record_prescreen
+import instrumentation
+from instrumentation import stage
 
 #constants and default values
 
 #name of output file. The file is created in current location
-output_filename = 'analytics.txt'
+output_filename = OUTPUT_FILENAME
+
+#number of files handed to a worker process at once, per worker, in parallel mode
+FILES_PER_WORKER_CHUNK = 4
+
+
+'''
+The function processes files one by one, each given together with the flag telling whether its plots should be
+rendered. With prefetching, the next files are read by a FramePrefetcher while the current one is processed.
+With stack_size above 1, consecutive files are processed together as stacks of stack_size frames
+
+Arguments:
+  tasks - list of tuples of image filename and render flag
+  find_events - find_events_in_file or find_events_with_key, with threshold strategy and minimal area bound;
+  with stack_size above 1, find_events_in_stack or find_stack_events_with_keys
+  prefetch - dict with 'depth', 'memory_budget', 'raw_format' and 'key' of the FramePrefetcher, None reads each
+  file when it is processed; frames of stacks are read together, without prefetching. With a key function, keys
+  taken before the files are read are passed to find_events_with_key
+  stack_size - number of files processed as one stack
+
+Returns:
+  generator of results of find_events, in the order of tasks
+'''
+def process_tasks(tasks, find_events, prefetch=None, stack_size=1):
+    if stack_size > 1:
+        for start in range(0, len(tasks), stack_size):
+            stack_tasks = tasks[start:start + stack_size]
+            for result in find_events([img_filename for img_filename, _ in stack_tasks],
+                                      render_flags=[render for _, render in stack_tasks]):
+                yield result
+        return
+    if prefetch is None:
+        for img_filename, render in tasks:
+            yield find_events(img_filename, render=render)
+        return
+    read = functools.partial(read_image, raw_format=prefetch['raw_format'])
+    frames = FramePrefetcher([img_filename for img_filename, _ in tasks], read, prefetch['depth'],
+                             prefetch['memory_budget'], key=prefetch['key'])
+    for (img_filename, image, key), (_, render) in zip(frames, tasks):
+        if key is None:
+            yield find_events(img_filename, render=render, image=image)
+        else:
+            yield find_events(img_filename, render=render, image=image, key=key)
 
 
 '''
-The function iterates over all image files in catalog, identifies streaks and prepares analytics file containing info about event statistics for each file
+The function processes a chunk of files in a worker process
+
+Arguments:
+  tasks - list of tuples of image filename and render flag
+  find_events - find_events_in_file or find_events_with_key, with threshold strategy and minimal area bound
+  instrument - whether stages should be measured in this (worker) process and returned
+  prefetch - settings of prefetching within the chunk, see process_tasks
+  stack_size - number of files processed as one stack, see process_tasks
+
+Returns:
+  list of results of find_events, and snapshot of measured stages (None if instrument is False)
+'''
+def process_chunk(tasks, find_events, instrument=False, prefetch=None, stack_size=1):
+    if not instrument:
+        return list(process_tasks(tasks, find_events, prefetch, stack_size)), None
+    instrumentation.enable()
+    instrumentation.reset()
+    results = list(process_tasks(tasks, find_events, prefetch, stack_size))
+    return results, instrumentation.snapshot()
+
+
+'''
+The function processes image files, serially or in a pool of processes, stores their results in the cache and
+passes data recorded for rendering to the render pool
+
+Arguments:
+  img_filenames - list of image files to process
+  render_flags - list telling, for each file, whether its plots should be rendered
+  workers - number of worker processes used to process the files, 1 means serial processing
+  threshold_strategy - threshold specification, see thresholds.parse_threshold_spec
+  cache - ResultCache where results are stored, or None
+  render_pool - RenderPool drawing plots, or None
+  min_area - minimal area of region to be counted as streak
+  tile_size - if given, images are processed in tiles of this size
+  raw_format - shape and type of pixels of raw files, see frame_readers.parse_raw_format
+  prescreen - 'exact' or 'fast' to reject frames without streaks early, None processes every frame
+  background - path of cached background model, None processes frames without correction
+  prefetch_depth - number of files read ahead of the processed one, in each worker; 0 disables prefetching
+  prefetch_memory - memory, in bytes, of decoded images read ahead, in each worker
+  stack_size - number of consecutive files processed as one stack, see stack_processing module; 1 processes files
+  one by one
+
+Returns:
+  generator of file results, in the order of img_filenames
+'''
+def process_files(img_filenames, render_flags, workers, threshold_strategy, cache, render_pool, min_area=MIN_STREAK_AREA,
+                  tile_size=None, raw_format=None, prescreen=None, background=None,
+                  prefetch_depth=DEFAULT_PREFETCH_DEPTH, prefetch_memory=DEFAULT_PREFETCH_BUDGET, stack_size=1):
+    if stack_size > 1:
+        find_events = find_stack_events_with_keys if cache is not None else find_events_in_stack
+        find_events = functools.partial(find_events, threshold_strategy=threshold_strategy, min_area=min_area,
+                                        raw_format=raw_format, background=background)
+    else:
+        find_events = find_events_with_key if cache is not None else find_events_in_file
+        find_events = functools.partial(find_events, threshold_strategy=threshold_strategy, min_area=min_area,
+                                        tile_size=tile_size, raw_format=raw_format, prescreen=prescreen,
+                                        background=background)
+    tasks = list(zip(img_filenames, render_flags))
+    prefetch = None
+    if prefetch_depth > 0:
+        #with a cache, keys of files are taken by the reading threads, before the files are read
+        prefetch = {'depth': prefetch_depth, 'memory_budget': prefetch_memory, 'raw_format': raw_format,
+                    'key': file_key if cache is not None else None}
+
+    if workers > 1:
+        #each worker gets chunks of consecutive files, and prefetches files of its chunk; chunks hold whole stacks
+        chunksize = max(1, len(tasks) // (workers * FILES_PER_WORKER_CHUNK * stack_size)) * stack_size
+        chunks = [tasks[i:i + chunksize] for i in range(0, len(tasks), chunksize)]
+        process = functools.partial(process_chunk, find_events=find_events, instrument=instrumentation.ENABLED,
+                                    prefetch=prefetch, stack_size=stack_size)
+        pool = multiprocessing.Pool(workers)
+        #imap returns results in the order of img_filenames, whatever the order of completion
+        results = (result for chunk_results, metrics in pool.imap(process, chunks)
+                   for result in merged_results(chunk_results, metrics))
+    else:
+        pool = None
+        results = process_tasks(tasks, find_events, prefetch, stack_size)
+
+    #results are written to the cache in a background thread
+    writer = AsyncWriter() if cache is not None else None
+    try:
+        for result in results:
+            if cache is not None:
+                file_result, key = result
+            else:
+                file_result = result
+            records = file_result.pop('render_records')
+            #results of stacks are not prescreened
+            record_prescreen(file_result.pop('prescreen_rejected', None))
+            if render_pool is not None:
+                render_pool.submit(records)
+            if writer is not None:
+                writer.submit(cache.store, key, file_result)
+            yield file_result
+    finally:
+        if pool is not None:
+            pool.terminate()
+        if writer is not None:
+            writer.close()
+
+
+'''
+The function merges stages measured by a worker process and returns results of its chunk
+
+Arguments:
+  results - list of results of a chunk
+  metrics - snapshot of measured stages, or None
+
+Returns:
+  the results
+'''
+def merged_results(results, metrics):
+    if metrics is not None:
+        instrumentation.merge(metrics)
+    return results
+
+
+'''
+The function iterates over all image files in catalog, identifies streaks and prepares analytics file containing info about event statistics for each file.
+With more than one worker the files are processed in a pool of processes; per-file results are merged in the original file order,
+so the output is identical to the one of a serial run. With a cache, files already processed in previous (also interrupted) runs
+are not processed again - their stored results are merged instead. Plots of streaks are drawn by a separate pool of
+rendering processes, from data recorded during detection. Data of each streak is written to columnar tables
 
 Arguments:
   catalog - directory to catalog containing images
-  output_filename - name of file where the statistics should be saved 
+  output_filename - name of file where the statistics should be saved
+  workers - number of worker processes used to process the files, 1 means serial processing
+  threshold_strategy - threshold specification, see thresholds.parse_threshold_spec
+  cache_filename - path to file storing results of processed files, None disables the cache
+  plots - whether plots of streaks should be drawn
+  plots_sample - plots are drawn only for every plots_sample-th image of the catalog
+  render_workers - number of rendering processes
+  table_basename - path of tables with one row per streak, without extension; None disables the tables
+  table_formats - formats of the tables, any of 'npz', 'csv' and 'parquet'
+  min_area - minimal area of region to be counted as streak
+  profiles_root - directory where plots are saved, None means default_profiles_root(catalog)
+  tile_size - if given, images are processed in tiles of this size, with the same results; it limits memory
+  used for very large images
+  raw_format - shape and type of pixels of raw files, see frame_readers.parse_raw_format; raw files are processed
+  only when it is given
+  prescreen - 'exact' to reject frames without streaks before the full resolution processing, with the same results;
+  'fast' to reject more frames, possibly missing streaks, see prescreen module; None processes every frame
+  artifact_mode - how plots are saved: 'plots' (PNG files of each streak), 'sheet' (one contact sheet of each image)
+  or 'store' (chunked arrays of all streaks, not drawn), see region_processing.ARTIFACT_MODES
+  index_filename - path of SQLite database where streaks of all processed files are indexed, see streak_index
+  module; None disables the index. With shard, it is not written: the index of all shards is written when their
+  partial results are merged
+  background_filename - path of file caching the background and hot pixel model, built or updated with frames of
+  the catalog before they are processed, see background_model module; None processes frames without correction
+  prefetch_depth - number of images read ahead of the processed one, in each worker; 0 disables prefetching
+  prefetch_memory - memory, in bytes, of decoded images read ahead, in each worker
+  shard - tuple (index, shards) to process only one shard of the catalog, e.g. on one of several nodes, see
+  sharding module; instead of statistics and tables, results are written to the partial result file, to be
+  merged with the other shards by sharding.merge_partials. None processes the whole catalog
+  partial_filename - with shard, path of the partial result file, None means sharding.default_partial_filename
+  stack_size - number of consecutive images processed as one stack, see stack_processing module; 1 processes
+  images one by one
+  tracks_filename - path of file where streaks of consecutive images are linked into tracks, see
+  stack_processing.TrackLinker; None does not link them. With stacks or tracks, images are processed in the order of
+  their names
 
 Returns:
   events - list of filenames where streaks have been found
   no_events - list of filenames with no streaks
 '''
-def find_and_classify_events(catalog, output_filename):
-    no_events = []
-    events = []
-    #array storing streak lengths
-    streak_length_array = [] 
+def find_and_classify_events(catalog, output_filename, workers=1, threshold_strategy=DEFAULT_THRESHOLD_STRATEGY,
+                             cache_filename=None, plots=True, plots_sample=1, render_workers=1,
+                             table_basename=None, table_formats=DEFAULT_TABLE_FORMATS, min_area=MIN_STREAK_AREA,
+                             profiles_root=None, tile_size=None, raw_format=None, prescreen=None,
+                             artifact_mode='plots', index_filename=None, background_filename=None,
+                             prefetch_depth=DEFAULT_PREFETCH_DEPTH, prefetch_memory=DEFAULT_PREFETCH_BUDGET,
+                             shard=None, partial_filename=None, stack_size=1, tracks_filename=None):
+    #file summaries, rows of streaks and statistics of streak lengths, updated while files are merged
+    results = ScanResults()
+
+    img_filenames = list_frames(catalog, raw_format)
+    if shard is not None:
+        img_filenames = select_shard(img_filenames, shard)
+    if stack_size > 1 or tracks_filename is not None:
+        #consecutive exposures are named in the order of time
+        img_filenames.sort()
 
-    #dict where key - original filename, value - array, where the following numbers are stored:
-    #at index 0 - total identified regions
-    #at index 1 - total of statistically too short streaks
-    #at index 2 - total of statistically too long streaks
-    file_stats_dict = {}
-    
-    #dict where key - length of streak, value - names of file containing streak of such length
-    filename_for_strk_length = {}
+    background = None
+    if background_filename is not None:
+        model = prepare_background_model(background_filename, img_filenames,
+                                         lambda f: read_frame(f, raw_format))
+        background = background_filename if model is not None else None
 
-    with open(output_filename, 'w') as output:
-        for img_filename in glob.glob(catalog+'/*.png'):
-           process_regions_for_file(img_filename, streak_length_array, filename_for_strk_length, 
-file_stats_dict, events, no_events)                       
-        sort_event_outliers(streak_length_array, file_stats_dict, filename_for_strk_length)
-	
-        output.write("filename | total streaks | short streaks | long streaks\n")
+    settings = {'threshold_strategy': threshold_strategy, 'min_area': min_area, 'raw_format': raw_format}
+    #exact prescreening does not change results, so results stored with and without it are interchangeable
+    if prescreen == 'fast':
+        settings['prescreen'] = prescreen
+    if background is not None:
+        settings['background'] = True
+    #stored results are computed again when the background model is rebuilt or updated; shards build their own
+    #models, so the model is not part of the settings compared when partial results are merged
+    cache_settings = dict(settings)
+    if background is not None:
+        cache_settings['background_model'] = model.digest
+    #thresholds built from histograms depend on all frames of the stack
+    if stack_size > 1:
+        settings['stack_size'] = stack_size
+    cache = ResultCache(cache_filename, cache_settings) if cache_filename is not None else None
 
-        for f in file_stats_dict:
-            output.write(f + " " + str(file_stats_dict[f][0]) + " " + str(file_stats_dict[f][1]) + " " + str(file_stats_dict[f][2])+'\n')
-    
-    return events, no_events           
+    if profiles_root is None:
+        profiles_root = default_profiles_root(catalog)
+    render_pool = RenderPool(render_workers, profiles_root=profiles_root,
+                             artifact_mode=artifact_mode) if plots else None
+    #outlier classes in tables need statistics of all shards, so tables of a shard are written by the merge
+    table = RegionTableWriter(table_basename, table_formats) if table_basename is not None and shard is None else None
+    partial = None
+    if shard is not None:
+        partial = PartialResultWriter(partial_filename or default_partial_filename(shard), shard, catalog, settings)
+    #streaks of a shard are indexed by the merge, together with the other shards
+    index = StreakIndexWriter(index_filename, catalog) if index_filename is not None and shard is None else None
+    linker = TrackLinker(tracks_filename) if tracks_filename is not None else None
 
-events, no_events = find_and_classify_events(DATA_LOCATION_CATALOG, output_filename)
+    #results stored in previous runs, None for files which have to be processed now
+    file_results = [cache.lookup(f) if cache is not None else None for f in img_filenames]
+    pending = [i for i, r in enumerate(file_results) if r is None]
+    new_results = process_files([img_filenames[i] for i in pending], [plots and i % plots_sample == 0 for i in pending],
+                                workers, threshold_strategy, cache, render_pool, min_area, tile_size, raw_format,
+                                prescreen, background, prefetch_depth, prefetch_memory, stack_size)
 
-sort_files(no_events, 'no_events/')
+    for file_result in file_results:
+        cached = file_result is not None
+        if not cached:
+            file_result = next(new_results)
+        merge_file_result(file_result, results)
+        if table is not None:
+            table.append(file_result)
+        if index is not None:
+            index.append(file_result, cached=cached)
+        if partial is not None:
+            partial.append(file_result, frame_timestamp(os.path.join(catalog, file_result['filename'])), cached)
+        if linker is not None:
+            linker.add(file_result)
+    new_results.close()
+    if cache is not None:
+        cache.close()
+    if render_pool is not None:
+        render_pool.close()
+    if index is not None:
+        index.close()
+    if linker is not None:
+        linker.close()
+    if partial is not None:
+        with stage('write_outputs'):
+            partial.close(results.stats)
+        return results.events(), results.no_events()
 
+    sort_event_outliers(results)
+    with stage('write_outputs'):
+        if table is not None:
+            table.close(results.stats)
 
+        with open(output_filename, 'w') as output:
+            write_analytics(output, results.event_summaries())
 
+    return results.events(), results.no_events()
 
 
+if __name__ == '__main__':
+    #command line is handled by the smugi module; running this file is the same as 'python -m smugi scan'
+    import sys
+    import smugi
+    sys.exit(smugi.main(['scan'] + sys.argv[1:]))
@@ -0,0 +1,150 @@
+#
+# Module measuring labelled regions without skimage regionprops. Areas of all labels are counted with a single
+# np.bincount over the label image, and only regions large enough are measured further: bounding box, centroid,
+# second order central moments and the properties derived from them are computed for all of them at once.
+#
+# Regions are returned as a numpy record array with one record per region. Fields are named like the properties of
+# skimage RegionProperties, so a record can be used in place of RegionProperties object by the rest of the detection:
+#
+#   region.label, region.area, region.bbox, region.centroid, region.orientation,
+#   region.major_axis_length, region.minor_axis_length
+#
+
+#importing packages for standard mathematical and data operations
+import math
+import numpy as np
+
+#importing instrumentation of stages
+from instrumentation import count
+
+#constants and default values
+
+#type of records describing regions
+REGION_DTYPE = np.dtype([
+    ('label', np.int64),
+    ('area', np.int64),
+    ('bbox', np.int64, (4,)),
+    ('centroid', np.float64, (2,)),
+    ('orientation', np.float64),
+    ('major_axis_length', np.float64),
+    ('minor_axis_length', np.float64),
+])
+
+
+'''
+The function returns empty record array of regions
+
+Arguments:
+  size - number of records
+
+Returns:
+  record array of REGION_DTYPE
+'''
+def empty_regions(size=0):
+    return np.recarray(size, dtype=REGION_DTYPE)
+
+
+'''
+The function computes moments of labelled pixels
+
+Arguments:
+  lab - array with label of each pixel, labels numbered from 1 to n
+  r, c - arrays with row and column of each pixel, pixels given in raster order
+  n - number of labels
+
+Returns:
+  dict of arrays with one value per label: 'area', centroid 'mean_r', 'mean_c', central moments 'mrr', 'mcc', 'mrc'
+  (sums of products of distances from the centroid), bounding box 'min_r', 'min_c', 'max_r', 'max_c' and the first
+  pixel in raster order 'first_r', 'first_c'
+'''
+def pixel_moments(lab, r, c, n):
+    area = np.bincount(lab, minlength=n + 1)[1:]
+    mean_r = np.bincount(lab, r, n + 1)[1:] / area
+    mean_c = np.bincount(lab, c, n + 1)[1:] / area
+    dr = r - mean_r[lab - 1]
+    dc = c - mean_c[lab - 1]
+
+    #pixels of each label are consecutive after sorting, so extremes are found with reduceat
+    order = np.argsort(lab, kind='stable')
+    starts = np.concatenate([[0], np.cumsum(area)[:-1]])
+    r_sorted = r[order]
+    c_sorted = c[order]
+    return {'area': area,
+            'mean_r': mean_r,
+            'mean_c': mean_c,
+            'mrr': np.bincount(lab, dr * dr, n + 1)[1:],
+            'mcc': np.bincount(lab, dc * dc, n + 1)[1:],
+            'mrc': np.bincount(lab, dr * dc, n + 1)[1:],
+            'min_r': np.minimum.reduceat(r_sorted, starts),
+            'max_r': np.maximum.reduceat(r_sorted, starts),
+            'min_c': np.minimum.reduceat(c_sorted, starts),
+            'max_c': np.maximum.reduceat(c_sorted, starts),
+            #sorting is stable, so the first pixel of a label is its first pixel in raster order
+            'first_r': r_sorted[starts],
+            'first_c': c_sorted[starts]}
+
+
+'''
+The function builds records of regions from their moments, computing properties the same way as skimage
+RegionProperties: inertia tensor [[mcc, -mrc], [-mrc, mrr]] / area, axis lengths equal to 4 square roots of its
+eigenvalues, and orientation of the major axis measured from the row axis
+
+Arguments:
+  labels - array with label of each region
+  moments - dict of arrays with 'area', 'mean_r', 'mean_c', 'mrr', 'mcc', 'mrc', 'min_r', 'min_c', 'max_r', 'max_c'
+  of each region, as returned by pixel_moments
+
+Returns:
+  record array of REGION_DTYPE
+'''
+def regions_from_moments(labels, moments):
+    area = moments['area']
+    a = moments['mcc'] / area
+    b = -moments['mrc'] / area
+    c = moments['mrr'] / area
+    tensors = np.stack([np.stack([a, b], axis=-1), np.stack([b, c], axis=-1)], axis=-2)
+    eigvals = np.clip(np.linalg.eigvalsh(tensors), 0, None) if len(area) else np.zeros((0, 2))
+
+    regions = empty_regions(len(area))
+    regions.label = labels
+    regions.area = area
+    regions.bbox = np.stack([moments['min_r'], moments['min_c'], moments['max_r'] + 1, moments['max_c'] + 1], axis=-1)
+    regions.centroid = np.stack([moments['mean_r'], moments['mean_c']], axis=-1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        regions.orientation = np.where(a - c == 0, np.where(b < 0, math.pi / 4., -math.pi / 4.),
+                                       0.5 * np.arctan2(-2 * b, c - a))
+    regions.major_axis_length = 4 * np.sqrt(eigvals[:, 1])
+    regions.minor_axis_length = 4 * np.sqrt(eigvals[:, 0])
+    return regions
+
+
+'''
+The function measures regions of a label image. Areas of all labels are counted with one np.bincount, and only
+regions with area of at least min_area are measured further
+
+Arguments:
+  labels - array of region labels, 0 marks background, as returned by skimage.measure.label
+  min_area - minimal area of measured region
+
+Returns:
+  record array of REGION_DTYPE, ordered by label
+'''
+def measure_regions(labels, min_area=0):
+    flat = labels.ravel()
+    areas = np.bincount(flat)
+    areas[0] = 0
+    count('regions_found', int(np.count_nonzero(areas)))
+
+    kept = np.flatnonzero(areas >= max(min_area, 1))
+    if len(kept) == 0:
+        return empty_regions()
+
+    #pixels of kept labels are found with a boolean lookup table, and only they are measured further;
+    #kept labels are renumbered 1..len(kept)
+    is_kept = np.zeros(len(areas), dtype=bool)
+    is_kept[kept] = True
+    renumber = np.zeros(len(areas), dtype=np.int64)
+    renumber[kept] = np.arange(1, len(kept) + 1)
+    idx = np.flatnonzero(is_kept[flat])
+    r, c = np.divmod(idx, labels.shape[1])
+    return regions_from_moments(kept, pixel_moments(renumber[flat[idx]], r, c, len(kept)))
@@ -0,0 +1,159 @@
+#
+# Module aggregating generator based stages of streak detection. Every image is decoded once into a Frame object, which
+# then flows through the stages; each stage takes an iterable of frames and yields them back with its results attached.
+# Stages can be chained in any order that satisfies their inputs, and the ones that are not needed can be skipped, e.g.
+#
+#   frames = measure_frames(label_frames(threshold_frames(read_frames(paths))))
+#   results = ScanResults()
+#   for frame in record_frames(render_frames(frames), results):
+#       pass
+#
+
+#importing packages supporting filesystem path walking
+import os
+
+#importing functions from custom modules
+from frame_readers import frame_name
+from image_processing import read_image, threshold_image, label_image, merge_file_result, describe_streaks, MIN_STREAK_AREA
+from region_processing import region_render_record, render_records, extract_brightness_profiles
+from thresholds import DEFAULT_THRESHOLD_STRATEGY
+from measurement import measure_regions
+
+
+'''
+Single image flowing through the pipeline
+
+Attributes:
+  path - path to the image file
+  pixels - array with decoded pixels of the image
+  metadata - dict with information about the image ('filename', 'name', 'shape', 'dtype')
+  mask - binary mask of pixels above threshold, set by threshold_frames
+  labels - array of region labels, set by label_frames
+  regions - record array of regions large enough to be streaks, see measurement module, set by measure_frames
+  profiles - list of brightness profiles of the regions, computed once by the first stage needing them
+'''
+class Frame:
+    def __init__(self, path, pixels, metadata=None):
+        self.path = path
+        self.pixels = pixels
+        self.metadata = metadata if metadata is not None else {}
+        self.mask = None
+        self.labels = None
+        self.regions = None
+        self.profiles = None
+
+
+'''
+The function returns brightness profiles of frame regions, computing them on first use
+
+Arguments:
+  frame - Frame object with regions
+
+Returns:
+  list of arrays with brightness profiles
+'''
+def frame_profiles(frame):
+    if frame.profiles is None:
+        frame.profiles = extract_brightness_profiles(frame.pixels, frame.regions)
+    return frame.profiles
+
+
+'''
+The function decodes image files, each one exactly once
+
+Arguments:
+  img_filenames - iterable of image paths
+  raw_format - shape and type of pixels of raw files, see frame_readers.parse_raw_format
+
+Returns:
+  generator of Frame objects
+'''
+def read_frames(img_filenames, raw_format=None):
+    for img_filename in img_filenames:
+        pixels = read_image(img_filename, raw_format)
+        filename = os.path.basename(img_filename)
+        metadata = {'filename': filename, 'name': frame_name(filename),
+                    'shape': pixels.shape, 'dtype': pixels.dtype}
+        yield Frame(img_filename, pixels, metadata)
+
+
+'''
+Pipeline stage applying threshold to the pixels of each frame
+
+Arguments:
+  frames - iterable of Frame objects with pixels
+  threshold_strategy - name of threshold strategy from thresholds module
+
+Returns:
+  generator of Frame objects with mask set
+'''
+def threshold_frames(frames, threshold_strategy=DEFAULT_THRESHOLD_STRATEGY):
+    for frame in frames:
+        frame.mask = threshold_image(frame.pixels, threshold_strategy)
+        yield frame
+
+
+'''
+Pipeline stage labelling regions of each frame's mask
+
+Arguments:
+  frames - iterable of Frame objects with mask
+
+Returns:
+  generator of Frame objects with labels set
+'''
+def label_frames(frames):
+    for frame in frames:
+        frame.labels = label_image(frame.mask)
+        yield frame
+
+
+'''
+Pipeline stage measuring labelled regions and keeping the ones with large enough areas
+
+Arguments:
+  frames - iterable of Frame objects with labels
+  min_area - minimal area of region to be kept
+
+Returns:
+  generator of Frame objects with regions set
+'''
+def measure_frames(frames, min_area=MIN_STREAK_AREA):
+    for frame in frames:
+        frame.regions = measure_regions(frame.labels, min_area)
+        yield frame
+
+
+'''
+Pipeline stage drawing brightness profile and rotation angle image of each region
+
+Arguments:
+  frames - iterable of Frame objects with regions
+
+Returns:
+  generator of Frame objects, unchanged
+'''
+def render_frames(frames):
+    for frame in frames:
+        profiles = frame_profiles(frame)
+        render_records([region_render_record(frame.pixels, region, frame.metadata['name'], index, profile)
+                        for index, (region, profile) in enumerate(zip(frame.regions, profiles), 1)])
+        yield frame
+
+
+'''
+Pipeline stage adding regions of each frame to results of the scan, the same way process_regions_for_file does
+
+Arguments:
+  frames - iterable of Frame objects with regions
+  results - results.ScanResults of the scan; files with and without streaks are given by its events and no_events,
+  outliers are classified afterwards by postprocessing.sort_event_outliers
+
+Returns:
+  generator of Frame objects, unchanged
+'''
+def record_frames(frames, results):
+    for frame in frames:
+        file_result = describe_streaks(frame.metadata['filename'], frame.regions, frame_profiles(frame))
+        merge_file_result(file_result, results)
+        yield frame
@@ -10,53 +10,176 @@ import os
 
 #importing from custom modules
 from global_variables import DATA_LOCATION_CATALOG
+from instrumentation import stage
+from relocation import relocate_files, DEFAULT_COPY_WORKERS
 
 '''
 This function transfers list of files from catalog containing data to new location.
 The list of files is given by the argument files_list, and the new location, with the name given by
-folder_name, is a subfolder of the catalog containing data.
+folder_name, is a subfolder of the catalog containing data, unless folder_name is an absolute path, e.g. of
+a directory on another volume. Files are relocated in journaled batches, see
+relocation module, so an interrupted transfer is finished by the next call with the same folder.
 
 Arguments:
   files_list - list of files to move from data catalog
-  folder_name - name of the subfolder of the data catalog, where the files from the list should be transferred
+  folder_name - name of the subfolder of the data catalog, or absolute path of the directory, where the files from
+  the list should be transferred
+  catalog - directory of the data catalog
+  mode - 'move', 'hardlink' (files stay in the catalog) or 'manifest' (only names of the files are written)
+  workers - number of threads copying files when the subfolder lies on another filesystem
 Returns:
-  void
+  number of files transferred
 '''
-def sort_files(files_list, folder_name):
+def sort_files(files_list, folder_name, catalog=DATA_LOCATION_CATALOG, mode='move', workers=DEFAULT_COPY_WORKERS):
     folder_name = folder_name.strip()
-    folder_name = folder_name.strip(os.sep)
+    if os.path.isabs(folder_name):
+        folder_path = folder_name
+    else:
+        folder_path = os.path.join(catalog, folder_name.strip(os.sep))
+    return relocate_files(files_list, catalog, folder_path, mode, workers)
+
+'''
+  Online accumulator of streak length statistics (count, mean and sum of squared deviations), updated with batches
+  of lengths using Welford's algorithm in the parallel form of Chan et al. Accumulators built by separate workers or
+  on separate shards can be merged, giving the same statistics as one accumulator fed with all lengths. Only three
+  numbers are kept, whatever the number of streaks.
+'''
+class StreakLengthStats:
+  def __init__(self, count=0, mean=0., m2=0.):
+    self.count = count
+    self.mean = mean
+    self.m2 = m2
+
+  '''
+    The method merges statistics of another accumulator into this one
+
+    Arguments:
+      other - StreakLengthStats object
+
+    Returns:
+      void
+  '''
+  def merge(self, other):
+    if other.count == 0:
+      return
+    count = self.count + other.count
+    delta = other.mean - self.mean
+    self.mean += delta * other.count / count
+    self.m2 += other.m2 + delta * delta * self.count * other.count / count
+    self.count = count
+
+  '''
+    The method updates statistics with a batch of streak lengths
+
+    Arguments:
+      lengths - array of streak lengths
+
+    Returns:
+      void
+  '''
+  def update(self, lengths):
+    lengths = np.asarray(lengths, dtype=np.float64)
+    if len(lengths) == 0:
+      return
+    batch_mean = lengths.mean()
+    self.merge(StreakLengthStats(len(lengths), batch_mean, float(np.sum((lengths - batch_mean) ** 2))))
+
+  '''
+    The method returns standard deviation of lengths (population one, like np.std)
+  '''
+  def std(self):
+    if self.count == 0:
+      return 0.
+    return float(np.sqrt(self.m2 / self.count))
+
+  '''
+    The method returns statistics as dict, e.g. to be saved in a partial result file
+  '''
+  def to_dict(self):
+    return {'count': self.count, 'mean': self.mean, 'm2': self.m2}
+
+  '''
+    The method creates accumulator from dict returned by to_dict
+  '''
+  @staticmethod
+  def from_dict(d):
+    return StreakLengthStats(d['count'], d['mean'], d['m2'])
+
+
+#outlier classes of streaks
+NORMAL_STREAK = 0
+SHORT_STREAK = 1
+LONG_STREAK = 2
+
+#number of streaks classified at once, bounding the size of temporary arrays
+CLASSIFICATION_CHUNK = 1 << 20
+
+'''
+  The function classifies streak lengths: streaks shorter than half of the mean length are too short, 
+  and streaks longer than mean plus three standard deviations are too long
+
+  Arguments:
+    lengths - array of streak lengths
+    stats - StreakLengthStats of all streaks
+
+  Returns:
+    array of outlier classes (NORMAL_STREAK, SHORT_STREAK or LONG_STREAK), one for each length
+'''
+def classify_streak_lengths(lengths, stats):
+  lengths = np.asarray(lengths, dtype=np.float64)
+  outlier_threshold = 3*stats.std() + stats.mean
+  classes = np.full(len(lengths), NORMAL_STREAK, dtype=np.int8)
+  classes[lengths > outlier_threshold] = LONG_STREAK
+  classes[lengths < (stats.mean / 2)] = SHORT_STREAK
+  return classes
 
-    folder_path = DATA_LOCATION_CATALOG + os.sep + folder_name
-    try:
-        os.mkdir(folder_path)
-    except:
-        pass
-    for i in files_list:
-        old_path = DATA_LOCATION_CATALOG + os.sep + i
-        new_path = folder_path + os.sep + i
-        os.rename(old_path, new_path)
-    return
 
 '''
-  The function fills up the data about rejected outlier regions in file_stats_dict
+  The function classifies all streaks of the scan and fills up numbers of too short and too long streaks of each file
 
   Arguments:
-    streak_length_array - array of streak lengths
-    file_stats_dict - dict storing numbers of regions found in each category
-    filename_for_strk_length - dict with filenames as values for streak length key
+    results - results.ScanResults of the scan; outlier classes of its streaks are set in place
+    stats - StreakLengthStats of all streaks, results.stats when not given
 
   Returns:
     void
 '''
-def sort_event_outliers(streak_length_array, file_stats_dict, filename_for_strk_length):
-  lengths_mean = np.mean(streak_length_array)
-  outlier_threshold = 3*np.std(streak_length_array) + lengths_mean
+def sort_event_outliers(results, stats=None):
+  with stage('sort_event_outliers'):
+    regions = results.regions
+    if stats is None:
+      stats = results.stats
+    if stats.count == 0:
+      return
+
+    short_counts = np.zeros(len(results.files), dtype=np.int64)
+    long_counts = np.zeros(len(results.files), dtype=np.int64)
+    for start in range(0, len(regions), CLASSIFICATION_CHUNK):
+      chunk = regions[start:start + CLASSIFICATION_CHUNK]
+      classes = classify_streak_lengths(chunk['length'], stats)
+      chunk['outlier_class'] = classes
+      short_counts += np.bincount(chunk['file_id'][classes == SHORT_STREAK], minlength=len(results.files))
+      long_counts += np.bincount(chunk['file_id'][classes == LONG_STREAK], minlength=len(results.files))
 
-  for le in streak_length_array:
-    if le < (lengths_mean / 2):
-      file_stats_dict[filename_for_strk_length[le]][1] += 1
-    elif le > (outlier_threshold):
-      file_stats_dict[filename_for_strk_length[le]][2] += 1
+    for file_id, summary in enumerate(results.files):
+      summary.short = int(short_counts[file_id])
+      summary.long = int(long_counts[file_id])
 
 
+'''
+  The function writes statistics of files with streaks, one line for each file
+
+  Arguments:
+    output - file opened for writing
+    summaries - results.FileSummary objects of files with streaks, in the order of writing
+    header - whether the header line is written first; lines appended to an existing file are written without it
+
+  Returns:
+    void
+'''
+def write_analytics(output, summaries, header=True):
+  if header:
+    output.write("filename | total streaks | short streaks | long streaks\n")
 
+  for summary in summaries:
+    output.write(summary.name + " " + str(summary.total) + " " + str(summary.short) + " " + str(summary.long)+'\n')
@@ -0,0 +1,215 @@
+#
+# Module overlapping disk I/O with computation.
+#
+# FramePrefetcher reads and decodes the next frames in a pool of threads while the current frame is processed.
+# Reading ahead is bounded by the number of frames and by a memory budget: decoded frames waiting for processing
+# count against the budget, and no new read starts while the budget is used up (at least one frame is always read).
+# A read reserves the size of the largest frame decoded so far, and the reservation is replaced by the real size of
+# the frame as soon as it is decoded; until the size of some frame is known, only one frame is read ahead. No more
+# reads are started than there are threads, so new reads are started against real sizes of decoded frames, and the
+# budget can be exceeded only by frames larger than all frames decoded before, by at most one such frame per thread.
+# Memory mapped frames are not copied - the kernel is asked to read their pages ahead, and they do not count
+# against the budget, as the page cache can be reclaimed. With a key function, the key of each file (e.g. its size
+# and modification time) is taken by the reading thread just before the file is read, and returned with the frame.
+#
+# AsyncWriter runs writes (e.g. of results to the cache) in a background thread, in the order of submission.
+# Its queue is bounded, so a slow disk slows the producer down instead of filling memory.
+#
+
+#importing packages for standard mathematical and data operations
+import numpy as np
+
+#importing packages for threads and memory mapping
+import collections
+import mmap
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+#importing instrumentation of stages
+from instrumentation import stage, count
+
+#constants and default values
+
+#number of frames read ahead of the processed one
+DEFAULT_PREFETCH_DEPTH = 2
+
+#memory, in bytes, of decoded frames read ahead
+DEFAULT_PREFETCH_BUDGET = 512 << 20
+
+#number of threads reading frames
+PREFETCH_THREADS = 2
+
+#number of writes waiting in the queue of AsyncWriter
+DEFAULT_WRITER_QUEUE = 64
+
+
+'''
+The function asks the kernel to read pages of a memory mapped frame ahead, without waiting for them
+
+Arguments:
+  frame - array returned by frame_readers.read_frame
+
+Returns:
+  True if the frame is memory mapped, False otherwise
+'''
+def advise_willneed(frame):
+    mapping = getattr(frame, '_mmap', None)
+    if mapping is None:
+        return False
+    if hasattr(mapping, 'madvise') and hasattr(mmap, 'MADV_WILLNEED'):
+        mapping.madvise(mmap.MADV_WILLNEED)
+    return True
+
+
+'''
+Iterator over frames read ahead in a pool of threads, returning (path, frame, key) tuples in the order of paths.
+An exception raised while reading a frame is raised when that frame is reached
+
+Arguments:
+  paths - list of paths of frames
+  read - function reading a frame from its path
+  depth - maximal number of frames read ahead
+  memory_budget - maximal number of bytes of decoded frames read ahead
+  threads - number of reading threads
+  key - function returning key of a file from its path (e.g. result_cache.file_key), called by the reading thread
+  just before the frame is read, so the key describes the file as it was read; None returns None keys
+'''
+class FramePrefetcher:
+    def __init__(self, paths, read, depth=DEFAULT_PREFETCH_DEPTH, memory_budget=DEFAULT_PREFETCH_BUDGET,
+                 threads=PREFETCH_THREADS, key=None):
+        self.paths = list(paths)
+        self.read = read
+        self.key = key
+        self.depth = max(depth, 1)
+        self.memory_budget = memory_budget
+        self.threads = max(threads, 1)
+        self.executor = ThreadPoolExecutor(self.threads)
+        #paths and futures of frames read ahead, with one element list holding number of bytes reserved for each
+        self.pending = collections.deque()
+        self.next_path = 0
+        #reserved bytes and the estimate are updated by reading threads too
+        self.lock = threading.Lock()
+        self.reserved = 0
+        #size of the largest decoded frame, used as estimate of the next ones; None until a frame is decoded
+        self.frame_bytes = None
+
+    '''
+    The method reads frame in a thread of the pool and replaces its reservation with the real size of the frame
+
+    Arguments:
+      path - path of the frame
+      reservation - one element list with number of bytes reserved for the frame
+
+    Returns:
+      frame, and key of its file taken before it was read (None without key function)
+    '''
+    def _read(self, path, reservation):
+        key = self.key(path) if self.key is not None else None
+        frame = self.read(path)
+        frame_bytes = 0 if advise_willneed(frame) else np.asarray(frame).nbytes
+        with self.lock:
+            self.reserved += frame_bytes - reservation[0]
+            reservation[0] = frame_bytes
+            self.frame_bytes = max(self.frame_bytes or 0, frame_bytes)
+        return frame, key
+
+    '''
+    The method starts reading next frames, as long as depth and memory budget allow
+    '''
+    def _fill(self):
+        while self.next_path < len(self.paths) and len(self.pending) < self.depth:
+            if sum(not future.done() for _, future, _ in self.pending) >= self.threads:
+                break
+            with self.lock:
+                if self.pending and (self.frame_bytes is None or
+                                     self.reserved + self.frame_bytes > self.memory_budget):
+                    count('prefetch_budget_waits')
+                    break
+                reservation = [self.frame_bytes or 0]
+                self.reserved += reservation[0]
+            path = self.paths[self.next_path]
+            self.pending.append((path, self.executor.submit(self._read, path, reservation), reservation))
+            self.next_path += 1
+
+    def __iter__(self):
+        try:
+            self._fill()
+            while self.pending:
+                path, future, reservation = self.pending.popleft()
+                if not future.done():
+                    count('prefetch_waits')
+                with stage('prefetch_wait'):
+                    frame, key = future.result()
+                with self.lock:
+                    self.reserved -= reservation[0]
+                self._fill()
+                yield path, frame, key
+        finally:
+            self.close()
+
+    '''
+    The method cancels reads not started yet and stops the threads
+    '''
+    def close(self):
+        for _, future, _ in self.pending:
+            future.cancel()
+        self.pending.clear()
+        self.executor.shutdown(wait=True)
+
+
+'''
+Writer running submitted functions in a background thread, in the order of submission. When max_pending writes
+are waiting, submit blocks until one of them is done. An exception raised by a write is raised by the next submit
+or by close
+
+Arguments:
+  max_pending - maximal number of writes waiting in the queue
+'''
+class AsyncWriter:
+    def __init__(self, max_pending=DEFAULT_WRITER_QUEUE):
+        self.queue = queue.Queue(max_pending)
+        self.error = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            function, args = item
+            if self.error is None:
+                try:
+                    with stage('async_write'):
+                        function(*args)
+                except BaseException as e:
+                    self.error = e
+
+    def _raise_error(self):
+        if self.error is not None:
+            error = self.error
+            self.error = None
+            raise error
+
+    '''
+    The method queues a write
+
+    Arguments:
+      function - function doing the write
+      args - its arguments
+    '''
+    def submit(self, function, *args):
+        self._raise_error()
+        if self.queue.full():
+            count('writer_waits')
+        self.queue.put((function, args))
+
+    '''
+    The method waits until all queued writes are done and stops the thread
+    '''
+    def close(self):
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        self._raise_error()
@@ -0,0 +1,176 @@
+#
+# Module rejecting frames which cannot contain streaks, before the full resolution detection.
+#
+# Binary mask of the frame is reduced to a pyramid of block counts - numbers of pixels above the threshold in square
+# blocks; a block is hot when its count is not zero. Closing with 3x3 footprint is contained in dilation of the mask
+# by one pixel, so every pixel of a region lies at most one pixel away from a pixel of the mask, and for blocks of at
+# least 3 pixels all hot blocks contributing to one region form an 8-connected group of blocks. A hot block of size b
+# with k pixels of the mask adds at most min(9 k, (b + 2)^2) pixels to the region, so the sum of these numbers over
+# a group bounds area of every region it contributes to. When the bound is smaller than the minimal area of a streak
+# for every group, the frame has no streaks - no streak is ever missed.
+#
+# The 'fast' mode bounds area of a group with the number of pixels of the mask in it, ignoring pixels added by the
+# closing. It rejects more frames, but a streak reaching the minimal area only thanks to the closing can be missed.
+#
+
+#importing packages for standard mathematical and data operations
+import numpy as np
+
+#importing instrumentation of stages
+from instrumentation import stage, count
+
+#constants and default values
+
+#sizes of blocks of pyramid levels, from the finest; each level has blocks twice as large as the previous one.
+#Blocks must have at least 3 pixels for the bound to hold
+PYRAMID_BLOCK_SIZES = (4, 8, 16, 32)
+
+#modes of prescreening: 'exact' never rejects a frame with streaks, 'fast' rejects more frames
+PRESCREEN_MODES = ('exact', 'fast')
+
+#numbers of frames prescreened and rejected by a scan in this process, see record_prescreen; counted whether
+#instrumentation is enabled or not
+_tally = {'frames_prescreened': 0, 'frames_rejected': 0}
+
+
+'''
+The function sums square blocks of an array, blocks at the bottom and right edges may be smaller
+
+Arguments:
+  array - 2D array
+  b - size of blocks
+
+Returns:
+  2D array with sum of each block
+'''
+def block_sum(array, b):
+    height, width = array.shape
+    full_h = height - height % b
+    full_w = width - width % b
+    rows = array[:full_h].reshape(full_h // b, b, width).sum(axis=1, dtype=np.int64)
+    if full_h < height:
+        rows = np.concatenate([rows, array[full_h:].sum(axis=0, dtype=np.int64)[np.newaxis]])
+    blocks = rows[:, :full_w].reshape(len(rows), full_w // b, b).sum(axis=2)
+    if full_w < width:
+        blocks = np.concatenate([blocks, rows[:, full_w:].sum(axis=1)[:, np.newaxis]], axis=1)
+    return blocks
+
+
+'''
+The function computes pyramid of block counts of pixels above threshold. Only the finest level is computed from the
+pixels, the other ones from the previous level
+
+Arguments:
+  image - array with pixels of the frame
+  threshold - threshold of the frame
+  block_sizes - sizes of blocks of the levels, from the finest, each one twice the previous one
+
+Returns:
+  list of (block size, array of block counts), from the finest level
+'''
+def block_count_pyramid(image, threshold, block_sizes=PYRAMID_BLOCK_SIZES):
+    mask = np.greater(image, threshold).view(np.uint8)
+    levels = [(block_sizes[0], block_sum(mask, block_sizes[0]))]
+    for b in block_sizes[1:]:
+        levels.append((b, block_sum(levels[-1][1], 2)))
+    return levels
+
+
+'''
+The function returns the largest bound of area of a region formed by groups of 8-connected hot blocks
+
+Arguments:
+  block_bounds - array with bound of pixels contributed by each block to a region, 0 for blocks which are not hot
+
+Returns:
+  the largest bound, 0 if there are no hot blocks
+'''
+def largest_group_bound(block_bounds):
+    from scipy import ndimage
+
+    groups, n = ndimage.label(block_bounds > 0, structure=np.ones((3, 3), dtype=bool))
+    if n == 0:
+        return 0
+    return int(np.bincount(groups.ravel(), block_bounds.ravel())[1:].max())
+
+
+'''
+The function checks whether a frame may contain a region of at least min_area pixels after thresholding and closing.
+Pyramid levels are checked from the coarsest one, the frame is rejected at the first level proving that it has no
+such region
+
+Arguments:
+  image - array with pixels of the frame
+  threshold - threshold of the frame
+  min_area - minimal area of a streak
+  mode - 'exact' or 'fast', see module description
+
+Returns:
+  False if the frame has no region of min_area pixels (in 'fast' mode: most likely has none), True otherwise
+'''
+def may_contain_region(image, threshold, min_area, mode='exact'):
+    if mode not in PRESCREEN_MODES:
+        raise ValueError('unknown prescreen mode ' + repr(mode) + ', expected one of: ' + ', '.join(PRESCREEN_MODES))
+    for b, counts in reversed(block_count_pyramid(image, threshold)):
+        if mode == 'exact':
+            bounds = np.minimum(9 * counts, (b + 2) ** 2)
+        else:
+            bounds = counts
+        if largest_group_bound(bounds) < min_area:
+            return False
+    return True
+
+
+'''
+The function prescreens a frame, measuring the time of prescreening and counting checked and rejected frames
+
+Arguments:
+  image - array with pixels of the frame
+  threshold - threshold of the frame
+  min_area - minimal area of a streak
+  mode - 'exact' or 'fast', see module description
+
+Returns:
+  False if the frame is rejected, True if it has to be processed at full resolution
+'''
+def prescreen_frame(image, threshold, min_area, mode='exact'):
+    with stage('prescreen'):
+        candidate = may_contain_region(image, threshold, min_area, mode)
+    count('frames_prescreened')
+    if not candidate:
+        count('frames_rejected')
+    return candidate
+
+
+'''
+The function adds a frame to the numbers of prescreened and rejected frames reported by rejection_summary
+
+Arguments:
+  rejected - 'prescreen_rejected' of the result of the frame: True if it was rejected, False if it passed, None if it
+  was not prescreened
+'''
+def record_prescreen(rejected):
+    if rejected is None:
+        return
+    _tally['frames_prescreened'] += 1
+    if rejected:
+        _tally['frames_rejected'] += 1
+
+
+'''
+The function describes rejection rate of prescreening
+
+Arguments:
+  counters - dict of counters, as in instrumentation.snapshot(); None uses frames recorded by record_prescreen
+
+Returns:
+  string with numbers of checked and rejected frames, None if no frame was prescreened
+'''
+def rejection_summary(counters=None):
+    if counters is None:
+        counters = _tally
+    checked = counters.get('frames_prescreened', 0)
+    if checked == 0:
+        return None
+    rejected = counters.get('frames_rejected', 0)
+    return 'prescreen rejected %d of %d frames (%.1f%%)' % (rejected, checked, 100. * rejected / checked)
@@ -2,40 +2,49 @@
 # Module aggregating functions responsible for single region analysis
 #
 
-#importing packages for visualization
-import matplotlib.pyplot as plt
-import matplotlib.patches as mpatches
-
-#importing packages used in image processing 
-from skimage import transform
+#packages for visualization (matplotlib) and image processing (skimage, scipy) are imported in the functions and
+#methods using them, so importing this module, e.g. by the command line entry point, stays fast
 
 #importing packages for standard mathematical and data operations
 import math
 import numpy as np
 import os
 
+#importing packages for parallel processing
+import multiprocessing
+
 #constants
 from global_variables import DATA_LOCATION_CATALOG
 
-import os
+#importing instrumentation of stages
+import instrumentation
+from instrumentation import stage, count
 
 #name of catalog to store brightness profiles
 PROFILES_DIRECTORY = '/brightness_profile/'
 
+#modes of saving rendered regions: 'plots' - profile and reference PNG files of each region in a folder of each
+#image, 'sheet' - one contact sheet PNG file with all regions of an image, 'store' - profiles and fragments of all
+#regions of a run in chunked NPZ files, see artifact_store module
+ARTIFACT_MODES = ('plots', 'sheet', 'store')
+
+#width and height, in inches, of the panel of a single region in a contact sheet
+SHEET_PANEL_SIZE = (4., 5.)
+
 '''
-The function returns boundary points of image region after extending the region in every direction by 
+The function returns boundary points of bounding box after extending it in every direction by 
 fraction passed in the padding argument
 
 Arguments:
-    region - the original region surrounding streak
-    padding - float expressing the fraction by which the region is to be extended in each direction
+    bbox - minr, minc, maxr, maxc of the original bounding box
+    padding - float expressing the fraction by which the box is to be extended in each direction
 
 Returns:
-    minr, minc, maxr, maxc - integers representing boundary points of extended rectangle surrounding streak
+    minr, minc, maxr, maxc - integers representing boundary points of extended rectangle
 
 '''
-def extend_region_around_streak(region, padding):
-    minr, minc, maxr, maxc =  region.bbox
+def extend_bbox(bbox, padding):
+    minr, minc, maxr, maxc = bbox
 
 
     rmargin = int(padding*(maxr - minr))
@@ -48,6 +57,21 @@ def extend_region_around_streak(region, padding):
     maxc += cmargin
 
     return np.max([minr, 0]), np.max([minc, 0]), maxr, maxc
+
+'''
+The function returns boundary points of image region after extending the region in every direction by 
+fraction passed in the padding argument
+
+Arguments:
+    region - the original region surrounding streak
+    padding - float expressing the fraction by which the region is to be extended in each direction
+
+Returns:
+    minr, minc, maxr, maxc - integers representing boundary points of extended rectangle surrounding streak
+
+'''
+def extend_region_around_streak(region, padding):
+    return extend_bbox(region.bbox, padding)
 '''
 The function takes identified region containing a streak, rotates it so the longer identified axis 
 is horizontal and cuts out only the streak
@@ -60,10 +84,13 @@ Returns:
 newimg - image of the rotated streak 
 '''
 def cut_out_strk(image, region):
+    from skimage import transform
+
     minr, minc, maxr, maxc = extend_region_around_streak(region, 0.1)
 
     newimg = image[minr:maxr, minc:maxc]
-    newimg = transform.rotate(newimg, -region.orientation*180./math.pi, resize=True)
+    with stage('rotate'):
+        newimg = transform.rotate(newimg, -region.orientation*180./math.pi, resize=True)
     
     img_orig_ht = len(newimg)
     strk_ht = region.minor_axis_length
@@ -73,78 +100,506 @@ def cut_out_strk(image, region):
     return newimg
 
 '''
-This function plots the brightness profile of an identified light streak
+The function returns factor converting pixel values of given type to floats in range [0, 1], the same way
+skimage converts images before rotating them, so profiles keep the scale of the ones computed by cut_out_strk
 
 Arguments:
-  image - the original image
-  region - one of regions containing streaks in this image, identified by skimage
-  filename - the name of the original image file
-  index - ordinal number of the region, indicates how many regions have been already processed for 
-  the original image
+  dtype - type of image pixels
+
 Returns:
-  void
+  float factor
 '''
-def draw_brightness_profile(image, region, filename, index):
-    
-    newimg = cut_out_strk(image, region)
-    profile = np.sum(newimg, axis=0)
-    
-    folder_path = DATA_LOCATION_CATALOG + PROFILES_DIRECTORY + filename
+def intensity_scale(dtype):
+    if np.issubdtype(dtype, np.integer):
+        return 1. / np.iinfo(dtype).max
+    return 1.
 
-    try:
-        os.mkdir(DATA_LOCATION_CATALOG + PROFILES_DIRECTORY)
-    except:
-        pass
 
-   
-    try:
-        os.mkdir(folder_path)
-    except:
-        pass
-    
-    plt.xlabel('Odległość od początku smugi [px]')
-    plt.plot(profile)
-    plt.savefig(folder_path + "/profile_" + str(index))
-    plt.clf()
+'''
+The function computes brightness profiles of all streaks of an image in one call. Instead of rotating the fragment
+of the image surrounding each streak, the image is sampled (with bilinear interpolation) directly on a grid aligned
+with the region: along the major axis, over the extent of the fragment extended by padding, and across it, over
+minor_axis_length pixels centred on the centroid. Profile is the sum of samples across the major axis.
+The orientation of regions follows skimage convention, so the major axis has direction (cos, sin) of orientation
+in (row, column) coordinates; profiles run from left to right
+
+Arguments:
+  image - the original image
+  regions - list of regions containing streaks in this image, identified by skimage
+  padding - float expressing the fraction by which the region is extended in each direction
 
-    return
+Returns:
+  list of arrays with brightness profile of each region
+'''
+def extract_brightness_profiles(image, regions, padding=0.1):
+    from scipy import ndimage
+
+    if len(regions) == 0:
+        return []
+
+    coords = []
+    shapes = []
+    for region in regions:
+        cr, cc = region.centroid
+        theta = region.orientation
+        along = np.array([math.cos(theta), math.sin(theta)])
+        if along[1] < 0:
+            along = -along
+        across = np.array([-along[1], along[0]])
+
+        #extent of the extended bounding box, projected on the major axis
+        minr, minc, maxr, maxc = extend_region_around_streak(region, padding)
+        corners = np.array([[minr, minc], [minr, maxc], [maxr, minc], [maxr, maxc]], dtype=np.float64)
+        projected = (corners - (cr, cc)) @ along
+        t = np.arange(int(math.ceil(projected.max() - projected.min()))) + projected.min()
+
+        strk_ht = max(1, int(round(region.minor_axis_length)))
+        s = np.arange(strk_ht) - (strk_ht - 1) / 2.
+
+        rows = cr + s[:, np.newaxis] * across[0] + t * along[0]
+        cols = cc + s[:, np.newaxis] * across[1] + t * along[1]
+        coords.append(np.stack([rows.ravel(), cols.ravel()]))
+        shapes.append((strk_ht, len(t)))
+
+    #one interpolation call for all regions of the image
+    with stage('profile'):
+        samples = ndimage.map_coordinates(image, np.concatenate(coords, axis=1), output=np.float64, order=1,
+                                          mode='constant', cval=0.)
+        samples *= intensity_scale(image.dtype)
+
+    profiles = []
+    start = 0
+    for strk_ht, length in shapes:
+        profiles.append(samples[start:start + strk_ht * length].reshape(strk_ht, length).sum(axis=0))
+        start += strk_ht * length
+    return profiles
 
 
 '''
-The function creates image for each streak, containing the angle of rotation
-  
+The function records all data needed to draw plots of a region, so they can be drawn later, in a separate stage,
+without the original image
+
 Arguments:
   image - the original image
   region - one of regions containing streaks in this image, identified by skimage
   filename - the name of the original image file
   index - ordinal number of the region, indicates how many regions have been already processed for 
   the original image
+  profile - brightness profile of the streak, if already computed by extract_brightness_profiles
 Returns:
-  void
+  dict with keys:
+    'filename', 'index' - as in arguments
+    'profile' - brightness profile of the streak
+    'crop' - copy of the image fragment surrounding the streak
+    'bbox' - boundary points of the fragment, as returned by extend_region_around_streak
+    'orientation' - orientation of the region
 '''
-def draw_rotation_angle(image, region, filename, index):
+def region_render_record(image, region, filename, index, profile=None):
+    if profile is None:
+        profile = extract_brightness_profiles(image, [region])[0]
 
     minr, minc, maxr, maxc = extend_region_around_streak(region, 0.1)
-    
-    folder_path = DATA_LOCATION_CATALOG + PROFILES_DIRECTORY + filename
+    crop = np.array(image[minr:maxr, minc:maxc])
 
-    newimg = image[minr:maxr, minc:maxc]
+    return {'filename': filename, 'index': index, 'profile': profile, 'crop': crop,
+            'bbox': (minr, minc, maxr, maxc), 'orientation': region.orientation}
+
+
+'''
+The function returns default directory where plots of regions are saved
+
+Arguments:
+  catalog - directory to catalog containing images
 
-    fig, ax = plt.subplots()
-    ax.imshow(newimg)
+Returns:
+  path of the directory
+'''
+def default_profiles_root(catalog=DATA_LOCATION_CATALOG):
+    return catalog + PROFILES_DIRECTORY
+
+
+'''
+Object drawing plots of recorded regions. It keeps one figure for brightness profiles, one for rotation angles and
+one for contact sheets, and reuses them for every region, so memory does not grow with the number of drawn regions
 
-    direction = np.sign(region.orientation)
+Arguments:
+  profiles_root - directory where folders with plots of each image are created, None means
+  default_profiles_root() of the default data catalog
+'''
+class RegionRenderer:
+    def __init__(self, profiles_root=None):
+        #figures are drawn with the Agg canvas directly, without pyplot global state
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+        self.profiles_root = profiles_root if profiles_root is not None else default_profiles_root()
+
+        self.profile_figure = Figure()
+        FigureCanvasAgg(self.profile_figure)
+        self.profile_axes = self.profile_figure.add_subplot()
+
+        self.reference_figure = Figure()
+        FigureCanvasAgg(self.reference_figure)
+        self.reference_axes = self.reference_figure.add_subplot()
+
+        self.sheet_figure = Figure()
+        FigureCanvasAgg(self.sheet_figure)
+
+        #folders already created, so they are not created again for each region
+        self.created_folders = set()
+
+    '''
+    The method returns folder for plots of the given image file, creating it if needed
+    '''
+    def folder_for(self, filename):
+        folder_path = os.path.join(self.profiles_root, filename)
+        if folder_path not in self.created_folders:
+            os.makedirs(folder_path, exist_ok=True)
+            self.created_folders.add(folder_path)
+        return folder_path
+
+    '''
+    The method saves figure as PNG file
+
+    Arguments:
+      figure - figure to save
+      path - path of the file, without extension
+    '''
+    def save(self, figure, path):
+        with stage('savefig'):
+            figure.savefig(path + '.png')
+        count('figures_rendered')
+        if instrumentation.ENABLED:
+            count('bytes_written', os.path.getsize(path + '.png'))
+
+    '''
+    The method plots the brightness profile of a recorded region
+
+    Arguments:
+      record - dict returned by region_render_record
+    '''
+    def draw_brightness_profile(self, record):
+        folder_path = self.folder_for(record['filename'])
+
+        ax = self.profile_axes
+        ax.clear()
+        plot_brightness_profile(ax, record)
+        self.save(self.profile_figure, folder_path + "/profile_" + str(record['index']))
+
+    '''
+    The method creates image of a recorded region, containing the angle of rotation
+
+    Arguments:
+      record - dict returned by region_render_record
+    '''
+    def draw_rotation_angle(self, record):
+        folder_path = self.folder_for(record['filename'])
+
+        ax = self.reference_axes
+        ax.clear()
+        plot_rotation_angle(ax, record)
+        self.save(self.reference_figure, folder_path + "/reference_" + str(record['index']))
+
+    '''
+    The method draws one contact sheet with all recorded regions of an image, saved as <filename>.png in the
+    profiles root: the fragment with the angle of rotation above the brightness profile of each region
+
+    Arguments:
+      records - list of dicts returned by region_render_record, all for the same image
+    '''
+    def draw_contact_sheet(self, records):
+        folder_path = self.folder_for('')
+
+        columns = int(math.ceil(math.sqrt(len(records))))
+        rows = int(math.ceil(len(records) / columns))
+        figure = self.sheet_figure
+        figure.clear()
+        figure.set_size_inches(SHEET_PANEL_SIZE[0] * columns, SHEET_PANEL_SIZE[1] * rows)
+        for i, record in enumerate(records):
+            row, column = divmod(i, columns)
+            ax = figure.add_subplot(2 * rows, columns, 2 * row * columns + column + 1)
+            plot_rotation_angle(ax, record)
+            ax.set_title(str(record['index']))
+            plot_brightness_profile(figure.add_subplot(2 * rows, columns, (2 * row + 1) * columns + column + 1),
+                                    record)
+        figure.tight_layout()
+        self.save(figure, os.path.join(folder_path, records[0]['filename']))
+
+    '''
+    The method draws both plots of a recorded region
+    '''
+    def render(self, record):
+        self.draw_brightness_profile(record)
+        self.draw_rotation_angle(record)
+
+    '''
+    The method releases the figures
+    '''
+    def close(self):
+        self.profile_figure.clear()
+        self.reference_figure.clear()
+        self.sheet_figure.clear()
+
+
+'''
+The function plots the brightness profile of a recorded region on given axes
+
+Arguments:
+  ax - matplotlib axes
+  record - dict returned by region_render_record
+'''
+def plot_brightness_profile(ax, record):
+    ax.set_xlabel('Odległość od początku smugi [px]')
+    ax.plot(record['profile'])
+
+
+'''
+The function shows fragment of the image surrounding a recorded region on given axes, with an arrow showing
+the angle of rotation
+
+Arguments:
+  ax - matplotlib axes
+  record - dict returned by region_render_record
+'''
+def plot_rotation_angle(ax, record):
+    import matplotlib.patches as mpatches
+
+    minr, minc, maxr, maxc = record['bbox']
+    ax.imshow(record['crop'])
+
+    direction = np.sign(record['orientation'])
     if (direction == 1):
         ystart = maxr-minr
     else:
         ystart = 0
 
-    
     con = mpatches.Arrow(0, ystart, (maxc-minc), direction*(minr-maxr), edgecolor='red', linewidth=2)
     ax.add_artist(con)
 
     ax.set_axis_off()
-    plt.savefig(folder_path + "/reference_" + str(index))
-    plt.clf()
 
 
+#renderer used by draw_brightness_profile and draw_rotation_angle, and by each process of RenderPool
+_renderer = None
+
+#directory where the renderer of the current process saves plots, None means the default one
+_profiles_root = None
+
+#mode of saving rendered regions in the current process, one of ARTIFACT_MODES except 'store'
+_artifact_mode = 'plots'
+
+'''
+The function sets directory where the renderer of the current process saves plots. It is also the initializer of
+processes of RenderPool
+
+Arguments:
+  profiles_root - directory where plots are saved, None means the default one
+  artifact_mode - 'plots' or 'sheet', see ARTIFACT_MODES
+'''
+def set_profiles_root(profiles_root, artifact_mode='plots'):
+    global _renderer, _profiles_root, _artifact_mode
+    _profiles_root = profiles_root
+    _artifact_mode = artifact_mode
+    if _renderer is not None and _renderer.profiles_root != profiles_root:
+        _renderer = None
+
+
+'''
+The function returns renderer of the current process, creating it on first use
+'''
+def get_renderer():
+    global _renderer
+    if _renderer is None:
+        _renderer = RegionRenderer(_profiles_root)
+    return _renderer
+
+
+'''
+The function draws plots of a list of recorded regions with the renderer of the current process
+
+Arguments:
+  records - list of dicts returned by region_render_record, all for the same image
+Returns:
+  number of rendered regions
+'''
+def render_records(records):
+    renderer = get_renderer()
+    if _artifact_mode == 'sheet':
+        renderer.draw_contact_sheet(records)
+        return len(records)
+    for record in records:
+        renderer.render(record)
+    return len(records)
+
+
+'''
+The function draws plots of a list of recorded regions in a process of RenderPool
+
+Arguments:
+  records - list of dicts returned by region_render_record
+  instrument - whether stages of rendering should be measured
+Returns:
+  number of rendered regions, and snapshot of measured stages (None if instrument is False)
+'''
+def render_records_task(records, instrument):
+    if not instrument:
+        return render_records(records), None
+    instrumentation.enable()
+    instrumentation.reset()
+    rendered = render_records(records)
+    return rendered, instrumentation.snapshot()
+
+
+'''
+Pool of processes drawing plots of recorded regions, separate from the detection, so detection does not wait
+for rendering. Records of one image are submitted at once; when more than max_pending submissions are not finished
+yet, submit waits for the oldest one. When instrumentation is enabled while the pool is created, stages measured in
+the rendering processes are merged into the records of the creating process. In the 'store' artifact mode nothing
+is drawn: records are written by an ArtifactStore in the creating process, and no rendering process is started
+
+Arguments:
+  workers - number of rendering processes
+  max_pending - maximal number of unfinished submissions
+  profiles_root - directory where plots are saved, None means the default one
+  artifact_mode - one of ARTIFACT_MODES
+'''
+class RenderPool:
+    def __init__(self, workers=1, max_pending=64, profiles_root=None, artifact_mode='plots'):
+        if artifact_mode not in ARTIFACT_MODES:
+            raise ValueError('unknown artifact mode ' + repr(artifact_mode) + ', expected one of: ' +
+                             ', '.join(ARTIFACT_MODES))
+        self.store = None
+        self.pool = None
+        if artifact_mode == 'store':
+            from artifact_store import ArtifactStore
+            self.store = ArtifactStore(profiles_root if profiles_root is not None else default_profiles_root())
+        else:
+            self.pool = multiprocessing.Pool(workers, set_profiles_root, (profiles_root, artifact_mode))
+        self.max_pending = max_pending
+        self.instrument = instrumentation.ENABLED
+        self.pending = []
+        self.rendered = 0
+
+    '''
+    The method collects result of finished submission
+    '''
+    def _collect(self, result):
+        rendered, metrics = result.get()
+        self.rendered += rendered
+        if metrics is not None:
+            instrumentation.merge(metrics)
+
+    '''
+    The method submits recorded regions of one image for rendering
+
+    Arguments:
+      records - list of dicts returned by region_render_record
+    '''
+    def submit(self, records):
+        if len(records) == 0:
+            return
+        if self.store is not None:
+            self.store.add(records)
+            self.rendered += len(records)
+            return
+        self.pending.append(self.pool.apply_async(render_records_task, (records, self.instrument)))
+        while len(self.pending) > self.max_pending:
+            self._collect(self.pending.pop(0))
+
+    '''
+    The method waits until all submitted regions are rendered and stops the processes
+
+    Returns:
+      number of rendered regions
+    '''
+    def close(self):
+        if self.store is not None:
+            self.store.close()
+            return self.rendered
+        try:
+            for result in self.pending:
+                self._collect(result)
+            self.pending = []
+            self.pool.close()
+            self.pool.join()
+        finally:
+            self.pool.terminate()
+        return self.rendered
+
+
+'''
+This function plots the brightness profile of an identified light streak
+
+Arguments:
+  image - the original image
+  region - one of regions containing streaks in this image, identified by skimage
+  filename - the name of the original image file
+  index - ordinal number of the region, indicates how many regions have been already processed for 
+  the original image
+Returns:
+  void
+'''
+def draw_brightness_profile(image, region, filename, index):
+    get_renderer().draw_brightness_profile(region_render_record(image, region, filename, index))
+
+
+'''
+The function creates image for each streak, containing the angle of rotation
+  
+Arguments:
+  image - the original image
+  region - one of regions containing streaks in this image, identified by skimage
+  filename - the name of the original image file
+  index - ordinal number of the region, indicates how many regions have been already processed for 
+  the original image
+Returns:
+  void
+'''
+def draw_rotation_angle(image, region, filename, index):
+    get_renderer().draw_rotation_angle(region_render_record(image, region, filename, index))
+
+
+'''
+The function draws plots of streaks again, from a table written by find_and_classify_events, without detecting them.
+Brightness profiles are taken from the table, and fragments surrounding streaks are read from images of the catalog
+
+Arguments:
+  table - dict returned by results_table.load_region_table
+  catalog - directory to catalog containing images
+  workers - number of rendering processes
+  profiles_root - directory where plots are saved, None means default_profiles_root(catalog)
+  raw_format - shape and type of pixels of raw files, see frame_readers.parse_raw_format
+  artifact_mode - one of ARTIFACT_MODES
+
+Returns:
+  number of rendered regions
+'''
+def render_region_table(table, catalog, workers=1, profiles_root=None, raw_format=None, artifact_mode='plots'):
+    from frame_readers import read_frame, frame_name
+
+    if profiles_root is None:
+        profiles_root = default_profiles_root(catalog)
+    offsets = table['profile_offsets']
+    file_ids = table['file_id']
+    #rows of one file are consecutive, in the order in which the streaks were found
+    starts = np.flatnonzero(np.diff(file_ids, prepend=-1)) if len(file_ids) else []
+
+    render_pool = RenderPool(workers, profiles_root=profiles_root, artifact_mode=artifact_mode)
+    try:
+        for i, start in enumerate(starts):
+            stop = starts[i + 1] if i + 1 < len(starts) else len(file_ids)
+            filename = str(table['file_names'][file_ids[start]])
+            image = read_frame(os.path.join(catalog, filename), raw_format)
+            records = []
+            for index, row in enumerate(range(start, stop), 1):
+                bbox = (table['bbox_min_row'][row], table['bbox_min_col'][row],
+                        table['bbox_max_row'][row], table['bbox_max_col'][row])
+                minr, minc, maxr, maxc = extend_bbox(bbox, 0.1)
+                records.append({'filename': frame_name(filename), 'index': index,
+                                'profile': table['profile_values'][offsets[row]:offsets[row + 1]],
+                                'crop': np.array(image[minr:maxr, minc:maxc]), 'bbox': (minr, minc, maxr, maxc),
+                                'orientation': float(table['orientation'][row])})
+            render_pool.submit(records)
+    finally:
+        rendered = render_pool.close()
+    return rendered
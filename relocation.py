@@ -0,0 +1,391 @@
+#
+# Module relocating many files of the catalog at once, e.g. images without streaks moved to no_events.
+#
+# Files are relocated in batches with one of the modes:
+#
+#   move      - files are renamed; when the destination is on another filesystem, they are copied by a pool of
+#               threads, synced to disk and only then removed from the catalog
+#   hardlink  - files are linked in the destination and stay in the catalog, no bytes are copied; when the
+#               destination is on another filesystem, files are copied instead
+#   manifest  - names of the files are appended to a manifest in the destination, no file is touched
+#
+# Moving and linking are journaled. Before any file is relocated, names of all files are written to a journal in the
+# destination directory, and after each batch is relocated, a record marking it done is appended; both are synced to
+# disk. Relocation of a single file is idempotent, so after a crash the journal is enough to finish the interrupted
+# relocation (resume_relocation) or to bring the files back (rollback_relocation). The journal is removed when
+# relocation completes.
+#
+# Files of the destination are never overwritten: relocation is refused before any file is touched when a name is
+# already taken in the destination. Only when an interrupted relocation is resumed, an existing destination is taken
+# for the copy made before the crash, and only if its content is the same as the content of the source.
+#
+
+#importing packages for serialization and parallel copying
+import json
+import shutil
+import filecmp
+import errno
+from concurrent.futures import ThreadPoolExecutor
+
+#importing packages supporting filesystem path walking
+import os
+
+#importing instrumentation of stages
+from instrumentation import stage, count
+
+#constants and default values
+
+#modes of relocation
+RELOCATION_MODES = ('move', 'hardlink', 'manifest')
+
+#name of the journal kept in the destination directory while files are relocated
+JOURNAL_FILENAME = '.relocation_journal.jsonl'
+
+#name of the manifest written in the destination directory by the manifest mode
+MANIFEST_FILENAME = 'manifest.txt'
+
+#number of files relocated between two journal records
+RELOCATION_BATCH = 256
+
+#number of threads copying files across filesystems
+DEFAULT_COPY_WORKERS = 4
+
+#suffix of files being copied across filesystems, renamed to the final name once complete
+PARTIAL_SUFFIX = '.partial'
+
+
+'''
+The function appends records to the journal and syncs them to disk
+
+Arguments:
+  journal - journal file opened for appending
+  records - list of dicts
+'''
+def append_journal(journal, records):
+    for record in records:
+        journal.write(json.dumps(record) + '\n')
+    journal.flush()
+    os.fsync(journal.fileno())
+
+
+'''
+The function syncs directory entries to disk, so renames and removals in it survive a crash
+'''
+def fsync_directory(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+'''
+The function tells whether two directories lie on the same filesystem, so files can be renamed between them
+'''
+def same_device(source_dir, destination_dir):
+    return os.stat(source_dir).st_dev == os.stat(destination_dir).st_dev
+
+
+'''
+The function tells whether the destination already holds the file, i.e. it is the same file (a link) or a copy
+with the same content
+
+Arguments:
+  source - path of the file
+  destination - path of the file in the destination
+
+Returns:
+  True if the destination holds the file, False if it does not exist
+'''
+def already_relocated(source, destination):
+    if not os.path.lexists(destination):
+        return False
+    if os.path.samefile(source, destination) or filecmp.cmp(source, destination, shallow=False):
+        return True
+    raise FileExistsError(errno.EEXIST, 'another file of the same name exists in the destination', destination)
+
+
+'''
+The function copies a file to another filesystem. The copy gets its final name only when it is complete and synced,
+so a destination of this name is always a complete copy; an existing destination is never overwritten
+
+Arguments:
+  source - path of the file
+  destination - new path of the file
+'''
+def copy_file(source, destination):
+    partial = destination + PARTIAL_SUFFIX
+    with open(source, 'rb') as fsrc, open(partial, 'wb') as fdst:
+        shutil.copyfileobj(fsrc, fdst)
+        fdst.flush()
+        os.fsync(fdst.fileno())
+    shutil.copystat(source, partial)
+    if os.path.lexists(destination):
+        os.unlink(partial)
+        raise FileExistsError(errno.EEXIST, 'file exists in the destination', destination)
+    os.replace(partial, destination)
+
+
+'''
+The function relocates a single file. A file of the same name already present in the destination is an error,
+unless the relocation is resumed after a crash and the destination holds the same content, in which case the file
+is taken as relocated before
+
+Arguments:
+  source - path of the file
+  destination - new path of the file
+  mode - 'move' or 'hardlink'
+  rename - whether files can be renamed, i.e. both paths lie on the same filesystem
+  resume - whether the file may have been relocated by an interrupted relocation
+
+Returns:
+  True if the file has been relocated now, False if it had been relocated before
+'''
+def relocate_file(source, destination, mode, rename=True, resume=False):
+    if mode == 'move' and not os.path.exists(source):
+        if resume and os.path.exists(destination):
+            return False
+        raise FileNotFoundError(errno.ENOENT, 'file to relocate does not exist', source)
+    if resume and already_relocated(source, destination):
+        if mode == 'move':
+            os.unlink(source)
+        return False
+    if os.path.lexists(destination):
+        raise FileExistsError(errno.EEXIST, 'file exists in the destination', destination)
+
+    if mode == 'hardlink':
+        try:
+            os.link(source, destination)
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            copy_file(source, destination)
+        return True
+    if rename:
+        try:
+            os.rename(source, destination)
+            return True
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+    copy_file(source, destination)
+    os.unlink(source)
+    return True
+
+
+'''
+The function relocates a batch of files, renaming or linking them in this thread or copying them with a pool of
+threads
+
+Arguments:
+  pairs - list of (source, destination) paths
+  mode - 'move' or 'hardlink'
+  rename - whether files can be renamed or linked, i.e. both directories lie on the same filesystem
+  executor - ThreadPoolExecutor copying files across filesystems
+  resume - whether the files may have been relocated by an interrupted relocation
+
+Returns:
+  number of files relocated now
+'''
+def relocate_batch(pairs, mode, rename, executor, resume=False):
+    if rename:
+        return sum(relocate_file(source, destination, mode, True, resume) for source, destination in pairs)
+    return sum(executor.map(lambda pair: relocate_file(pair[0], pair[1], mode, False, resume), pairs))
+
+
+'''
+The function reads the journal of an interrupted relocation
+
+Arguments:
+  journal_path - path of the journal
+
+Returns:
+  header - dict with 'source', 'destination' and 'mode' of the relocation
+  planned - list of names of files planned to be relocated, in order
+  done - set of names of files relocated in completed batches
+'''
+def read_journal(journal_path):
+    header = None
+    planned = []
+    done = set()
+    with open(journal_path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                #the last record may be cut by a crash
+                break
+            if record['op'] == 'start':
+                header = record
+            elif record['op'] == 'plan':
+                planned += record['names']
+            elif record['op'] == 'done':
+                done.update(record['names'])
+    if header is None:
+        raise ValueError(journal_path + ' is not a relocation journal')
+    return header, planned, done
+
+
+'''
+The function relocates files in batches, appending a record to the journal after each batch
+
+Arguments:
+  names - names of the files, relative to the source directory
+  source_dir - directory containing the files
+  destination_dir - existing directory where the files are relocated
+  mode - 'move' or 'hardlink'
+  workers - number of threads copying files across filesystems
+  journal - journal file opened for appending
+  resume - whether the relocation was interrupted before, see relocate_file
+
+Returns:
+  number of files relocated
+'''
+def run_journaled(names, source_dir, destination_dir, mode, workers, journal, resume=False):
+    rename = same_device(source_dir, destination_dir)
+    relocated = 0
+    with ThreadPoolExecutor(max(workers, 1)) as executor:
+        for start in range(0, len(names), RELOCATION_BATCH):
+            batch = names[start:start + RELOCATION_BATCH]
+            relocated += relocate_batch([(os.path.join(source_dir, name), os.path.join(destination_dir, name))
+                                         for name in batch], mode, rename, executor, resume)
+            fsync_directory(destination_dir)
+            if mode == 'move':
+                fsync_directory(source_dir)
+            append_journal(journal, [{'op': 'done', 'names': batch}])
+    count('files_relocated', relocated)
+    return relocated
+
+
+'''
+The function appends names of files to the manifest of the destination directory, without touching the files
+
+Arguments:
+  names - names of the files, relative to the source directory
+  source_dir - directory containing the files
+  destination_dir - existing directory where the manifest is written
+
+Returns:
+  number of files listed
+'''
+def write_manifest(names, source_dir, destination_dir):
+    with open(os.path.join(destination_dir, MANIFEST_FILENAME), 'a') as f:
+        for name in names:
+            f.write(os.path.join(source_dir, name) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+    count('files_listed', len(names))
+    return len(names)
+
+
+'''
+The function finishes relocation interrupted by a crash, using its journal
+
+Arguments:
+  destination_dir - destination directory of the relocation
+  workers - number of threads copying files across filesystems
+
+Returns:
+  number of files relocated now, 0 if there is no interrupted relocation
+'''
+def resume_relocation(destination_dir, workers=DEFAULT_COPY_WORKERS):
+    journal_path = os.path.join(destination_dir, JOURNAL_FILENAME)
+    if not os.path.exists(journal_path):
+        return 0
+    header, planned, done = read_journal(journal_path)
+    remaining = [name for name in planned if name not in done]
+    with stage('relocate'):
+        with open(journal_path, 'a') as journal:
+            relocated = run_journaled(remaining, header['source'], destination_dir, header['mode'], workers, journal,
+                                      resume=True)
+    os.remove(journal_path)
+    return relocated
+
+
+'''
+The function brings back files of relocation interrupted by a crash, using its journal: moved files are moved back
+to the source directory, links and copies are removed, and so are incomplete copies left by the crash
+
+Arguments:
+  destination_dir - destination directory of the relocation
+  workers - number of threads copying files across filesystems
+
+Returns:
+  number of files brought back, 0 if there is no interrupted relocation
+'''
+def rollback_relocation(destination_dir, workers=DEFAULT_COPY_WORKERS):
+    journal_path = os.path.join(destination_dir, JOURNAL_FILENAME)
+    if not os.path.exists(journal_path):
+        return 0
+    header, planned, _ = read_journal(journal_path)
+    source_dir = header['source']
+    restored = 0
+    with stage('relocate'):
+        for name in planned:
+            for partial in (os.path.join(destination_dir, name + PARTIAL_SUFFIX),
+                            os.path.join(source_dir, name + PARTIAL_SUFFIX)):
+                if os.path.exists(partial):
+                    os.unlink(partial)
+        if header['mode'] == 'hardlink':
+            for name in planned:
+                link = os.path.join(destination_dir, name)
+                if os.path.exists(link):
+                    os.unlink(link)
+                    restored += 1
+        else:
+            #files not moved yet are still in the source directory and are skipped
+            names = [name for name in planned if os.path.exists(os.path.join(destination_dir, name))]
+            rename = same_device(destination_dir, source_dir)
+            with ThreadPoolExecutor(max(workers, 1)) as executor:
+                for start in range(0, len(names), RELOCATION_BATCH):
+                    restored += relocate_batch([(os.path.join(destination_dir, name), os.path.join(source_dir, name))
+                                                for name in names[start:start + RELOCATION_BATCH]],
+                                               'move', rename, executor, resume=True)
+            fsync_directory(source_dir)
+    os.remove(journal_path)
+    count('files_restored', restored)
+    return restored
+
+
+'''
+The function relocates files from the source directory to the destination directory. Relocation interrupted
+earlier in the same destination is finished first. Relocation is refused, before any file is touched, when a file
+of the same name exists in the destination
+
+Arguments:
+  names - names of the files, relative to the source directory
+  source_dir - directory containing the files
+  destination_dir - directory where the files are relocated, created if it does not exist
+  mode - 'move', 'hardlink' or 'manifest', see module description
+  workers - number of threads copying files across filesystems
+
+Returns:
+  number of files relocated; FileExistsError is raised when names of some files are already taken in the destination
+'''
+def relocate_files(names, source_dir, destination_dir, mode='move', workers=DEFAULT_COPY_WORKERS):
+    if mode not in RELOCATION_MODES:
+        raise ValueError('unknown relocation mode ' + repr(mode) + ', expected one of: ' + ', '.join(RELOCATION_MODES))
+    os.makedirs(destination_dir, exist_ok=True)
+    relocated = resume_relocation(destination_dir, workers)
+    names = list(names)
+    if not names:
+        return relocated
+    if mode == 'manifest':
+        with stage('relocate'):
+            return relocated + write_manifest(names, source_dir, destination_dir)
+
+    taken = [name for name in names if os.path.lexists(os.path.join(destination_dir, name))]
+    if taken:
+        raise FileExistsError(errno.EEXIST, str(len(taken)) + ' files of the same names exist in the destination, '
+                              'e.g. ' + ', '.join(taken[:5]), destination_dir)
+
+    journal_path = os.path.join(destination_dir, JOURNAL_FILENAME)
+    with stage('relocate'):
+        with open(journal_path, 'a') as journal:
+            append_journal(journal, [{'op': 'start', 'source': os.path.abspath(source_dir),
+                                      'destination': os.path.abspath(destination_dir), 'mode': mode}] +
+                           [{'op': 'plan', 'names': names[start:start + RELOCATION_BATCH]}
+                            for start in range(0, len(names), RELOCATION_BATCH)])
+            relocated += run_journaled(names, source_dir, destination_dir, mode, workers, journal)
+    os.remove(journal_path)
+    return relocated
@@ -0,0 +1,249 @@
+#
+# Module with persistent store of per-file results, allowing incremental and resumable runs.
+#
+# The store is a text file with one JSON record per line. The first line holds the settings the results were
+# computed with; each following line holds the result of one file, keyed by path, size and modification time.
+# Files are not hashed when they are processed, so a cold run reads each file once. A file is hashed only when it is
+# found with a changed modification time: if its record has the same hash, the file was only touched or copied back
+# and is not processed again; otherwise it is processed again and the hash is kept in its new record, so later
+# touches are recognized. Records are appended as soon as a file is
+# processed, so a run that crashes halfway leaves all finished files in the store; a record cut by the crash is
+# dropped by rewriting the store before new records are appended. When a path appears more than once, the last
+# record wins.
+#
+
+#importing packages for serialization and hashing
+import json
+import hashlib
+import threading
+
+#importing packages supporting filesystem path walking
+import os
+
+#importing functions from custom modules
+from image_processing import find_events_in_file, MIN_STREAK_AREA
+from global_variables import CACHE_FILENAME
+
+#constants and default values
+
+#size of blocks in which files are read while hashing
+HASH_BLOCK_SIZE = 1 << 20
+
+#version of the stored file results, changed whenever describe_streaks changes; stores of other versions are discarded
+RESULT_FORMAT_VERSION = 2
+
+
+'''
+The function computes hash of the file content
+
+Arguments:
+  path - path to the file
+
+Returns:
+  hex digest of SHA-1 of the file content
+'''
+def content_hash(path):
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+'''
+The function returns the key under which result of the file is stored
+
+Arguments:
+  path - path to the file
+
+Returns:
+  dict with keys 'path', 'size' and 'mtime_ns'
+'''
+def file_key(path):
+    st = os.stat(path)
+    return {'path': path, 'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+
+
+'''
+The function processes single image file and returns its result together with the key of the file.
+The key is taken before the file is read, so a file modified during processing is processed again in the next run
+
+Arguments:
+  img_filename - the name of image filename
+  threshold_strategy - name of threshold strategy from thresholds module
+  render - whether data needed to draw plots of the streaks should be recorded
+  min_area - minimal area of region to be counted as streak
+  tile_size - if given, the image is processed in tiles of this size
+  raw_format - shape and type of pixels of raw files
+  prescreen - 'exact' or 'fast' to reject frames without streaks early, None processes every frame
+  background - path of cached background model, None processes frames without correction
+  image - pixels of the image already read, None reads img_filename
+  key - key of the file taken before image was read, e.g. by prefetch.FramePrefetcher; None takes the key now
+
+Returns:
+  file_result - dict returned by find_events_in_file
+  key - dict returned by file_key
+'''
+def find_events_with_key(img_filename, threshold_strategy, render=True, min_area=MIN_STREAK_AREA, tile_size=None,
+                         raw_format=None, prescreen=None, background=None, image=None, key=None):
+    if key is None:
+        key = file_key(img_filename)
+    return find_events_in_file(img_filename, threshold_strategy, render, min_area, tile_size, raw_format,
+                               prescreen, background, image), key
+
+
+'''
+The function processes consecutive image files as stacks, see stack_processing module, and returns their results
+together with keys of the files, taken before the files are read
+
+Arguments:
+  img_filenames - paths of consecutive frames
+  threshold_strategy - name of threshold strategy from thresholds module
+  render_flags - list telling, for each file, whether data needed to draw plots should be recorded
+  min_area - minimal area of region to be counted as streak
+  raw_format - shape and type of pixels of raw files
+  background - path of cached background model, None processes frames without correction
+
+Returns:
+  list of tuples (file_result, key), one for each file
+'''
+def find_stack_events_with_keys(img_filenames, threshold_strategy, render_flags=None, min_area=MIN_STREAK_AREA,
+                                raw_format=None, background=None):
+    from stack_processing import find_events_in_stack
+
+    keys = [file_key(f) for f in img_filenames]
+    return list(zip(find_events_in_stack(img_filenames, threshold_strategy, render_flags, min_area, raw_format,
+                                         background), keys))
+
+
+'''
+Persistent store of per-file results
+
+Arguments:
+  cache_filename - path to the store file, created if it does not exist
+  settings - dict with settings influencing results (e.g. threshold strategy); the stored results are discarded
+  when they were computed with different settings
+'''
+class ResultCache:
+    def __init__(self, cache_filename, settings):
+        self.cache_filename = cache_filename
+        self.settings = dict(settings, result_format_version=RESULT_FORMAT_VERSION)
+        #dict where key - path of the file, value - record with key fields and 'result'
+        self.records = {}
+        #dict where key - path of file processed again because its modification time changed, value - (size,
+        #mtime_ns, sha1) of the file hashed by lookup, added to its new record
+        self.hashes = {}
+        self.lock = threading.Lock()
+        lines_count = self._load()
+        if lines_count is None or lines_count > 2 * len(self.records) + 1:
+            self._rewrite()
+        self.output = open(self.cache_filename, 'a')
+
+    '''
+    The method reads records from the store file
+
+    Returns:
+      number of lines in the file, or None if the file is missing, was written with different settings or has a line
+      cut by a crash, so that the file is rewritten before new records are appended to it
+    '''
+    def _load(self):
+        if not os.path.exists(self.cache_filename):
+            return None
+        lines_count = 0
+        cut = False
+        with open(self.cache_filename) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    #last line of a run that crashed while writing it
+                    cut = True
+                    continue
+                if lines_count == 0:
+                    if record.get('settings') != self.settings:
+                        self.records = {}
+                        return None
+                else:
+                    self.records[record['path']] = record
+                lines_count += 1
+        return None if cut else lines_count
+
+    '''
+    The method replaces the store file with one holding only the current records
+    '''
+    def _rewrite(self):
+        tmp_filename = self.cache_filename + '.tmp'
+        with open(tmp_filename, 'w') as f:
+            f.write(json.dumps({'settings': self.settings}) + '\n')
+            for record in self.records.values():
+                f.write(json.dumps(record) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_filename, self.cache_filename)
+
+    '''
+    The method appends record to the store file
+
+    Arguments:
+      record - dict with key fields and 'result'
+    '''
+    def _append(self, record):
+        line = json.dumps(record) + '\n'
+        #records may be stored by a writer thread, see prefetch.AsyncWriter
+        with self.lock:
+            self.records[record['path']] = record
+            self.output.write(line)
+            self.output.flush()
+
+    '''
+    The method returns stored result of the file, if the file has not changed since it was processed.
+    Size and modification time are checked first; the content is hashed only when the modification time differs,
+    and compared with the hash in the record, if the record has one
+
+    Arguments:
+      img_filename - the name of image filename
+
+    Returns:
+      file_result dict, or None if the file has to be processed
+    '''
+    def lookup(self, img_filename):
+        record = self.records.get(img_filename)
+        if record is None:
+            return None
+        try:
+            st = os.stat(img_filename)
+        except OSError:
+            return None
+        if st.st_size != record['size']:
+            return None
+        if st.st_mtime_ns != record['mtime_ns']:
+            sha1 = content_hash(img_filename)
+            if sha1 != record.get('sha1'):
+                self.hashes[img_filename] = (st.st_size, st.st_mtime_ns, sha1)
+                return None
+            record = dict(record, mtime_ns=st.st_mtime_ns)
+            self._append(record)
+        return record['result']
+
+    '''
+    The method stores result of processed file
+
+    Arguments:
+      key - dict returned by file_key
+      file_result - dict returned by find_events_in_file; data recorded for rendering is not stored
+    '''
+    def store(self, key, file_result):
+        file_result = {k: v for k, v in file_result.items() if k != 'render_records'}
+        record = dict(key, count=len(file_result['lengths']), result=file_result)
+        hashed = self.hashes.pop(key['path'], None)
+        if hashed is not None and hashed[:2] == (key['size'], key['mtime_ns']):
+            record['sha1'] = hashed[2]
+        self._append(record)
+
+    '''
+    The method flushes the store file to disk and closes it
+    '''
+    def close(self):
+        self.output.flush()
+        os.fsync(self.output.fileno())
+        self.output.close()
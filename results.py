@@ -0,0 +1,203 @@
+#
+# Module with the container of results of a scan: which files have streaks, how many of them are too short or too
+# long, and one compact record of each streak.
+#
+# Names of files are interned: each file gets an id, its index in the list of FileSummary objects, and streaks refer
+# to files by id. Streaks are kept as rows of a structured numpy array of RESULT_REGION_DTYPE (25 bytes per streak),
+# grown by doubling its capacity, instead of Python lists of floats and dicts keyed by lengths, in which streaks of
+# equal length of different files overwrote each other. Results are appended file by file, results of separate parts
+# of a scan (e.g. shards) can be merged, and all results can be saved to and loaded from an NPZ file.
+#
+
+#importing packages for standard mathematical and data operations
+import numpy as np
+
+#importing functions from custom modules
+from postprocessing import StreakLengthStats
+
+#constants and default values
+
+#type of rows describing streaks; rows are packed, without padding
+RESULT_REGION_DTYPE = np.dtype([
+    ('file_id', np.int32),
+    ('label', np.int32),
+    ('length', np.float64),
+    ('area', np.int32),
+    ('orientation', np.float32),
+    ('outlier_class', np.int8),
+])
+
+#number of rows allocated for streaks when the first one is added
+INITIAL_REGION_CAPACITY = 1024
+
+
+'''
+Numbers of streaks found in one file, in each category
+'''
+class FileSummary:
+    __slots__ = ('name', 'total', 'short', 'long')
+
+    def __init__(self, name, total=0, short=0, long=0):
+        self.name = name
+        self.total = total
+        self.short = short
+        self.long = long
+
+
+'''
+Results of a scan: summaries of files, rows of their streaks and statistics of streak lengths
+'''
+class ScanResults:
+    def __init__(self):
+        #summaries of files, file id is the index in this list
+        self.files = []
+        #dict where key - name of the file, value - its id
+        self.file_ids = {}
+        self.rows = np.zeros(0, dtype=RESULT_REGION_DTYPE)
+        self.size = 0
+        self.stats = StreakLengthStats()
+
+    '''
+    The method returns rows of all streaks, as a view of the growable array
+    '''
+    @property
+    def regions(self):
+        return self.rows[:self.size]
+
+    '''
+    The method returns id of the file, adding its summary when the file is seen for the first time
+
+    Arguments:
+      name - name of the file
+
+    Returns:
+      id of the file
+    '''
+    def intern(self, name):
+        file_id = self.file_ids.get(name)
+        if file_id is None:
+            file_id = len(self.files)
+            self.file_ids[name] = file_id
+            self.files.append(FileSummary(name))
+        return file_id
+
+    '''
+    The method makes room for more rows, doubling the capacity when needed
+
+    Arguments:
+      extra - number of rows to be appended
+    '''
+    def _reserve(self, extra):
+        needed = self.size + extra
+        if needed <= len(self.rows):
+            return
+        capacity = max(len(self.rows), INITIAL_REGION_CAPACITY)
+        while capacity < needed:
+            capacity *= 2
+        rows = np.zeros(capacity, dtype=RESULT_REGION_DTYPE)
+        rows[:self.size] = self.regions
+        self.rows = rows
+
+    '''
+    The method appends rows of streaks at once, updating totals of their files and statistics of lengths
+
+    Arguments:
+      rows - array of RESULT_REGION_DTYPE
+    '''
+    def append_rows(self, rows):
+        if len(rows) == 0:
+            return
+        self._reserve(len(rows))
+        self.rows[self.size:self.size + len(rows)] = rows
+        self.size += len(rows)
+        for file_id, total in zip(*np.unique(rows['file_id'], return_counts=True)):
+            self.files[file_id].total += int(total)
+        self.stats.update(rows['length'])
+
+    '''
+    The method adds result of one file, with all its streaks
+
+    Arguments:
+      file_result - dict returned by image_processing.describe_streaks
+
+    Returns:
+      id of the file
+    '''
+    def add_file(self, file_result):
+        file_id = self.intern(file_result['filename'])
+        rows = np.zeros(len(file_result['lengths']), dtype=RESULT_REGION_DTYPE)
+        rows['file_id'] = file_id
+        rows['label'] = file_result['labels']
+        rows['length'] = file_result['lengths']
+        rows['area'] = file_result['areas']
+        rows['orientation'] = file_result['orientations']
+        self.append_rows(rows)
+        return file_id
+
+    '''
+    The method adds results of another part of the scan. Files of the other results get ids in these results, and
+    statistics of lengths are merged, not computed again
+
+    Arguments:
+      other - ScanResults object
+    '''
+    def merge(self, other):
+        mapping = np.array([self.intern(summary.name) for summary in other.files], dtype=np.int32)
+        rows = other.regions.copy()
+        rows['file_id'] = mapping[rows['file_id']]
+        self._reserve(len(rows))
+        self.rows[self.size:self.size + len(rows)] = rows
+        self.size += len(rows)
+        for summary, file_id in zip(other.files, mapping.tolist()):
+            mine = self.files[file_id]
+            mine.total += summary.total
+            mine.short += summary.short
+            mine.long += summary.long
+        self.stats.merge(other.stats)
+
+    '''
+    The method returns names of files with streaks, in the order of adding
+    '''
+    def events(self):
+        return [summary.name for summary in self.files if summary.total > 0]
+
+    '''
+    The method returns names of files without streaks, in the order of adding
+    '''
+    def no_events(self):
+        return [summary.name for summary in self.files if summary.total == 0]
+
+    '''
+    The method returns summaries of files with streaks, in the order of adding
+    '''
+    def event_summaries(self):
+        return [summary for summary in self.files if summary.total > 0]
+
+    '''
+    The method saves the results
+
+    Arguments:
+      path - path of the NPZ file
+    '''
+    def save(self, path):
+        np.savez(path,
+                 names=np.array([summary.name for summary in self.files], dtype=str),
+                 counts=np.array([(s.total, s.short, s.long) for s in self.files], dtype=np.int64).reshape(-1, 3),
+                 regions=self.regions,
+                 stats=np.array([self.stats.count, self.stats.mean, self.stats.m2], dtype=np.float64))
+
+    '''
+    The method loads results saved by save
+    '''
+    @staticmethod
+    def load(path):
+        results = ScanResults()
+        with np.load(path) as data:
+            for name, (total, short, long) in zip(data['names'].tolist(), data['counts'].tolist()):
+                results.file_ids[name] = len(results.files)
+                results.files.append(FileSummary(name, total, short, long))
+            results.rows = data['regions'].astype(RESULT_REGION_DTYPE)
+            results.size = len(results.rows)
+            count, mean, m2 = data['stats'].tolist()
+            results.stats = StreakLengthStats(int(count), mean, m2)
+        return results
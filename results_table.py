@@ -0,0 +1,292 @@
+#
+# Module writing per-region results as columnar tables, one row per streak, alongside analytics.txt.
+#
+# Tables are written as NPZ (always loadable with numpy alone), CSV and, when pyarrow is installed, Parquet.
+# Brightness profiles have different lengths, so in NPZ they are stored as one flat array 'profile_values'
+# with 'profile_offsets' marking where the profile of each row starts; CSV holds only their lengths.
+#
+
+#importing packages for standard mathematical and data operations
+import numpy as np
+
+#importing packages for writing tables
+import csv
+import itertools
+
+#importing packages supporting filesystem path walking
+import os
+
+#importing functions from custom modules
+from postprocessing import classify_streak_lengths
+from global_variables import TABLE_BASENAME
+
+#constants and default values
+
+#formats written when none are given
+DEFAULT_TABLE_FORMATS = ('npz', 'csv')
+
+#number of rows converted to arrays and written at once
+TABLE_BATCH_SIZE = 10000
+
+#columns of the table with their types, in the order in which they are written
+REGION_COLUMNS = [
+    ('file_id', np.int32),
+    ('label', np.int32),
+    ('area', np.int64),
+    ('bbox_min_row', np.int32),
+    ('bbox_min_col', np.int32),
+    ('bbox_max_row', np.int32),
+    ('bbox_max_col', np.int32),
+    ('centroid_row', np.float64),
+    ('centroid_col', np.float64),
+    ('major_axis_length', np.float64),
+    ('minor_axis_length', np.float64),
+    ('orientation', np.float64),
+]
+
+#header of CSV table; file id is replaced by file name, and profiles are represented by their lengths
+CSV_HEADER = ['file'] + [name for name, _ in REGION_COLUMNS[1:]] + ['outlier_class', 'profile_length']
+
+
+'''
+The function imports pyarrow, needed only for Parquet output
+
+Returns:
+  pyarrow module, or None if it is not installed
+'''
+def import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        return None
+    return pyarrow
+
+
+'''
+The function converts a batch of file results into arrays, one for each column
+
+Arguments:
+  file_results - list of dicts returned by describe_streaks
+  file_ids - list of ids of these files
+
+Returns:
+  dict where key - column name, value - array; profiles are under 'profile_values' (flat) and 'profile_lengths'
+'''
+def batch_to_columns(file_results, file_ids):
+    chain = itertools.chain.from_iterable
+    counts = [len(r['lengths']) for r in file_results]
+    bboxes = np.array(list(chain(r['bboxes'] for r in file_results)), dtype=np.int32).reshape(-1, 4)
+    centroids = np.array(list(chain(r['centroids'] for r in file_results)), dtype=np.float64).reshape(-1, 2)
+    profiles = list(chain(r['profiles'] for r in file_results))
+
+    columns = {
+        'file_id': np.repeat(np.array(file_ids, dtype=np.int32), counts),
+        'label': np.array(list(chain(r['labels'] for r in file_results)), dtype=np.int32),
+        'area': np.array(list(chain(r['areas'] for r in file_results)), dtype=np.int64),
+        'bbox_min_row': bboxes[:, 0],
+        'bbox_min_col': bboxes[:, 1],
+        'bbox_max_row': bboxes[:, 2],
+        'bbox_max_col': bboxes[:, 3],
+        'centroid_row': centroids[:, 0],
+        'centroid_col': centroids[:, 1],
+        'major_axis_length': np.array(list(chain(r['lengths'] for r in file_results)), dtype=np.float64),
+        'minor_axis_length': np.array(list(chain(r['minor_lengths'] for r in file_results)), dtype=np.float64),
+        'orientation': np.array(list(chain(r['orientations'] for r in file_results)), dtype=np.float64),
+        'profile_lengths': np.array([len(p) for p in profiles], dtype=np.int64),
+        'profile_values': np.array(list(chain(profiles)), dtype=np.float64),
+    }
+    return columns
+
+
+'''
+The function converts a batch of rows with outlier classes into CSV rows
+
+Arguments:
+  columns - dict returned by batch_to_columns, with 'outlier_class' added
+  file_names - list of names of files, indexed by file id
+
+Returns:
+  iterator of CSV rows, matching CSV_HEADER
+'''
+def csv_rows(columns, file_names):
+    files = [file_names[i] for i in columns['file_id'].tolist()]
+    values = [columns[name].tolist() for name in CSV_HEADER[1:-1]] + [columns['profile_lengths'].tolist()]
+    return zip(files, *values)
+
+
+'''
+Writer of per-region tables. Results of files are appended while they are merged, and converted to arrays in batches
+of TABLE_BATCH_SIZE rows. Outlier classes depend on statistics of all streaks, so tables are written when the writer
+is closed, batch by batch
+
+Arguments:
+  base_path - path of the table files, without extension
+  formats - formats to write, any of 'npz', 'csv' and 'parquet'
+  batch_size - number of rows converted and written at once
+'''
+class RegionTableWriter:
+    def __init__(self, base_path=TABLE_BASENAME, formats=DEFAULT_TABLE_FORMATS, batch_size=TABLE_BATCH_SIZE):
+        if 'parquet' in formats and import_pyarrow() is None:
+            raise ImportError('writing Parquet tables requires pyarrow')
+        self.base_path = base_path
+        self.formats = formats
+        self.batch_size = batch_size
+        #names of files with streaks, file id is the index in this list
+        self.file_names = []
+        #converted batches of rows
+        self.batches = []
+        #file results and their ids, not converted yet
+        self.pending = []
+        self.pending_ids = []
+        self.pending_rows = 0
+
+    '''
+    The method appends rows of streaks found in one file
+
+    Arguments:
+      file_result - dict returned by describe_streaks
+    '''
+    def append(self, file_result):
+        if len(file_result['lengths']) == 0:
+            return
+        self.pending_ids.append(len(self.file_names))
+        self.file_names.append(file_result['filename'])
+        self.pending.append(file_result)
+        self.pending_rows += len(file_result['lengths'])
+        if self.pending_rows >= self.batch_size:
+            self._convert_pending()
+
+    '''
+    The method converts appended file results into a batch of arrays
+    '''
+    def _convert_pending(self):
+        if self.pending:
+            self.batches.append(batch_to_columns(self.pending, self.pending_ids))
+        self.pending = []
+        self.pending_ids = []
+        self.pending_rows = 0
+
+    '''
+    The method classifies all rows and writes the tables
+
+    Arguments:
+      stats - StreakLengthStats of all streaks, used to assign outlier classes
+
+    Returns:
+      number of written rows
+    '''
+    def close(self, stats):
+        self._convert_pending()
+        for batch in self.batches:
+            batch['outlier_class'] = classify_streak_lengths(batch['major_axis_length'], stats)
+
+        if 'npz' in self.formats:
+            self._write_npz()
+        if 'csv' in self.formats:
+            self._write_csv()
+        if 'parquet' in self.formats:
+            self._write_parquet()
+        return sum(len(batch['file_id']) for batch in self.batches)
+
+    def _write_npz(self):
+        columns = {}
+        for name, dtype in REGION_COLUMNS + [('outlier_class', np.int8)]:
+            columns[name] = np.concatenate([batch[name] for batch in self.batches] + [np.zeros(0, dtype)])
+        profile_lengths = np.concatenate([batch['profile_lengths'] for batch in self.batches] + [np.zeros(0, np.int64)])
+        columns['profile_offsets'] = np.concatenate([[0], np.cumsum(profile_lengths)])
+        columns['profile_values'] = np.concatenate([batch['profile_values'] for batch in self.batches] +
+                                                   [np.zeros(0, np.float64)])
+        columns['file_names'] = np.array(self.file_names, dtype=str)
+        np.savez(self.base_path + '.npz', **columns)
+
+    def _write_csv(self):
+        with open(self.base_path + '.csv', 'w', newline='') as output:
+            writer = csv.writer(output)
+            writer.writerow(CSV_HEADER)
+            for batch in self.batches:
+                writer.writerows(csv_rows(batch, self.file_names))
+
+    def _write_parquet(self):
+        pyarrow = import_pyarrow()
+        writer = None
+        try:
+            for batch in self.batches:
+                offsets = np.concatenate([[0], np.cumsum(batch['profile_lengths'])])
+                columns = {'file': pyarrow.array([self.file_names[i] for i in batch['file_id'].tolist()])}
+                for name, _ in REGION_COLUMNS[1:]:
+                    columns[name] = pyarrow.array(batch[name])
+                columns['outlier_class'] = pyarrow.array(batch['outlier_class'])
+                columns['profile'] = pyarrow.ListArray.from_arrays(pyarrow.array(offsets.astype(np.int32)),
+                                                                   pyarrow.array(batch['profile_values']))
+                table = pyarrow.table(columns)
+                if writer is None:
+                    writer = pyarrow.parquet.ParquetWriter(self.base_path + '.parquet', table.schema)
+                writer.write_table(table)
+        finally:
+            if writer is not None:
+                writer.close()
+
+
+'''
+Writer appending rows of streaks to a CSV table as soon as they are known, used when files are processed one by one
+and outlier classes are assigned with statistics known at that moment. The header is written only to a new file
+
+Arguments:
+  path - path of the CSV file
+'''
+class RegionCsvAppender:
+    def __init__(self, path):
+        new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+        self.output = open(path, 'a', newline='')
+        self.writer = csv.writer(self.output)
+        if new_file:
+            self.writer.writerow(CSV_HEADER)
+
+    '''
+    The method appends rows of streaks found in one file
+
+    Arguments:
+      file_result - dict returned by describe_streaks
+      classes - array with outlier class of each streak
+    '''
+    def append(self, file_result, classes):
+        if len(file_result['lengths']) == 0:
+            return
+        columns = batch_to_columns([file_result], [0])
+        columns['outlier_class'] = classes
+        self.writer.writerows(csv_rows(columns, [file_result['filename']]))
+        self.output.flush()
+
+    def close(self):
+        self.output.close()
+
+
+'''
+The function loads table written in NPZ format
+
+Arguments:
+  base_path - path of the table files, without extension
+
+Returns:
+  dict where key - column name, value - array; besides REGION_COLUMNS and 'outlier_class' it holds 'file_names'
+  (name of file for each file_id), 'profile_offsets' and 'profile_values'
+'''
+def load_region_table(base_path=TABLE_BASENAME):
+    with np.load(base_path + '.npz') as data:
+        return {name: data[name] for name in data.files}
+
+
+'''
+The function returns brightness profile of a row of loaded table
+
+Arguments:
+  table - dict returned by load_region_table
+  row - index of the row
+
+Returns:
+  array with brightness profile
+'''
+def region_profile(table, row):
+    offsets = table['profile_offsets']
+    return table['profile_values'][offsets[row]:offsets[row + 1]]
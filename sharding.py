@@ -0,0 +1,364 @@
+#
+# Module splitting a scan of the catalog between several nodes and merging their results.
+#
+# Each node processes a deterministic slice (shard) of the frames of the catalog: a frame belongs to shard
+# hash(name) mod shards, where the hash is SHA-1 of the file name, so every node chooses the same frames whatever the
+# order in which it lists the catalog, and new frames do not move old ones to other shards. Instead of analytics, a
+# node writes a partial result file, with one JSON record per line:
+#
+#   first line   - header: 'shard', 'shards', 'catalog' and 'settings' the results were computed with
+#   next lines   - one record per frame: 'count' of streaks, 'timestamp' (modification time of the frame), 'cached'
+#                  (whether the result was taken from the result cache) and 'result', the dict returned by
+#                  describe_streaks
+#   last line    - summary: number of 'files' and 'stats', StreakLengthStats of all streaks of the shard
+#
+# The file is written under a temporary name and renamed when complete, so a partial file always has its summary.
+# Outlier classes depend on statistics of all streaks, so they are assigned by merge_partials: it checks that the
+# partial files come from the same sharding and settings and cover all shards, merges statistics of the shards,
+# classifies streaks of all frames, and writes analytics, the list of frames without streaks (to be sorted with
+# postprocessing.sort_files) and, optionally, tables and the SQLite index of all streaks.
+#
+# run_local_shards runs the nodes as separate local processes, e.g. to test the sharding on one host.
+#
+
+#importing packages for serialization, hashing and parallel processing
+import json
+import hashlib
+import multiprocessing
+
+#importing packages supporting filesystem path walking
+import os
+
+#importing functions from custom modules
+from image_processing import merge_file_result
+from postprocessing import sort_event_outliers, write_analytics, StreakLengthStats
+from results import ScanResults
+from results_table import RegionTableWriter, DEFAULT_TABLE_FORMATS
+from streak_index import StreakIndexWriter
+from global_variables import PARTIAL_FILENAME
+from instrumentation import stage, count
+
+#constants and default values
+
+#version of partial result files, changed whenever their records change
+PARTIAL_FORMAT_VERSION = 3
+
+
+'''
+The function parses shard specification given as 'INDEX/SHARDS', e.g. '0/4' for the first of four shards
+
+Arguments:
+  spec - shard specification
+
+Returns:
+  tuple (index, shards)
+'''
+def parse_shard_spec(spec):
+    try:
+        index, shards = (int(part) for part in spec.split('/'))
+    except ValueError:
+        raise ValueError('shard ' + repr(spec) + ' should be given as INDEX/SHARDS, e.g. 0/4')
+    if shards < 1 or not 0 <= index < shards:
+        raise ValueError('shard index should be between 0 and ' + str(shards - 1) + ', got ' + repr(spec))
+    return index, shards
+
+
+'''
+The function returns shard of a frame
+
+Arguments:
+  img_filename - path or name of the frame; only the name is hashed
+  shards - number of shards
+
+Returns:
+  index of the shard, between 0 and shards - 1
+'''
+def shard_of(img_filename, shards):
+    digest = hashlib.sha1(os.path.basename(img_filename).encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') % shards
+
+
+'''
+The function selects frames of one shard
+
+Arguments:
+  img_filenames - paths of frames of the catalog
+  shard - tuple (index, shards)
+
+Returns:
+  list of paths of frames of the shard, in the order of img_filenames
+'''
+def select_shard(img_filenames, shard):
+    index, shards = shard
+    return [f for f in img_filenames if shard_of(f, shards) == index]
+
+
+'''
+The function returns path of a file of one shard, e.g. of its cache, so local processes do not share files
+
+Arguments:
+  path - path of the file
+  shard - tuple (index, shards)
+
+Returns:
+  path with '.shard-INDEX-of-SHARDS' inserted before the extension
+'''
+def shard_path(path, shard):
+    root, extension = os.path.splitext(path)
+    return root + '.shard-%d-of-%d' % shard + extension
+
+
+'''
+The function returns default name of the partial result file of a shard
+'''
+def default_partial_filename(shard):
+    return PARTIAL_FILENAME % shard
+
+
+'''
+Writer of the partial result file of a shard
+
+Arguments:
+  path - path of the partial result file
+  shard - tuple (index, shards)
+  catalog - directory containing the frames
+  settings - dict with settings influencing results, see main.find_and_classify_events
+'''
+class PartialResultWriter:
+    def __init__(self, path, shard, catalog, settings):
+        self.path = path
+        self.temporary = path + '.tmp'
+        self.files = 0
+        self.output = open(self.temporary, 'w')
+        self._write({'shard': shard[0], 'shards': shard[1], 'catalog': os.path.abspath(catalog),
+                     'settings': settings, 'partial_format_version': PARTIAL_FORMAT_VERSION})
+
+    def _write(self, record):
+        self.output.write(json.dumps(record) + '\n')
+
+    '''
+    The method appends result of one frame
+
+    Arguments:
+      file_result - dict returned by describe_streaks
+      timestamp - modification time of the frame
+      cached - whether the result was taken from the result cache
+    '''
+    def append(self, file_result, timestamp=None, cached=False):
+        self._write({'count': len(file_result['lengths']), 'timestamp': timestamp, 'cached': cached,
+                     'result': file_result})
+        self.files += 1
+
+    '''
+    The method writes the summary and gives the file its final name
+
+    Arguments:
+      stats - StreakLengthStats of all streaks of the shard
+    '''
+    def close(self, stats):
+        self._write({'summary': {'files': self.files, 'stats': stats.to_dict()}})
+        self.output.flush()
+        os.fsync(self.output.fileno())
+        self.output.close()
+        os.replace(self.temporary, self.path)
+
+
+'''
+The function reads the partial result file of a shard
+
+Arguments:
+  path - path of the partial result file
+
+Returns:
+  header - dict with 'shard', 'shards', 'catalog' and 'settings'
+  results - generator of (file result, timestamp of the frame, whether the result was cached), to be consumed before
+  summary is used
+  summary - dict with 'files' and 'stats', filled when results are consumed
+'''
+def read_partial(path):
+    f = open(path)
+    header = json.loads(f.readline() or 'null')
+    if not isinstance(header, dict) or header.get('partial_format_version') != PARTIAL_FORMAT_VERSION:
+        f.close()
+        raise ValueError(path + ' is not a partial result file of this version')
+    summary = {}
+
+    def results():
+        with f:
+            files = 0
+            for line in f:
+                record = json.loads(line)
+                if 'summary' in record:
+                    summary.update(record['summary'])
+                    break
+                files += 1
+                yield record['result'], record['timestamp'], record['cached']
+        if summary.get('files') != files:
+            raise ValueError(path + ' is incomplete: ' + str(files) + ' records of files, summary ' + repr(summary))
+
+    return header, results(), summary
+
+
+'''
+The function checks that partial result files come from one sharded scan and cover all its shards
+
+Arguments:
+  headers - list of (path, header) of the partial result files
+
+Returns:
+  headers sorted by shard index
+'''
+def check_partials(headers):
+    if not headers:
+        raise ValueError('no partial result files to merge')
+    _, first = headers[0]
+    for path, header in headers:
+        if header['shards'] != first['shards']:
+            raise ValueError(path + ' comes from a scan split into ' + str(header['shards']) + ' shards, not ' +
+                             str(first['shards']))
+        if header['settings'] != first['settings']:
+            raise ValueError(path + ' was computed with settings ' + repr(header['settings']) + ', not ' +
+                             repr(first['settings']))
+    indexes = sorted(header['shard'] for _, header in headers)
+    if indexes != list(range(first['shards'])):
+        missing = sorted(set(range(first['shards'])) - set(indexes))
+        duplicated = sorted(set(i for i in indexes if indexes.count(i) > 1))
+        raise ValueError('partial result files do not cover each shard once, missing shards: ' + repr(missing) +
+                         ', duplicated shards: ' + repr(duplicated))
+    return sorted(headers, key=lambda item: item[1]['shard'])
+
+
+'''
+The function merges partial result files of all shards: it classifies streaks using statistics of all shards and
+writes analytics, the list of frames without streaks and, optionally, tables of all streaks
+
+Arguments:
+  partial_filenames - paths of partial result files, one for each shard
+  output_filename - name of file where statistics of each frame are written, like by main.find_and_classify_events
+  no_events_filename - name of file where names of frames without streaks are written, one per line; None does not
+  write it
+  table_basename - path of tables with one row per streak, without extension; None disables the tables
+  table_formats - formats of the tables, any of 'npz', 'csv' and 'parquet'
+  index_filename - path of SQLite database where streaks of all shards are indexed, see streak_index module; None
+  disables the index
+
+Returns:
+  catalog - directory containing the frames, recorded by the first shard
+  events - list of filenames where streaks have been found, sorted
+  no_events - list of filenames with no streaks, sorted
+'''
+def merge_partials(partial_filenames, output_filename, no_events_filename=None, table_basename=None,
+                   table_formats=DEFAULT_TABLE_FORMATS, index_filename=None):
+    partials = [(path,) + read_partial(path) for path in partial_filenames]
+    check_partials([(path, header) for path, header, _, _ in partials])
+    partials.sort(key=lambda partial: partial[1]['shard'])
+
+    results = ScanResults()
+    table = RegionTableWriter(table_basename, table_formats) if table_basename is not None else None
+    index = StreakIndexWriter(index_filename, partials[0][1]['catalog']) if index_filename is not None else None
+
+    with stage('merge_partials'):
+        for path, header, file_results, summary in partials:
+            shard_results = ScanResults()
+            for file_result, timestamp, cached in file_results:
+                merge_file_result(file_result, shard_results)
+                if table is not None:
+                    table.append(file_result)
+                if index is not None:
+                    index.append(file_result, timestamp, cached)
+            #statistics of the shards are merged, instead of being computed again from all lengths
+            shard_results.stats = StreakLengthStats.from_dict(summary['stats'])
+            results.merge(shard_results)
+            count('partials_merged')
+    if index is not None:
+        index.close()
+    sort_event_outliers(results)
+
+    events = sorted(results.events())
+    no_events = sorted(results.no_events())
+    with stage('write_outputs'):
+        if table is not None:
+            table.close(results.stats)
+        with open(output_filename, 'w') as output:
+            write_analytics(output, sorted(results.event_summaries(), key=lambda summary: summary.name))
+        if no_events_filename is not None:
+            with open(no_events_filename, 'w') as f:
+                for filename in no_events:
+                    f.write(filename + '\n')
+    return partials[0][1]['catalog'], events, no_events
+
+
+'''
+The function reads the list of frames written by merge_partials
+
+Arguments:
+  no_events_filename - name of the file
+
+Returns:
+  list of filenames
+'''
+def read_file_list(no_events_filename):
+    with open(no_events_filename) as f:
+        return [line.rstrip('\n') for line in f if line.strip()]
+
+
+'''
+The function scans one shard in a separate process, see run_local_shards
+'''
+def run_shard(catalog, shard, partial_filename, options):
+    from main import find_and_classify_events
+
+    find_and_classify_events(catalog, None, shard=shard, partial_filename=partial_filename, **options)
+
+
+'''
+The function scans the catalog in several local processes, each standing in for a node processing one shard, and
+merges their partial result files. Files written by each node (cache, background model, artifact store) get names
+of its shard, see shard_path, so the processes do not share them; the index of streaks is written by the merge
+
+Arguments:
+  catalog - directory containing the frames
+  shards - number of shards, i.e. processes
+  output_filename - name of file where statistics of each frame are written
+  partial_dir - directory where partial result files are written
+  no_events_filename - name of file where names of frames without streaks are written, None does not write it
+  table_basename - path of tables with one row per streak, without extension; None disables the tables
+  table_formats - formats of the tables
+  options - other keyword arguments of main.find_and_classify_events, passed to each node
+
+Returns:
+  events - list of filenames where streaks have been found, sorted
+  no_events - list of filenames with no streaks, sorted
+'''
+def run_local_shards(catalog, shards, output_filename, partial_dir='.', no_events_filename=None, table_basename=None,
+                     table_formats=DEFAULT_TABLE_FORMATS, **options):
+    os.makedirs(partial_dir, exist_ok=True)
+    partial_filenames = []
+    processes = []
+    for index in range(shards):
+        shard = (index, shards)
+        node_options = dict(options)
+        for name in ('cache_filename', 'background_filename'):
+            if node_options.get(name) is not None:
+                node_options[name] = shard_path(node_options[name], shard)
+        if node_options.get('artifact_mode') == 'store':
+            from region_processing import default_profiles_root
+            profiles_root = node_options.get('profiles_root') or default_profiles_root(catalog)
+            node_options['profiles_root'] = shard_path(profiles_root, shard)
+        partial_filename = os.path.join(partial_dir, default_partial_filename(shard))
+        partial_filenames.append(partial_filename)
+        process = multiprocessing.Process(target=run_shard, args=(catalog, shard, partial_filename, node_options))
+        process.start()
+        processes.append(process)
+
+    failed = []
+    for index, process in enumerate(processes):
+        process.join()
+        if process.exitcode != 0:
+            failed.append(index)
+    if failed:
+        raise RuntimeError('scanning of shards ' + repr(failed) + ' failed')
+
+    _, events, no_events = merge_partials(partial_filenames, output_filename, no_events_filename, table_basename,
+                                          table_formats, options.get('index_filename'))
+    return events, no_events
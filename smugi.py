@@ -0,0 +1,590 @@
+#
+# Command line entry point, run from the repository root:
+#
+#   python -m smugi scan [options]     find and classify streaks in all images of the catalog
+#   python -m smugi watch [options]    process new images of the catalog as they appear
+#   python -m smugi render [options]   draw plots of streaks again, from the table written by scan
+#   python -m smugi stack [options]    find streaks in pages of multi-page TIFF files, processed as stacks
+#   python -m smugi merge [options]    merge partial results of shards of the catalog scanned by several nodes
+#   python -m smugi serve [options]    keep detection warm and answer requests for single frames over a socket
+#   python -m smugi query [options]    find streaks in the index written by scan, without processing images
+#   python -m smugi relocate [options] finish or roll back moving of images interrupted by a crash
+#   python -m smugi bench [options]    run benchmarks, options are passed to benchmarks.run
+#
+# Modules doing the work (and numpy, skimage, matplotlib imported by them) are imported only by the subcommand
+# which needs them, so the parser and --help start without loading them.
+#
+
+#importing packages for command line parsing
+import argparse
+import os
+import sys
+
+#constants and default values
+from global_variables import DATA_LOCATION_CATALOG, MIN_STREAK_AREA, OUTPUT_FILENAME, CACHE_FILENAME, TABLE_BASENAME, \
+    INDEX_FILENAME, BACKGROUND_FILENAME, NO_EVENTS_FILENAME, SERVER_SOCKET_FILENAME
+
+
+'''
+The function checks threshold specification given in the command line
+
+Arguments:
+  spec - threshold specification, see thresholds.parse_threshold_spec
+
+Returns:
+  the specification, unchanged
+'''
+def threshold_spec(spec):
+    from thresholds import parse_threshold_spec
+
+    try:
+        parse_threshold_spec(spec)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+    return spec
+
+
+'''
+The function checks raw format specification given in the command line
+
+Arguments:
+  spec - raw format specification, see frame_readers.parse_raw_format
+
+Returns:
+  the specification, unchanged
+'''
+def raw_format_spec(spec):
+    from frame_readers import parse_raw_format
+
+    try:
+        parse_raw_format(spec)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+    return spec
+
+
+'''
+The function adds option declaring format of raw files
+'''
+def add_raw_format_argument(parser):
+    parser.add_argument('--raw-format', type=raw_format_spec, metavar='HEIGHTxWIDTH:DTYPE[:offset=BYTES]',
+                        help='shape and type of pixels of .raw files, e.g. 4096x4096:uint16; .raw files are '
+                             'processed only when it is given (.npy and FITS files are memory mapped, PNG and TIFF '
+                             'are decoded)')
+
+
+'''
+The function checks shard specification given in the command line
+
+Arguments:
+  spec - shard specification, see sharding.parse_shard_spec
+
+Returns:
+  tuple (index, shards)
+'''
+def shard_spec(spec):
+    from sharding import parse_shard_spec
+
+    try:
+        return parse_shard_spec(spec)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+'''
+The function adds options shared by subcommands detecting streaks
+'''
+def add_detection_arguments(parser):
+    parser.add_argument('--catalog', default=DATA_LOCATION_CATALOG, help='directory containing images to process')
+    parser.add_argument('--output', default=OUTPUT_FILENAME, help='file where statistics of each image are written')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of worker processes, 1 (default) processes files serially')
+    parser.add_argument('--threshold', type=threshold_spec, default=None, metavar='STRATEGY[:NAME=VALUE,...]',
+                        help='strategy used to compute the threshold of each image, with optional parameters, '
+                             'e.g. max_fraction:fraction=0.1; strategies: max_fraction (default), otsu, percentile, '
+                             'histogram')
+    parser.add_argument('--min-area', type=int, default=MIN_STREAK_AREA,
+                        help='minimal area of region, in pixels, to be counted as streak')
+    parser.add_argument('--tile-size', type=int, metavar='PIXELS',
+                        help='process images in tiles of this size, with the same results, to limit memory used '
+                             'for very large images')
+    add_raw_format_argument(parser)
+    parser.add_argument('--prescreen', choices=['exact', 'fast', 'off'], default='exact',
+                        help='reject images without streaks on coarse block counts before the full resolution '
+                             'detection: exact (default) never misses a streak, fast rejects more images but may miss '
+                             'streaks enlarged by closing, off processes every image fully')
+    parser.add_argument('--no-plots', action='store_true', help='do not draw brightness profiles and rotation angles')
+    parser.add_argument('--background', action='store_true',
+                        help='subtract background and mask hot pixels before thresholding, with a model built from '
+                             'a sample of images and updated with new images by each run')
+    parser.add_argument('--background-model', default=BACKGROUND_FILENAME,
+                        help='with --background, file caching the background model')
+    add_plot_arguments(parser)
+    add_instrument_arguments(parser)
+
+
+'''
+The function adds options choosing where and how plots are saved
+'''
+def add_plot_arguments(parser):
+    parser.add_argument('--profiles-dir',
+                        help='directory where plots are saved, by default brightness_profile in the catalog')
+    parser.add_argument('--artifacts', choices=['plots', 'sheet', 'store'], default='plots',
+                        help='plots (default): profile and reference PNG files of each streak; sheet: one contact '
+                             'sheet PNG file of each image; store: profiles and fragments of all streaks in chunked '
+                             'NPZ files, without drawing')
+
+
+'''
+The function adds options of instrumentation
+'''
+def add_instrument_arguments(parser):
+    parser.add_argument('--instrument', action='store_true',
+                        help='measure time of each stage and count processed data, print summary at the end')
+    parser.add_argument('--metrics-json', help='with --instrument, file where measurements are saved as JSON')
+    parser.add_argument('--metrics-prom', help='with --instrument, file where measurements are saved in Prometheus text format')
+
+
+'''
+The function adds option of the number of threads moving images
+'''
+def add_sort_workers_argument(parser):
+    parser.add_argument('--sort-workers', type=int, default=4,
+                        help='number of threads copying images when they are moved to another filesystem')
+
+
+'''
+The function adds options of moving images without streaks
+'''
+def add_sort_arguments(parser):
+    parser.add_argument('--no-sort', action='store_true', help='do not move images without streaks to no_events')
+    parser.add_argument('--sort-dir', default='no_events/',
+                        help='subfolder of the catalog, or absolute path e.g. on another volume, where images without '
+                             'streaks are moved')
+    parser.add_argument('--sort-mode', choices=['move', 'hardlink', 'manifest'], default='move',
+                        help='move images without streaks (default), link them leaving the originals in the catalog, '
+                             'or only list them in manifest.txt')
+    add_sort_workers_argument(parser)
+
+
+'''
+The function adds options of tables with one row per streak
+'''
+def add_table_arguments(parser):
+    parser.add_argument('--table', default=TABLE_BASENAME,
+                        help='path of tables with one row per streak, without extension')
+    parser.add_argument('--table-formats', default='npz,csv',
+                        help='comma separated formats of the tables: npz, csv, parquet (needs pyarrow)')
+    parser.add_argument('--no-table', action='store_true', help='do not write tables with one row per streak')
+
+
+'''
+The function returns threshold specification chosen in the command line
+'''
+def chosen_threshold(args):
+    if args.threshold is not None:
+        return args.threshold
+    from thresholds import DEFAULT_THRESHOLD_STRATEGY
+    return DEFAULT_THRESHOLD_STRATEGY
+
+
+'''
+The function returns prescreening mode chosen in the command line, None when prescreening is off
+'''
+def chosen_prescreen(args):
+    return None if args.prescreen == 'off' else args.prescreen
+
+
+'''
+The function returns file of the background model chosen in the command line, None when background is not
+subtracted
+'''
+def chosen_background(args):
+    return args.background_model if args.background else None
+
+
+'''
+The function runs a subcommand, measuring it when --instrument is given. When images are prescreened, the number of
+rejected images is reported too
+
+Arguments:
+  args - parsed command line
+  run - function running the subcommand, without arguments
+
+Returns:
+  exit code
+'''
+def run_instrumented(args, run):
+    if args.instrument:
+        import instrumentation
+        instrumentation.enable()
+    run()
+    if getattr(args, 'prescreen', 'off') != 'off':
+        from prescreen import rejection_summary
+        summary = rejection_summary()
+        if summary is not None:
+            print(summary)
+    if args.instrument:
+        print(instrumentation.summary_table())
+        instrumentation.write_report(args.metrics_json, args.metrics_prom)
+    return 0
+
+
+def command_scan(args):
+    if args.watch:
+        return command_watch(args)
+    if args.local_shards is not None:
+        return command_local_shards(args)
+
+    from main import find_and_classify_events
+    from postprocessing import sort_files
+    from instrumentation import stage
+
+    def run():
+        events, no_events = find_and_classify_events(args.catalog, args.output, args.workers, chosen_threshold(args),
+                                                     None if args.no_cache else args.cache, not args.no_plots,
+                                                     args.plots_sample, args.render_workers,
+                                                     None if args.no_table else args.table,
+                                                     args.table_formats.split(','), args.min_area, args.profiles_dir,
+                                                     args.tile_size, args.raw_format, chosen_prescreen(args),
+                                                     args.artifacts, None if args.no_index else args.index,
+                                                     chosen_background(args), args.prefetch, args.prefetch_memory << 20,
+                                                     args.shard, args.partial, args.stack, args.tracks)
+        #images of a shard are sorted by merge, which knows the results of all shards
+        if not args.no_sort and args.shard is None:
+            with stage('sort_files'):
+                sort_files(no_events, args.sort_dir, args.catalog, args.sort_mode, args.sort_workers)
+
+    return run_instrumented(args, run)
+
+
+def command_local_shards(args):
+    from sharding import run_local_shards
+    from postprocessing import sort_files
+    from instrumentation import stage
+
+    def run():
+        events, no_events = run_local_shards(args.catalog, args.local_shards, args.output, args.partial_dir,
+                                             NO_EVENTS_FILENAME, None if args.no_table else args.table,
+                                             args.table_formats.split(','), workers=args.workers,
+                                             threshold_strategy=chosen_threshold(args),
+                                             cache_filename=None if args.no_cache else args.cache,
+                                             plots=not args.no_plots, plots_sample=args.plots_sample,
+                                             render_workers=args.render_workers, min_area=args.min_area,
+                                             profiles_root=args.profiles_dir, tile_size=args.tile_size,
+                                             raw_format=args.raw_format, prescreen=chosen_prescreen(args),
+                                             artifact_mode=args.artifacts,
+                                             index_filename=None if args.no_index else args.index,
+                                             background_filename=chosen_background(args),
+                                             prefetch_depth=args.prefetch, prefetch_memory=args.prefetch_memory << 20,
+                                             stack_size=args.stack)
+        if not args.no_sort:
+            with stage('sort_files'):
+                sort_files(no_events, args.sort_dir, args.catalog, args.sort_mode, args.sort_workers)
+
+    return run_instrumented(args, run)
+
+
+def command_stack(args):
+    from stack_processing import find_events_in_pages, TrackLinker
+    from results import ScanResults
+    from postprocessing import sort_event_outliers, write_analytics
+
+    def run():
+        results = ScanResults()
+        linker = TrackLinker(args.tracks) if args.tracks is not None else None
+        for filename in args.files:
+            for file_result in find_events_in_pages(filename, chosen_threshold(args), args.min_area, args.stack_size):
+                results.add_file(file_result)
+                if linker is not None:
+                    linker.add(file_result)
+        sort_event_outliers(results)
+        with open(args.output, 'w') as output:
+            write_analytics(output, results.event_summaries())
+        print('found streaks in ' + str(len(results.events())) + ' of ' + str(len(results.files)) + ' frames')
+        if linker is not None:
+            print('linked streaks into ' + str(linker.close()) + ' tracks')
+
+    return run_instrumented(args, run)
+
+
+def command_merge(args):
+    from sharding import merge_partials
+    from postprocessing import sort_files
+    from instrumentation import stage
+
+    def run():
+        catalog, events, no_events = merge_partials(args.partials, args.output, args.no_events_list,
+                                                    None if args.no_table else args.table,
+                                                    args.table_formats.split(','),
+                                                    None if args.no_index else args.index)
+        print('merged ' + str(len(args.partials)) + ' shards: ' + str(len(events)) + ' images with streaks, ' +
+              str(len(no_events)) + ' without')
+        #images are sorted in the catalog recorded by the shards, unless another one is given
+        if not args.no_sort:
+            with stage('sort_files'):
+                sort_files(no_events, args.sort_dir, args.catalog or catalog, args.sort_mode, args.sort_workers)
+
+    return run_instrumented(args, run)
+
+
+def command_watch(args):
+    from watcher import watch_catalog
+
+    def run():
+        watch_catalog(args.catalog, args.output, None if args.no_table else args.table + '.csv', args.workers,
+                      chosen_threshold(args), not args.no_plots, getattr(args, 'max_pending', None),
+                      getattr(args, 'stop_after', None), args.process_existing, args.min_area, args.profiles_dir,
+                      args.tile_size, args.raw_format, chosen_prescreen(args), args.artifacts,
+                      chosen_background(args))
+
+    return run_instrumented(args, run)
+
+
+def command_serve(args):
+    from detection_server import create_server, run_server
+
+    def run():
+        server = create_server(None if args.port is not None else args.socket, args.port, args.workers,
+                               chosen_threshold(args), args.min_area, args.tile_size, args.raw_format,
+                               chosen_prescreen(args), chosen_background(args))
+        run_server(server)
+
+    return run_instrumented(args, run)
+
+
+def command_render(args):
+    from results_table import load_region_table
+    from region_processing import render_region_table
+
+    def run():
+        rendered = render_region_table(load_region_table(args.table), args.catalog, args.render_workers,
+                                       args.profiles_dir, args.raw_format, args.artifacts)
+        print('rendered plots of ' + str(rendered) + ' streaks')
+
+    return run_instrumented(args, run)
+
+
+'''
+The function converts time given in the command line, as seconds since the epoch or ISO 8601 date and time, into
+seconds since the epoch
+'''
+def timestamp_arg(value):
+    import datetime
+
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return datetime.datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        raise argparse.ArgumentTypeError('time ' + repr(value) + ' should be seconds since the epoch or ISO 8601 '
+                                         'date, e.g. 2024-05-01 or 2024-05-01T22:00')
+
+
+def command_query(args):
+    import time
+    from streak_index import query_streaks
+
+    since = args.since
+    if args.last_days is not None:
+        since = time.time() - args.last_days * 86400
+
+    def run():
+        result = query_streaks(args.index, args.min_length, args.max_length, args.min_area, args.max_area,
+                               args.orientation, args.tolerance, since, args.until, args.rows, args.cols, args.file,
+                               args.limit, args.count)
+        if args.count:
+            print(result)
+            return
+        columns = ['path', 'label', 'timestamp', 'length', 'area', 'orientation', 'centroid_row', 'centroid_col']
+        print(' '.join(columns))
+        for row in result:
+            print(' '.join(str(row[c]) for c in columns))
+
+    return run_instrumented(args, run)
+
+
+def command_relocate(args):
+    from relocation import resume_relocation, rollback_relocation
+
+    destination = os.path.join(args.catalog, args.folder)
+
+    def run():
+        if args.rollback:
+            print('brought back ' + str(rollback_relocation(destination, args.sort_workers)) + ' files')
+        else:
+            print('relocated ' + str(resume_relocation(destination, args.sort_workers)) + ' files')
+
+    return run_instrumented(args, run)
+
+
+def command_bench(args):
+    from benchmarks.run import main as bench_main
+    return bench_main(args.bench_args)
+
+
+'''
+The function builds parser of the command line
+'''
+def build_parser():
+    parser = argparse.ArgumentParser(prog='smugi', description='Detection and classification of streaks in images')
+    subparsers = parser.add_subparsers(dest='command', metavar='COMMAND')
+    subparsers.required = True
+
+    scan = subparsers.add_parser('scan', help='find and classify streaks in all images of the catalog')
+    add_detection_arguments(scan)
+    scan.add_argument('--cache', default=CACHE_FILENAME,
+                      help='file storing results of processed images, so they are skipped in later runs')
+    scan.add_argument('--no-cache', action='store_true', help='process all images, without reading or writing cache')
+    scan.add_argument('--plots-sample', type=int, default=1, metavar='K',
+                      help='draw plots only for every K-th image of the catalog')
+    scan.add_argument('--render-workers', type=int, default=1,
+                      help='number of processes drawing plots, separate from the detection workers')
+    add_table_arguments(scan)
+    scan.add_argument('--prefetch', type=int, default=2, metavar='K',
+                      help='number of images read ahead of the processed one, in each worker; 0 disables reading '
+                           'ahead')
+    scan.add_argument('--prefetch-memory', type=int, default=512, metavar='MB',
+                      help='memory of decoded images read ahead, in each worker, in megabytes')
+    scan.add_argument('--index', default=INDEX_FILENAME,
+                      help='SQLite database where streaks of all processed images are indexed, see the query command')
+    scan.add_argument('--no-index', action='store_true', help='do not index streaks')
+    add_sort_arguments(scan)
+    scan.add_argument('--stack', type=int, default=1, metavar='N',
+                      help='process N consecutive images (in the order of names) as one stack, with thresholding, '
+                           'closing and labelling run once for the stack; images are not prescreened nor tiled')
+    scan.add_argument('--tracks', help='link streaks of consecutive images into tracks, written to this file')
+    scan.add_argument('--shard', type=shard_spec, metavar='INDEX/SHARDS',
+                      help='process only one shard of the images, e.g. 0/4 on the first of four nodes, and write '
+                           'its results to a partial file instead of statistics, tables and index; partial files of all '
+                           'shards are combined by the merge command')
+    scan.add_argument('--partial', help='with --shard, partial result file, by default partial_INDEX_of_SHARDS.jsonl')
+    scan.add_argument('--local-shards', type=int, metavar='SHARDS',
+                      help='scan the shards in the given number of local processes standing in for nodes, then '
+                           'merge their partial files')
+    scan.add_argument('--partial-dir', default='.', help='with --local-shards, directory of partial result files')
+    scan.add_argument('--watch', action='store_true', help='the same as the watch command')
+    scan.add_argument('--process-existing', action='store_true',
+                      help='with --watch, process images already present in the catalog first')
+    scan.set_defaults(handler=command_scan)
+
+    watch = subparsers.add_parser('watch', help='process new images of the catalog as they appear')
+    add_detection_arguments(watch)
+    watch.add_argument('--table', default=TABLE_BASENAME,
+                       help='path of CSV table with one row per streak, without extension; rows are appended')
+    watch.add_argument('--no-table', action='store_true', help='do not write table with one row per streak')
+    watch.add_argument('--process-existing', action='store_true',
+                       help='process images already present in the catalog first')
+    watch.add_argument('--max-pending', type=int,
+                       help='maximal number of images queued or being processed, by default twice the workers')
+    watch.add_argument('--stop-after', type=int, help='stop after processing given number of images')
+    watch.set_defaults(handler=command_watch)
+
+    render = subparsers.add_parser('render', help='draw plots of streaks again, from the table written by scan')
+    render.add_argument('--catalog', default=DATA_LOCATION_CATALOG, help='directory containing the images')
+    render.add_argument('--table', default=TABLE_BASENAME, help='path of NPZ table written by scan, without extension')
+    render.add_argument('--render-workers', type=int, default=1, help='number of processes drawing plots')
+    add_plot_arguments(render)
+    add_raw_format_argument(render)
+    add_instrument_arguments(render)
+    render.set_defaults(handler=command_render)
+
+    stack = subparsers.add_parser('stack', help='find streaks in pages of multi-page TIFF files, processed as stacks')
+    stack.add_argument('files', nargs='+', help='multi-page TIFF files, or 3D .npy files, pages are frames')
+    stack.add_argument('--output', default=OUTPUT_FILENAME, help='file where statistics of each page are written')
+    stack.add_argument('--stack-size', type=int, default=8, help='number of pages processed at once')
+    stack.add_argument('--threshold', type=threshold_spec, default=None, metavar='STRATEGY[:NAME=VALUE,...]',
+                       help='strategy used to compute the threshold of each page, see scan')
+    stack.add_argument('--min-area', type=int, default=MIN_STREAK_AREA,
+                       help='minimal area of region, in pixels, to be counted as streak')
+    stack.add_argument('--tracks', help='link streaks of consecutive pages into tracks, written to this file')
+    add_instrument_arguments(stack)
+    stack.set_defaults(handler=command_stack)
+
+    merge = subparsers.add_parser('merge', help='merge partial results of shards of the catalog scanned by several '
+                                                'nodes with scan --shard')
+    merge.add_argument('partials', nargs='+', help='partial result files, one of each shard')
+    merge.add_argument('--output', default=OUTPUT_FILENAME, help='file where statistics of each image are written')
+    merge.add_argument('--no-events-list', default=NO_EVENTS_FILENAME,
+                       help='file where names of images without streaks are written, one per line')
+    add_table_arguments(merge)
+    merge.add_argument('--index', default=INDEX_FILENAME,
+                       help='SQLite database where streaks of all shards are indexed, see the query command')
+    merge.add_argument('--no-index', action='store_true', help='do not index streaks')
+    merge.add_argument('--catalog', help='directory containing the images, by default the one recorded by the shards')
+    add_sort_arguments(merge)
+    add_instrument_arguments(merge)
+    merge.set_defaults(handler=command_merge)
+
+    serve = subparsers.add_parser('serve', help='keep detection warm and answer requests for single frames over a '
+                                                'socket, see detection_server module')
+    serve.add_argument('--socket', default=SERVER_SOCKET_FILENAME, help='path of the Unix domain socket to listen on')
+    serve.add_argument('--port', type=int, help='listen on this port of localhost instead of the Unix socket')
+    serve.add_argument('--workers', type=int, default=2, help='number of worker processes detecting streaks')
+    serve.add_argument('--threshold', type=threshold_spec, default=None, metavar='STRATEGY[:NAME=VALUE,...]',
+                       help='strategy used to compute the threshold of each frame, see scan')
+    serve.add_argument('--min-area', type=int, default=MIN_STREAK_AREA,
+                       help='minimal area of region, in pixels, to be counted as streak')
+    serve.add_argument('--tile-size', type=int, metavar='PIXELS', help='process frames in tiles of this size')
+    add_raw_format_argument(serve)
+    serve.add_argument('--prescreen', choices=['exact', 'fast', 'off'], default='exact',
+                       help='reject frames without streaks on coarse block counts first, see scan')
+    serve.add_argument('--background', action='store_true',
+                       help='subtract background and mask hot pixels with the model cached by scan --background')
+    serve.add_argument('--background-model', default=BACKGROUND_FILENAME, help='file of the background model')
+    add_instrument_arguments(serve)
+    serve.set_defaults(handler=command_serve)
+
+    query = subparsers.add_parser('query', help='find streaks in the index written by scan, without processing images')
+    query.add_argument('--index', default=INDEX_FILENAME, help='SQLite database written by scan')
+    query.add_argument('--min-length', type=float, help='minimal length of streak (major axis), in pixels')
+    query.add_argument('--max-length', type=float, help='maximal length of streak, in pixels')
+    query.add_argument('--min-area', type=int, help='minimal area of streak, in pixels')
+    query.add_argument('--max-area', type=int, help='maximal area of streak, in pixels')
+    query.add_argument('--orientation', type=float, help='orientation of streak, in radians from the row axis')
+    query.add_argument('--tolerance', type=float, default=0.1,
+                       help='with --orientation, maximal difference of orientation, in radians (default 0.1)')
+    query.add_argument('--since', type=timestamp_arg, help='earliest modification time of the image')
+    query.add_argument('--until', type=timestamp_arg, help='latest modification time of the image')
+    query.add_argument('--last-days', type=float, help='only images modified in the given number of last days')
+    query.add_argument('--rows', type=float, nargs=2, metavar=('LOW', 'HIGH'), help='range of centroid row')
+    query.add_argument('--cols', type=float, nargs=2, metavar=('LOW', 'HIGH'), help='range of centroid column')
+    query.add_argument('--file', help='only streaks of this image, given by path or name')
+    query.add_argument('--limit', type=int, help='maximal number of printed streaks')
+    query.add_argument('--count', action='store_true', help='print only the number of matching streaks')
+    add_instrument_arguments(query)
+    query.set_defaults(handler=command_query)
+
+    relocate = subparsers.add_parser('relocate',
+                                     help='finish or roll back moving of images interrupted by a crash, '
+                                          'using the journal in the destination')
+    relocate.add_argument('--catalog', default=DATA_LOCATION_CATALOG, help='directory containing the images')
+    relocate.add_argument('--folder', default='no_events/',
+                          help='subfolder of the catalog, or absolute path, where the images were moved')
+    relocate.add_argument('--rollback', action='store_true',
+                          help='move the images back to the catalog instead of finishing the move')
+    add_sort_workers_argument(relocate)
+    add_instrument_arguments(relocate)
+    relocate.set_defaults(handler=command_relocate)
+
+    bench = subparsers.add_parser('bench', help='run benchmarks on synthetic frames, see python -m smugi bench -h',
+                                  add_help=False)
+    bench.set_defaults(handler=command_bench)
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    #options of bench are not known to this parser, they are passed to benchmarks.run
+    args, extra = parser.parse_known_args(argv)
+    if args.command == 'bench':
+        args.bench_args = extra
+    elif extra:
+        parser.error('unrecognized arguments: ' + ' '.join(extra))
+    return args.handler(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
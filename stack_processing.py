@@ -0,0 +1,328 @@
+#
+# Module processing consecutive frames as one stack: N frames of a sequence, or pages of a multi-page TIFF, are held
+# in one 3D array (frames along the first axis) and detection runs over the whole stack at once:
+#
+#   threshold - thresholds of all frames are computed by one call of the threshold strategy (see thresholds module,
+#               every strategy accepts stacks), and the stack is compared with them in one pass
+#   closing   - one morphological closing of the stack with a (1, 3, 3) footprint, i.e. square(3) in every plane,
+#               without connecting pixels of different frames
+#   labelling - one labelling of the stack with connectivity limited to planes; regions touching the border of their
+#               frame are cleared, and labels are renumbered within each plane, so they are the same as labels of
+#               the frame processed alone
+#   measuring - regions of each plane are measured separately, see measurement module
+#
+# Results of each frame are the same as of image_processing, except for frames of floating point pixels thresholded
+# by strategies building histograms, whose bins span the whole stack. Frames are not prescreened nor tiled.
+#
+# Regions found in consecutive frames can be linked into tracks by TrackLinker: a region continues a track of the
+# previous frame when their centroids are close and orientations similar, so a slow-moving streak is reported once,
+# with its position in each frame.
+#
+
+#importing packages for standard mathematical and data operations
+import numpy as np
+
+#importing packages for serialization
+import json
+
+#importing packages supporting filesystem path walking
+import os
+
+#importing functions from custom modules
+from image_processing import read_image, describe_image_events, find_events_in_file, MIN_STREAK_AREA
+from thresholds import compute_threshold, DEFAULT_THRESHOLD_STRATEGY
+from measurement import measure_regions
+from background_model import load_background_model
+from instrumentation import stage, count
+
+#constants and default values
+
+#number of consecutive frames processed as one stack
+DEFAULT_STACK_SIZE = 8
+
+#footprint of the closing of a stack: square(3) in each plane, nothing across planes
+STACK_FOOTPRINT = np.ones((1, 3, 3), dtype=bool)
+
+#maximal distance, in pixels, between centroids of a region and of the same streak in the previous frame
+TRACK_MAX_DISTANCE = 25.
+
+#maximal difference of orientation, in radians, of a region and of the same streak in the previous frame
+TRACK_MAX_ANGLE = 0.1
+
+
+'''
+The function labels regions of each plane of a binary stack, skipping the ones touching the border of their plane
+
+Arguments:
+  bw - 3D binary array, frames along the first axis
+
+Returns:
+  3D array of region labels, numbered from 1 in each plane in the raster order of their first pixels, like
+  skimage.measure.label labels a single frame; 0 marks background
+'''
+def label_stack(bw):
+    from scipy import ndimage
+
+    #8-connectivity within planes, none across them
+    structure = np.zeros((3, 3, 3), dtype=bool)
+    structure[1] = True
+    with stage('label'):
+        labels, n = ndimage.label(bw, structure)
+    if n == 0:
+        return labels
+
+    with stage('clear_border'):
+        keep = np.ones(n + 1, dtype=bool)
+        keep[0] = False
+        for border in (labels[:, 0, :], labels[:, -1, :], labels[:, :, 0], labels[:, :, -1]):
+            keep[border] = False
+        #labels grow plane by plane, so labels of plane p are above the last label of plane p - 1
+        plane_last = np.maximum.accumulate(labels.reshape(len(labels), -1).max(axis=1))
+        plane_first = np.concatenate([[0], plane_last[:-1]])
+        plane_of = np.searchsorted(plane_last, np.arange(1, n + 1))
+        kept_before = np.cumsum(keep)
+        renumber = np.zeros(n + 1, dtype=labels.dtype)
+        renumber[1:] = np.where(keep[1:], kept_before[1:] - kept_before[plane_first[plane_of]], 0)
+        return renumber[labels]
+
+
+'''
+The function finds regions in each frame of a stack
+
+Arguments:
+  stack - 3D array, frames along the first axis
+  threshold_strategy - threshold specification, see thresholds.parse_threshold_spec
+  min_area - minimal area of returned region
+
+Returns:
+  list with record array of regions of each frame, see measurement module
+'''
+def find_regions_in_stack(stack, threshold_strategy=DEFAULT_THRESHOLD_STRATEGY, min_area=0):
+    from skimage.morphology import closing
+
+    with stage('threshold'):
+        thresholds = np.atleast_1d(compute_threshold(stack, threshold_strategy))
+        bw = stack > thresholds.reshape(-1, 1, 1)
+    with stage('closing'):
+        bw = closing(bw, STACK_FOOTPRINT)
+    labels = label_stack(bw)
+    count('stacks')
+    count('stack_frames', len(stack))
+    with stage('measure'):
+        return [measure_regions(plane, min_area) for plane in labels]
+
+
+'''
+The function finds streaks in each frame of a stack and describes them like find_events_in_file
+
+Arguments:
+  stack - 3D array, frames along the first axis
+  filenames - names of the frames, one for each plane
+  threshold_strategy - threshold specification
+  render_flags - list telling, for each frame, whether data needed to draw plots should be recorded
+  min_area - minimal area of region to be counted as streak
+  background - path of cached background model, None processes frames without correction
+
+Returns:
+  list of dicts returned by find_events_in_file, one for each frame
+'''
+def find_events_in_frames(stack, filenames, threshold_strategy=DEFAULT_THRESHOLD_STRATEGY, render_flags=None,
+                          min_area=MIN_STREAK_AREA, background=None):
+    if render_flags is None:
+        render_flags = [True] * len(stack)
+    detected = stack
+    if background is not None:
+        model = load_background_model(background)
+        #frames of other size than the model are processed without correction
+        if model.shape == stack.shape[1:]:
+            detected = np.empty(stack.shape, dtype=model.background.dtype)
+            for plane, frame in zip(detected, stack):
+                plane[...] = model.correct(frame)
+    regions = find_regions_in_stack(detected, threshold_strategy, min_area)
+    return [describe_image_events(frame, filename, streaks, render)
+            for frame, filename, streaks, render in zip(stack, filenames, regions, render_flags)]
+
+
+'''
+The function splits frames into runs of consecutive frames of the same shape and type, which can be stacked
+
+Arguments:
+  frames - list of arrays
+
+Returns:
+  list of lists of indexes of frames
+'''
+def stackable_runs(frames):
+    runs = []
+    for i, frame in enumerate(frames):
+        if runs and frame.shape == frames[runs[-1][0]].shape and frame.dtype == frames[runs[-1][0]].dtype:
+            runs[-1].append(i)
+        else:
+            runs.append([i])
+    return runs
+
+
+'''
+The function processes a sequence of image files as stacks and returns their results in the order of files. Files
+which cannot be stacked with their neighbours, e.g. of another size, or with more than one plane, are processed
+alone by find_events_in_file
+
+Arguments:
+  img_filenames - paths of consecutive frames
+  threshold_strategy - threshold specification
+  render_flags - list telling, for each file, whether data needed to draw plots should be recorded; None records it
+  for all files
+  min_area - minimal area of region to be counted as streak
+  raw_format - shape and type of pixels of raw files
+  background - path of cached background model, None processes frames without correction
+
+Returns:
+  list of dicts returned by find_events_in_file, one for each file
+'''
+def find_events_in_stack(img_filenames, threshold_strategy=DEFAULT_THRESHOLD_STRATEGY, render_flags=None,
+                         min_area=MIN_STREAK_AREA, raw_format=None, background=None):
+    if render_flags is None:
+        render_flags = [True] * len(img_filenames)
+    frames = [read_image(f, raw_format) for f in img_filenames]
+    results = [None] * len(frames)
+    for run in stackable_runs(frames):
+        if frames[run[0]].ndim != 2 or len(run) == 1:
+            for i in run:
+                results[i] = find_events_in_file(img_filenames[i], threshold_strategy, render_flags[i], min_area,
+                                                 raw_format=raw_format, background=background, image=frames[i])
+            continue
+        with stage('stack'):
+            stack = np.stack([frames[i] for i in run])
+        run_results = find_events_in_frames(stack, [os.path.basename(img_filenames[i]) for i in run],
+                                            threshold_strategy, [render_flags[i] for i in run], min_area, background)
+        for i, file_result in zip(run, run_results):
+            results[i] = file_result
+    return results
+
+
+'''
+The function returns names of pages of a multi-page file
+
+Arguments:
+  img_filename - path of the file
+  pages - number of pages
+
+Returns:
+  list of names 'NAME[PAGE]', pages numbered from 0
+'''
+def page_names(img_filename, pages):
+    name = os.path.basename(img_filename)
+    return ['%s[%d]' % (name, page) for page in range(pages)]
+
+
+'''
+The function processes pages of a multi-page TIFF file, or planes of a 3D .npy file, as stacks of stack_size pages
+
+Arguments:
+  img_filename - path of the file
+  threshold_strategy - threshold specification
+  min_area - minimal area of region to be counted as streak
+  stack_size - number of pages processed at once
+  background - path of cached background model, None processes frames without correction
+
+Returns:
+  list of dicts returned by find_events_in_file, one for each page, named by page_names; data for plots is not
+  recorded
+'''
+def find_events_in_pages(img_filename, threshold_strategy=DEFAULT_THRESHOLD_STRATEGY, min_area=MIN_STREAK_AREA,
+                         stack_size=DEFAULT_STACK_SIZE, background=None):
+    pages = read_image(img_filename)
+    if pages.ndim == 2:
+        pages = pages[np.newaxis]
+    names = page_names(img_filename, len(pages))
+    results = []
+    for start in range(0, len(pages), stack_size):
+        results += find_events_in_frames(np.asarray(pages[start:start + stack_size]), names[start:start + stack_size],
+                                         threshold_strategy, [False] * len(names[start:start + stack_size]),
+                                         min_area, background)
+    return results
+
+
+'''
+Linker of streaks found in consecutive frames into tracks. Frames are added in order; a streak continues the track of
+the nearest streak of the previous frame, if their centroids are at most max_distance apart and their orientations
+differ by at most max_angle. Each streak belongs to one track, and a track has one streak in each of its frames.
+Tracks are written, one JSON record per line, when they end:
+
+  'track' - number of the track
+  'frames' - names of the frames
+  'labels', 'centroids', 'lengths', 'orientations' - the streak in each frame
+
+Arguments:
+  path - path of the file where tracks are written
+  max_distance - maximal distance of centroids in consecutive frames, in pixels
+  max_angle - maximal difference of orientations in consecutive frames, in radians
+'''
+class TrackLinker:
+    def __init__(self, path, max_distance=TRACK_MAX_DISTANCE, max_angle=TRACK_MAX_ANGLE):
+        self.output = open(path, 'w')
+        self.max_distance = max_distance
+        self.max_angle = max_angle
+        #tracks with a streak in the last added frame
+        self.open_tracks = []
+        self.tracks = 0
+
+    '''
+    The method adds streaks of the next frame
+
+    Arguments:
+      file_result - dict returned by describe_streaks
+    '''
+    def add(self, file_result):
+        centroids = np.array(file_result['centroids'], dtype=np.float64).reshape(-1, 2)
+        orientations = np.array(file_result['orientations'], dtype=np.float64)
+        continued = [None] * len(centroids)
+        if self.open_tracks and len(centroids):
+            with stage('link_tracks'):
+                last = np.array([track['centroids'][-1] for track in self.open_tracks])
+                last_orientations = np.array([track['orientations'][-1] for track in self.open_tracks])
+                distance = np.hypot(*(last[:, np.newaxis, :] - centroids[np.newaxis, :, :]).transpose(2, 0, 1))
+                angle = np.abs(last_orientations[:, np.newaxis] - orientations[np.newaxis, :])
+                #orientations differing by pi describe the same direction
+                angle = np.minimum(angle, np.pi - angle)
+                candidates = np.argwhere((distance <= self.max_distance) & (angle <= self.max_angle))
+                used_tracks = set()
+                for t, r in candidates[np.argsort(distance[candidates[:, 0], candidates[:, 1]], kind='stable')]:
+                    if t not in used_tracks and continued[r] is None:
+                        used_tracks.add(t)
+                        continued[r] = self.open_tracks[t]
+        continued_ids = set(id(track) for track in continued if track is not None)
+        for track in self.open_tracks:
+            if id(track) not in continued_ids:
+                self._write(track)
+
+        self.open_tracks = []
+        for i, track in enumerate(continued):
+            if track is None:
+                track = {'track': self.tracks, 'frames': [], 'labels': [], 'centroids': [], 'lengths': [],
+                         'orientations': []}
+                self.tracks += 1
+            track['frames'].append(file_result['filename'])
+            track['labels'].append(file_result['labels'][i])
+            track['centroids'].append(file_result['centroids'][i])
+            track['lengths'].append(file_result['lengths'][i])
+            track['orientations'].append(file_result['orientations'][i])
+            self.open_tracks.append(track)
+
+    def _write(self, track):
+        self.output.write(json.dumps(track) + '\n')
+        if len(track['frames']) > 1:
+            count('linked_tracks')
+
+    '''
+    The method writes tracks still open and closes the file
+
+    Returns:
+      number of tracks
+    '''
+    def close(self):
+        for track in self.open_tracks:
+            self._write(track)
+        self.open_tracks = []
+        self.output.close()
+        return self.tracks
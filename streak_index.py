@@ -0,0 +1,309 @@
+#
+# Module keeping an index of all streaks found by scans in an SQLite database, so questions like "streaks longer
+# than X at orientation near Y found in frames of last week" are answered without processing the frames again.
+#
+# The database has two tables:
+#
+#   files   - one row per processed frame: 'id', 'path', 'name' (file name without directory), 'timestamp'
+#             (modification time of the frame, seconds since the epoch) and 'indexed_at' (time of the scan)
+#   streaks - one row per streak: 'file_id', 'label', 'timestamp' (copied from the frame, so time ranges do not need
+#             a join), 'length' (major axis length), 'minor_length', 'area', 'orientation', 'centroid_row',
+#             'centroid_col' and the bounding box 'bbox_min_row', 'bbox_min_col', 'bbox_max_row', 'bbox_max_col'
+#
+# Timestamp, length, area, orientation and centroid are indexed, so range queries over millions of streaks read only
+# the matching part of an index. Streaks are inserted with executemany in batches, one transaction per batch; a frame
+# indexed again has its old streaks replaced.
+#
+# Frames are stored by absolute path, so scans of one catalog given by relative and absolute paths share rows.
+# Results taken from the result cache are indexed only when their frame is not indexed yet with the same timestamp,
+# so an incremental scan touches only rows of new and changed frames.
+#
+# Nodes of a sharded scan do not index streaks; the index of the whole catalog is written when their partial results
+# are merged, see sharding.merge_partials, so queries after a sharded scan see streaks of all shards.
+#
+
+#importing packages for the database
+import sqlite3
+import time
+import urllib.parse
+
+#importing packages supporting filesystem path walking
+import errno
+import os
+
+#importing instrumentation of stages
+from instrumentation import stage, count
+
+#constants and default values
+
+#number of streaks inserted in one transaction
+INDEX_BATCH_SIZE = 50000
+
+#columns of the streaks table, in the order in which they are inserted
+STREAK_COLUMNS = ['file_id', 'label', 'timestamp', 'length', 'minor_length', 'area', 'orientation',
+                  'centroid_row', 'centroid_col', 'bbox_min_row', 'bbox_min_col', 'bbox_max_row', 'bbox_max_col']
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    name TEXT,
+    timestamp REAL,
+    indexed_at REAL
+);
+CREATE TABLE IF NOT EXISTS streaks (
+    file_id INTEGER NOT NULL REFERENCES files(id),
+    label INTEGER,
+    timestamp REAL,
+    length REAL,
+    minor_length REAL,
+    area INTEGER,
+    orientation REAL,
+    centroid_row REAL,
+    centroid_col REAL,
+    bbox_min_row INTEGER,
+    bbox_min_col INTEGER,
+    bbox_max_row INTEGER,
+    bbox_max_col INTEGER
+);
+CREATE INDEX IF NOT EXISTS files_name ON files(name);
+CREATE INDEX IF NOT EXISTS streaks_file ON streaks(file_id);
+CREATE INDEX IF NOT EXISTS streaks_timestamp ON streaks(timestamp);
+CREATE INDEX IF NOT EXISTS streaks_length ON streaks(length);
+CREATE INDEX IF NOT EXISTS streaks_area ON streaks(area);
+CREATE INDEX IF NOT EXISTS streaks_orientation ON streaks(orientation);
+CREATE INDEX IF NOT EXISTS streaks_centroid ON streaks(centroid_row, centroid_col);
+'''
+
+#orientation of regions lies in [-pi/2, pi/2], both ends describing the same direction
+HALF_PI = 1.5707963267948966
+
+
+'''
+The function opens the index, creating its tables when needed
+
+Arguments:
+  path - path of the database file
+
+Returns:
+  sqlite3 connection
+  read_only - whether the database is only read; it is then not created, and a missing file is an error
+
+Returns:
+  sqlite3 connection
+'''
+def open_index(path, read_only=False):
+    if read_only:
+        if not os.path.exists(path):
+            raise FileNotFoundError(errno.ENOENT, 'streak index does not exist', path)
+        return sqlite3.connect('file:' + urllib.parse.quote(os.path.abspath(path)) + '?mode=ro', uri=True)
+    connection = sqlite3.connect(path)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('PRAGMA synchronous=NORMAL')
+    connection.executescript(SCHEMA)
+    return connection
+
+
+'''
+The function returns the modification time of the frame, stored in the index as its timestamp
+
+Arguments:
+  path - path of the frame
+
+Returns:
+  seconds since the epoch, None if the frame cannot be read
+'''
+def frame_timestamp(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+'''
+Writer adding results of processed frames to the index. Streaks are collected and inserted in batches of batch_size
+rows, each batch in a single transaction
+
+Arguments:
+  path - path of the database file
+  catalog - directory containing the frames, used to read their modification times; frames are stored by absolute
+  paths
+  batch_size - number of streaks inserted at once
+'''
+class StreakIndexWriter:
+    def __init__(self, path, catalog, batch_size=INDEX_BATCH_SIZE):
+        self.connection = open_index(path)
+        self.catalog = os.path.abspath(catalog)
+        self.batch_size = batch_size
+        #dict where key - path of indexed frame, value - its timestamp; read when first needed by append
+        self.indexed = None
+        self.indexed_at = time.time()
+        #frames waiting for insertion: tuples (path, timestamp, file_result)
+        self.pending = []
+        self.pending_rows = 0
+        self.inserted = 0
+
+    '''
+    The method adds a processed frame, with or without streaks
+
+    Arguments:
+      file_result - dict returned by describe_streaks
+      timestamp - modification time of the frame, e.g. recorded by the node which processed it; None reads it from
+      the catalog
+      cached - whether the result was taken from the result cache; it is then skipped when the frame is already
+      indexed with the same timestamp
+    '''
+    def append(self, file_result, timestamp=None, cached=False):
+        path = os.path.join(self.catalog, file_result['filename'])
+        if timestamp is None:
+            timestamp = frame_timestamp(path)
+        if cached:
+            if self.indexed is None:
+                self.indexed = dict(self.connection.execute('SELECT path, timestamp FROM files'))
+            if path in self.indexed and self.indexed[path] == timestamp:
+                count('index_unchanged')
+                return
+        self.pending.append((path, timestamp, file_result))
+        self.pending_rows += len(file_result['lengths'])
+        if self.pending_rows >= self.batch_size:
+            self.flush()
+
+    '''
+    The method inserts pending frames and their streaks in one transaction
+    '''
+    def flush(self):
+        if not self.pending:
+            return
+        with stage('index_streaks'):
+            with self.connection:
+                cursor = self.connection.cursor()
+                cursor.executemany('INSERT INTO files (path, name, timestamp, indexed_at) VALUES (?, ?, ?, ?) '
+                                   'ON CONFLICT(path) DO UPDATE SET timestamp = excluded.timestamp, '
+                                   'indexed_at = excluded.indexed_at',
+                                   [(path, os.path.basename(path), timestamp, self.indexed_at)
+                                    for path, timestamp, _ in self.pending])
+                ids = {}
+                paths = [path for path, _, _ in self.pending]
+                #ids are looked up in chunks, below the limit of SQL variables
+                for start in range(0, len(paths), 500):
+                    chunk = paths[start:start + 500]
+                    ids.update(cursor.execute('SELECT path, id FROM files WHERE path IN (%s)' %
+                                              ','.join('?' * len(chunk)), chunk))
+                cursor.executemany('DELETE FROM streaks WHERE file_id = ?', [(ids[path],) for path in paths])
+                cursor.executemany('INSERT INTO streaks (%s) VALUES (%s)' %
+                                   (', '.join(STREAK_COLUMNS), ', '.join('?' * len(STREAK_COLUMNS))),
+                                   self._rows(ids))
+        count('streaks_indexed', self.pending_rows)
+        self.inserted += self.pending_rows
+        self.pending = []
+        self.pending_rows = 0
+
+    '''
+    The method returns rows of streaks of pending frames, in the order of STREAK_COLUMNS
+    '''
+    def _rows(self, ids):
+        for path, timestamp, r in self.pending:
+            file_id = ids[path]
+            for label, length, minor, area, orientation, (crow, ccol), (r0, c0, r1, c1) in zip(
+                    r['labels'], r['lengths'], r['minor_lengths'], r['areas'], r['orientations'], r['centroids'],
+                    r['bboxes']):
+                yield (file_id, label, timestamp, length, minor, area, orientation, crow, ccol, r0, c0, r1, c1)
+
+    '''
+    The method inserts remaining frames and closes the database
+
+    Returns:
+      number of inserted streaks
+    '''
+    def close(self):
+        try:
+            self.flush()
+            #statistics of the indexes let queries choose the most selective one
+            self.connection.execute('PRAGMA optimize')
+        finally:
+            self.connection.close()
+        return self.inserted
+
+
+'''
+The function adds to a query conditions on a range of a column
+
+Arguments:
+  conditions - list of SQL conditions, extended in place
+  parameters - list of query parameters, extended in place
+  column - name of the column
+  low, high - bounds of the range, inclusive; None means unbounded
+'''
+def add_range(conditions, parameters, column, low, high):
+    if low is not None:
+        conditions.append(column + ' >= ?')
+        parameters.append(low)
+    if high is not None:
+        conditions.append(column + ' <= ?')
+        parameters.append(high)
+
+
+'''
+The function finds streaks in the index
+
+Arguments:
+  path - path of the database file
+  min_length, max_length - range of major axis length
+  min_area, max_area - range of area
+  orientation, tolerance - streaks with orientation within tolerance from the given one are returned; orientations
+  differing by pi describe the same direction, so the range wraps around -pi/2 and pi/2
+  since, until - range of timestamps of frames, seconds since the epoch
+  rows, cols - (low, high) ranges of centroid row and column, None means unbounded
+  file - path of the frame, relative paths are made absolute, or its name
+  limit - maximal number of returned streaks, None means all
+  count_only - return the number of matching streaks instead of the streaks
+
+Returns:
+  list of dicts with 'path' of the frame and STREAK_COLUMNS (without 'file_id'), ordered by timestamp and label,
+  or the number of matching streaks if count_only is True
+'''
+def query_streaks(path, min_length=None, max_length=None, min_area=None, max_area=None, orientation=None,
+                  tolerance=0.1, since=None, until=None, rows=None, cols=None, file=None, limit=None,
+                  count_only=False):
+    conditions = []
+    parameters = []
+    add_range(conditions, parameters, 's.length', min_length, max_length)
+    add_range(conditions, parameters, 's.area', min_area, max_area)
+    add_range(conditions, parameters, 's.timestamp', since, until)
+    if rows is not None:
+        add_range(conditions, parameters, 's.centroid_row', *rows)
+    if cols is not None:
+        add_range(conditions, parameters, 's.centroid_col', *cols)
+    if orientation is not None:
+        low = orientation - tolerance
+        high = orientation + tolerance
+        ranges = [(max(low, -HALF_PI), min(high, HALF_PI))]
+        if low < -HALF_PI:
+            ranges.append((low + 2 * HALF_PI, HALF_PI))
+        if high > HALF_PI:
+            ranges.append((-HALF_PI, high - 2 * HALF_PI))
+        conditions.append('(' + ' OR '.join(['s.orientation BETWEEN ? AND ?'] * len(ranges)) + ')')
+        for range_low, range_high in ranges:
+            parameters += [range_low, range_high]
+    if file is not None:
+        if os.sep in file:
+            file = os.path.abspath(file)
+        conditions.append('(f.path = ? OR f.name = ?)')
+        parameters += [file, file]
+
+    where = (' WHERE ' + ' AND '.join(conditions)) if conditions else ''
+    connection = open_index(path, read_only=True)
+    try:
+        with stage('query_index'):
+            if count_only:
+                return connection.execute('SELECT COUNT(*) FROM streaks s JOIN files f ON f.id = s.file_id' + where,
+                                          parameters).fetchone()[0]
+            columns = [c for c in STREAK_COLUMNS if c != 'file_id']
+            sql = ('SELECT f.path, ' + ', '.join('s.' + c for c in columns) +
+                   ' FROM streaks s JOIN files f ON f.id = s.file_id' + where + ' ORDER BY s.timestamp, s.label')
+            if limit is not None:
+                sql += ' LIMIT ?'
+                parameters.append(limit)
+            return [dict(zip(['path'] + columns, row)) for row in connection.execute(sql, parameters)]
+    finally:
+        connection.close()
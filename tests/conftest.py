@@ -0,0 +1,24 @@
+#
+# Configuration of tests: modules of the repository are imported from its root, the same way python -m smugi does
+#
+
+#importing packages supporting filesystem path walking
+import os
+import sys
+
+#importing packages for tests
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+'''
+Fixture writing a small catalog of synthetic frames, half of them with streaks, and returning its directory
+'''
+@pytest.fixture
+def catalog(tmp_path):
+    from benchmarks.synthetic import write_synthetic_catalog
+
+    directory = str(tmp_path / 'catalog')
+    write_synthetic_catalog(directory, 8, height=128, width=128, streaks=2, border_streaks=1)
+    return directory
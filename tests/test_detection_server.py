@@ -0,0 +1,93 @@
+#
+# Tests of the line protocol of the detection server, on a Unix socket with one worker
+#
+
+#importing packages for serialization and sockets
+import json
+import socket
+import threading
+
+#importing packages supporting filesystem path walking
+import os
+
+#importing packages for tests
+import pytest
+
+#importing functions from custom modules
+import detection_server
+from detection_server import create_server, DetectionClient
+from frame_readers import list_frames
+from image_processing import find_events_in_file
+
+
+'''
+Fixture starting the server in a thread and returning the path of its socket
+'''
+@pytest.fixture
+def server_socket(tmp_path):
+    socket_path = str(tmp_path / 'smugi.sock')
+    server = create_server(socket_path, workers=1)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield socket_path
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+
+def test_frames_are_detected_like_by_a_scan(catalog, server_socket):
+    from skimage import io
+
+    client = DetectionClient(server_socket)
+    try:
+        for path in list_frames(catalog):
+            expected = find_events_in_file(path, render=False)
+            for response in (client.detect(path), client.detect_array(io.imread(path), os.path.basename(path))):
+                assert 'error' not in response
+                assert response['filename'] == os.path.basename(path)
+                assert response['count'] == len(expected['lengths'])
+                assert response['streak'] == (len(expected['lengths']) > 0)
+                assert [region['area'] for region in response['regions']] == expected['areas']
+                assert response['latency_ms'] >= 0
+    finally:
+        client.close()
+
+
+def test_requests_are_answered_in_order_with_their_ids(catalog, server_socket):
+    client = DetectionClient(server_socket)
+    try:
+        assert client.request({'id': 'a', 'op': 'ping'}) == {'id': 'a', 'ok': True}
+        missing = client.request({'id': 7, 'path': os.path.join(catalog, 'missing.png')})
+        assert missing['id'] == 7 and 'error' in missing
+        invalid = client.request({'id': 8, 'op': 'detect'})
+        assert invalid['id'] == 8 and 'error' in invalid
+        stats = client.stats()
+        assert stats['requests'] == 2 and stats['errors'] == 2
+    finally:
+        client.close()
+
+
+def test_oversized_request_line_is_answered_once_and_closes_the_connection(server_socket, monkeypatch):
+    monkeypatch.setattr(detection_server, 'MAX_REQUEST_BYTES', 1024)
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    connection.connect(server_socket)
+    stream = connection.makefile('rwb')
+    try:
+        stream.write(json.dumps({'id': 1, 'path': 'x' * 5000}).encode('utf-8') + b'\n')
+        stream.write(json.dumps({'id': 2, 'op': 'ping'}).encode('utf-8') + b'\n')
+        stream.flush()
+
+        response = json.loads(stream.readline())
+        assert response['id'] is None
+        assert '1024' in response['error']
+        assert stream.readline() == b''
+    finally:
+        stream.close()
+        connection.close()
+
+    #other connections are still served
+    client = DetectionClient(server_socket)
+    try:
+        assert client.request({'op': 'ping'})['ok']
+    finally:
+        client.close()
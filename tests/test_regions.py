@@ -0,0 +1,87 @@
+#
+# Tests of region finding: tiled processing, measurement without regionprops and exact prescreening must give the
+# same regions as the full resolution detection on the whole frame
+#
+
+#importing packages for standard mathematical and data operations
+import numpy as np
+
+#importing packages for tests
+import pytest
+
+#importing functions from custom modules
+from benchmarks.synthetic import synthetic_frame
+from image_processing import find_regions_in_image, threshold_image, label_image, MIN_STREAK_AREA
+from measurement import measure_regions
+from prescreen import may_contain_region
+from thresholds import compute_threshold
+
+
+'''
+The function checks that two record arrays of regions are the same, up to rounding of the derived properties
+'''
+def assert_same_regions(regions, expected):
+    assert len(regions) == len(expected)
+    for name in ('label', 'area', 'bbox'):
+        np.testing.assert_array_equal(regions[name], expected[name])
+    for name in ('centroid', 'orientation', 'major_axis_length', 'minor_axis_length'):
+        np.testing.assert_allclose(regions[name], expected[name], rtol=1e-9, atol=1e-9)
+
+
+@pytest.mark.parametrize('tile_size', [16, 50, 128])
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_tiled_regions_are_the_same_as_untiled(seed, tile_size):
+    frame, _ = synthetic_frame(200, 300, streaks=5, border_streaks=2, hot_pixels=20, seed=seed)
+
+    for min_area in (0, MIN_STREAK_AREA):
+        assert_same_regions(find_regions_in_image(frame, tile_size=tile_size, min_area=min_area),
+                            find_regions_in_image(frame, min_area=min_area))
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_measure_regions_matches_regionprops(seed):
+    from skimage.measure import regionprops
+
+    frame, _ = synthetic_frame(200, 300, streaks=5, border_streaks=2, hot_pixels=20, seed=seed)
+    labels = label_image(threshold_image(frame))
+    regions = measure_regions(labels)
+    props = regionprops(labels)
+
+    assert len(regions) == len(props) > 0
+    for region, prop in zip(regions, props):
+        assert region.label == prop.label
+        assert region.area == prop.area
+        assert tuple(region.bbox) == prop.bbox
+        np.testing.assert_allclose(region.centroid, prop.centroid, atol=1e-9)
+        np.testing.assert_allclose(region.orientation, prop.orientation, atol=1e-9)
+        np.testing.assert_allclose(region.major_axis_length, prop.axis_major_length, atol=1e-9)
+        np.testing.assert_allclose(region.minor_axis_length, prop.axis_minor_length, atol=1e-9)
+
+
+def test_measure_regions_skips_small_regions():
+    labels = np.zeros((10, 10), dtype=np.int64)
+    labels[1, 1] = 1
+    labels[3:6, 3:6] = 2
+
+    regions = measure_regions(labels, min_area=5)
+
+    assert regions.label.tolist() == [2]
+    assert regions.area.tolist() == [9]
+
+
+def test_exact_prescreen_never_rejects_a_frame_with_streaks():
+    with_streaks = 0
+    rejected = 0
+    for seed in range(60):
+        #short and dim streaks, whose areas are close to the minimal one
+        frame, _ = synthetic_frame(96, 96, streaks=seed % 3, length=(5, 40), brightness=0.3, hot_pixels=seed % 7,
+                                   seed=seed)
+        regions = find_regions_in_image(frame, min_area=MIN_STREAK_AREA)
+        candidate = may_contain_region(frame, compute_threshold(frame), MIN_STREAK_AREA, 'exact')
+        if len(regions) > 0:
+            with_streaks += 1
+            assert candidate
+        rejected += not candidate
+        assert_same_regions(find_regions_in_image(frame, min_area=MIN_STREAK_AREA, prescreen='exact'), regions)
+    #the frames test both outcomes of prescreening
+    assert with_streaks > 0 and rejected > 0
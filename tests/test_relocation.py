@@ -0,0 +1,104 @@
+#
+# Tests of journaled relocation: relocation interrupted by a crash is finished or rolled back from its journal,
+# and files of the destination are never overwritten
+#
+
+#importing packages supporting filesystem path walking
+import os
+
+#importing packages for tests
+import pytest
+
+#importing functions from custom modules
+import relocation
+from relocation import relocate_files, resume_relocation, rollback_relocation, JOURNAL_FILENAME
+
+
+'''
+The function writes files with distinct content and returns their names
+'''
+def write_files(directory, count):
+    os.makedirs(directory, exist_ok=True)
+    names = ['frame_%03d.png' % i for i in range(count)]
+    for i, name in enumerate(names):
+        with open(os.path.join(directory, name), 'wb') as f:
+            f.write(bytes([i]) * (100 + i))
+    return names
+
+
+'''
+The function makes relocation crash after the first batch of files, with its journal left in the destination,
+until monkeypatch.undo is called
+'''
+def crash_after_first_batch(monkeypatch):
+    monkeypatch.setattr(relocation, 'RELOCATION_BATCH', 3)
+    relocate_batch = relocation.relocate_batch
+    calls = []
+
+    def crashing_batch(*args, **kwargs):
+        if calls:
+            raise RuntimeError('crash')
+        calls.append(1)
+        return relocate_batch(*args, **kwargs)
+
+    monkeypatch.setattr(relocation, 'relocate_batch', crashing_batch)
+
+
+@pytest.mark.parametrize('mode', ['move', 'hardlink'])
+def test_relocation_leaves_no_journal(tmp_path, mode):
+    source, destination = str(tmp_path / 'catalog'), str(tmp_path / 'no_events')
+    names = write_files(source, 7)
+
+    assert relocate_files(names, source, destination, mode) == 7
+
+    assert sorted(os.listdir(destination)) == names
+    assert sorted(os.listdir(source)) == ([] if mode == 'move' else names)
+
+
+def test_interrupted_move_is_resumed(tmp_path, monkeypatch):
+    source, destination = str(tmp_path / 'catalog'), str(tmp_path / 'no_events')
+    names = write_files(source, 7)
+    crash_after_first_batch(monkeypatch)
+    with pytest.raises(RuntimeError):
+        relocate_files(names, source, destination)
+    assert os.path.exists(os.path.join(destination, JOURNAL_FILENAME))
+    monkeypatch.undo()
+
+    assert resume_relocation(destination) == 4
+
+    assert sorted(os.listdir(destination)) == names
+    assert os.listdir(source) == []
+    for i, name in enumerate(names):
+        with open(os.path.join(destination, name), 'rb') as f:
+            assert f.read() == bytes([i]) * (100 + i)
+
+
+@pytest.mark.parametrize('mode', ['move', 'hardlink'])
+def test_interrupted_relocation_is_rolled_back(tmp_path, monkeypatch, mode):
+    source, destination = str(tmp_path / 'catalog'), str(tmp_path / 'no_events')
+    names = write_files(source, 7)
+    crash_after_first_batch(monkeypatch)
+    with pytest.raises(RuntimeError):
+        relocate_files(names, source, destination, mode)
+    monkeypatch.undo()
+
+    assert rollback_relocation(destination) == 3
+
+    assert os.listdir(destination) == []
+    assert sorted(os.listdir(source)) == names
+    assert rollback_relocation(destination) == 0
+
+
+def test_relocation_never_overwrites_the_destination(tmp_path):
+    source, destination = str(tmp_path / 'catalog'), str(tmp_path / 'no_events')
+    names = write_files(source, 3)
+    os.makedirs(destination)
+    with open(os.path.join(destination, names[1]), 'wb') as f:
+        f.write(b'other')
+
+    with pytest.raises(FileExistsError):
+        relocate_files(names, source, destination)
+
+    assert sorted(os.listdir(source)) == names
+    with open(os.path.join(destination, names[1]), 'rb') as f:
+        assert f.read() == b'other'
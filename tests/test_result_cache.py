@@ -0,0 +1,118 @@
+#
+# Tests of the result cache: a scan resumed from the cache gives the same results without processing stored files
+# again, and results are processed again when their files or the settings change
+#
+
+#importing packages supporting filesystem path walking
+import os
+
+#importing functions from custom modules
+import main
+from frame_readers import list_frames
+from result_cache import ResultCache, find_events_with_key, RESULT_FORMAT_VERSION
+from thresholds import DEFAULT_THRESHOLD_STRATEGY
+
+
+#settings of results stored by the tests
+SETTINGS = {'threshold_strategy': DEFAULT_THRESHOLD_STRATEGY}
+
+
+'''
+The function stores results of files in a new cache and closes it
+'''
+def fill_cache(cache_filename, paths, settings=SETTINGS):
+    cache = ResultCache(cache_filename, settings)
+    for path in paths:
+        file_result, key = find_events_with_key(path, DEFAULT_THRESHOLD_STRATEGY, render=False)
+        cache.store(key, file_result)
+    cache.close()
+
+
+'''
+The function moves modification time of a file by the given number of seconds, without changing its content
+'''
+def touch(path, seconds):
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + seconds * 10 ** 9))
+
+
+'''
+The function runs a scan without plots and returns the analytics and the list of files processed by find_events
+'''
+def scan(catalog, output_filename, cache_filename, monkeypatch):
+    processed = []
+    process_files = main.process_files
+
+    def recording_process_files(img_filenames, *args, **kwargs):
+        processed.extend(img_filenames)
+        return process_files(img_filenames, *args, **kwargs)
+
+    monkeypatch.setattr(main, 'process_files', recording_process_files)
+    main.find_and_classify_events(catalog, output_filename, plots=False, cache_filename=cache_filename)
+    with open(output_filename) as f:
+        return f.read(), processed
+
+
+def test_scan_resumed_from_cache_processes_only_missing_files(catalog, tmp_path, monkeypatch):
+    cache_filename = str(tmp_path / 'cache.jsonl')
+    expected, processed = scan(catalog, str(tmp_path / 'uncached.txt'), cache_filename, monkeypatch)
+    paths = list_frames(catalog)
+    assert processed == paths
+
+    #an interrupted run stored the settings and results of the first three files, the next record cut by the crash
+    with open(cache_filename) as f:
+        lines = f.readlines()
+    with open(cache_filename, 'w') as f:
+        f.writelines(lines[:4])
+        f.write(lines[4][:40])
+
+    analytics, processed = scan(catalog, str(tmp_path / 'resumed.txt'), cache_filename, monkeypatch)
+    assert analytics == expected
+    assert processed == paths[3:]
+
+    analytics, processed = scan(catalog, str(tmp_path / 'cached.txt'), cache_filename, monkeypatch)
+    assert analytics == expected
+    assert processed == []
+
+
+def test_changed_file_is_processed_again(catalog, tmp_path):
+    cache_filename = str(tmp_path / 'cache.jsonl')
+    paths = list_frames(catalog)
+    fill_cache(cache_filename, paths)
+
+    #a touched file is hashed and processed again once; its record then has the hash, so later touches of the same
+    #content are recognized
+    touch(paths[0], 1)
+    cache = ResultCache(cache_filename, SETTINGS)
+    assert cache.lookup(paths[0]) is None
+    file_result, key = find_events_with_key(paths[0], DEFAULT_THRESHOLD_STRATEGY, render=False)
+    cache.store(key, file_result)
+    cache.close()
+    touch(paths[0], 2)
+
+    #file of the same size with other content is processed again
+    with open(paths[1], 'rb') as f:
+        content = bytearray(f.read())
+    content[-20] ^= 0xff
+    with open(paths[1], 'wb') as f:
+        f.write(content)
+
+    cache = ResultCache(cache_filename, SETTINGS)
+    assert cache.lookup(paths[0]) == {k: v for k, v in file_result.items() if k != 'render_records'}
+    assert cache.lookup(paths[1]) is None
+    assert all(cache.lookup(path) is not None for path in paths[2:])
+    cache.close()
+
+
+def test_results_of_other_settings_are_discarded(catalog, tmp_path):
+    cache_filename = str(tmp_path / 'cache.jsonl')
+    paths = list_frames(catalog)
+    fill_cache(cache_filename, paths)
+
+    cache = ResultCache(cache_filename, {'threshold_strategy': 'otsu'})
+    assert all(cache.lookup(path) is None for path in paths)
+    cache.close()
+    cache = ResultCache(cache_filename, SETTINGS)
+    assert cache.settings['result_format_version'] == RESULT_FORMAT_VERSION
+    assert all(cache.lookup(path) is None for path in paths)
+    cache.close()
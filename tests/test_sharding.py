@@ -0,0 +1,58 @@
+#
+# Tests of sharded scans: partial results of all shards, merged, give the same outputs as a scan of the whole catalog
+#
+
+#importing packages supporting filesystem path walking
+import os
+
+#importing packages for tests
+import pytest
+
+#importing functions from custom modules
+from main import find_and_classify_events
+from sharding import merge_partials, select_shard, default_partial_filename
+from frame_readers import list_frames
+from streak_index import query_streaks
+
+
+@pytest.mark.parametrize('shards', [1, 3])
+def test_merged_shards_give_the_same_outputs_as_unsharded_scan(catalog, tmp_path, shards):
+    expected_filename = str(tmp_path / 'analytics.txt')
+    events, no_events = find_and_classify_events(catalog, expected_filename, plots=False,
+                                                 index_filename=str(tmp_path / 'index.sqlite'))
+
+    partial_filenames = []
+    for index in range(shards):
+        shard = (index, shards)
+        partial_filenames.append(str(tmp_path / default_partial_filename(shard)))
+        find_and_classify_events(catalog, None, plots=False, shard=shard, partial_filename=partial_filenames[-1])
+    merged_filename = str(tmp_path / 'merged.txt')
+    merged_catalog, merged_events, merged_no_events = merge_partials(
+        reversed(partial_filenames), merged_filename, index_filename=str(tmp_path / 'merged.sqlite'))
+
+    assert merged_catalog == catalog
+    assert merged_events == sorted(events)
+    assert merged_no_events == sorted(no_events)
+    with open(expected_filename) as expected, open(merged_filename) as merged:
+        assert sorted(merged.read().splitlines()) == sorted(expected.read().splitlines())
+    assert (query_streaks(str(tmp_path / 'merged.sqlite'), count_only=True) ==
+            query_streaks(str(tmp_path / 'index.sqlite'), count_only=True) > 0)
+
+
+def test_shards_split_the_catalog(catalog):
+    img_filenames = list_frames(catalog)
+
+    selected = [select_shard(img_filenames, (index, 3)) for index in range(3)]
+
+    assert sorted(f for shard_filenames in selected for f in shard_filenames) == sorted(img_filenames)
+
+
+def test_partials_of_other_settings_are_not_merged(catalog, tmp_path):
+    partial_filenames = [str(tmp_path / default_partial_filename((index, 2))) for index in range(2)]
+    find_and_classify_events(catalog, None, plots=False, shard=(0, 2), partial_filename=partial_filenames[0])
+    find_and_classify_events(catalog, None, plots=False, shard=(1, 2), partial_filename=partial_filenames[1],
+                             min_area=50)
+
+    with pytest.raises(ValueError):
+        merge_partials(partial_filenames, str(tmp_path / 'merged.txt'))
+    assert not os.path.exists(str(tmp_path / 'merged.txt'))
@@ -0,0 +1,38 @@
+#
+# Smoke tests running entry points end to end on small synthetic frames, so a changed signature of a shared function
+# is caught before a run on real data
+#
+
+#importing packages for standard mathematical and data operations
+import json
+
+#importing functions from custom modules
+from benchmarks.synthetic import write_synthetic_catalog
+from image_processing import find_events_in_file
+from pipeline import read_frames, threshold_frames, label_frames, measure_frames, record_frames
+from postprocessing import sort_event_outliers
+from results import ScanResults
+
+
+def test_pipeline_records_the_same_streaks_as_find_events_in_file(tmp_path):
+    paths = write_synthetic_catalog(str(tmp_path), 4, height=128, width=128, streaks=2)
+    results = ScanResults()
+    frames = list(record_frames(measure_frames(label_frames(threshold_frames(read_frames(paths)))), results))
+    sort_event_outliers(results)
+
+    assert len(frames) == len(paths)
+    assert len(results.events()) + len(results.no_events()) == len(paths)
+    assert results.events()
+    for path, summary in zip(paths, results.files):
+        assert summary.total == len(find_events_in_file(path, render=False)['lengths'])
+
+
+def test_benchmarks_run_with_small_sizes(tmp_path):
+    from benchmarks.run import main
+
+    output = tmp_path / 'bench.json'
+    assert main(['--sizes', '128', '--dtypes', 'uint8', '--workers', '1', '--streak-counts', '1000', '--repeat', '1',
+                 '--no-startup', '--output', str(output)]) == 0
+    results = json.loads(output.read_text())['results']
+    assert 'sort_event_outliers[1000]' in results
+    assert 'find_and_classify_events[128,workers=1]' in results
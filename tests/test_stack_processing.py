@@ -0,0 +1,40 @@
+#
+# Tests of stack processing: frames processed together as a stack give the same streaks as frames processed one by one
+#
+
+#importing functions from custom modules
+from frame_readers import list_frames
+from image_processing import find_events_in_file
+from stack_processing import find_events_in_stack
+
+
+#keys of file results compared between stacked and per-file detection
+COMPARED_KEYS = ('filename', 'lengths', 'areas', 'orientations', 'labels', 'bboxes', 'centroids', 'minor_lengths',
+                 'profiles')
+
+
+def test_stack_finds_the_same_streaks_as_single_frames(catalog):
+    img_filenames = sorted(list_frames(catalog))
+
+    stacked = find_events_in_stack(img_filenames, render_flags=[False] * len(img_filenames))
+
+    assert len(stacked) == len(img_filenames)
+    assert any(file_result['lengths'] for file_result in stacked)
+    for img_filename, file_result in zip(img_filenames, stacked):
+        expected = find_events_in_file(img_filename, render=False)
+        for key in COMPARED_KEYS:
+            assert file_result[key] == expected[key], key
+
+
+def test_frames_of_other_shapes_are_processed_one_by_one(catalog, tmp_path):
+    from benchmarks.synthetic import write_synthetic_catalog
+
+    img_filenames = sorted(list_frames(catalog))[:3]
+    img_filenames += write_synthetic_catalog(str(tmp_path / 'wide'), 2, empty_fraction=0, height=96, width=160)
+
+    stacked = find_events_in_stack(img_filenames, render_flags=[False] * len(img_filenames))
+
+    for img_filename, file_result in zip(img_filenames, stacked):
+        expected = find_events_in_file(img_filename, render=False)
+        for key in COMPARED_KEYS:
+            assert file_result[key] == expected[key], key
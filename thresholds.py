@@ -0,0 +1,270 @@
+#
+# Module aggregating threshold strategies used to separate streaks from the background.
+# Every strategy accepts either a single frame (2D array) or a stack of frames (3D array, frames along the first axis)
+# and returns a single threshold or an array with one threshold per frame. Integer frames (uint8/uint16) are
+# processed in their own dtype - histograms are built with np.bincount, without casting the pixels to float.
+#
+
+#importing packages for standard mathematical and data operations
+import numpy as np
+
+#importing packages for checking parameters of strategies
+import functools
+import inspect
+
+#constants and default values
+
+#fraction of the brightest pixel value used as threshold by the max_fraction strategy
+THRESHOLD_FRACTION = 0.085
+
+#number of histogram bins used for non-integer frames
+FLOAT_HISTOGRAM_BINS = 256
+
+#name of the strategy used when none is given
+DEFAULT_THRESHOLD_STRATEGY = 'max_fraction'
+
+
+'''
+The function returns view of the images as a stack of flattened frames, without copying contiguous data
+
+Arguments:
+  images - single frame (2D array) or stack of frames (3D array)
+
+Returns:
+  2D array with one flattened frame per row
+'''
+def _as_frame_rows(images):
+    images = np.asarray(images)
+    if images.ndim == 2:
+        images = images[np.newaxis]
+    return images.reshape(len(images), -1)
+
+
+'''
+The function builds histogram of each frame in the stack
+
+For integer frames bins correspond to consecutive integer values between the minimum and maximum of the stack,
+like in skimage.filters.threshold_otsu. Other frames use FLOAT_HISTOGRAM_BINS equal bins over the range of the stack.
+
+Arguments:
+  rows - 2D array with one flattened frame per row
+
+Returns:
+  hist - 2D array with histogram of each frame in a row
+  bin_centers - values represented by consecutive bins
+'''
+def _frame_histograms(rows):
+    lo = rows.min()
+    hi = rows.max()
+    if np.issubdtype(rows.dtype, np.integer):
+        nbins = int(hi) - int(lo) + 1
+        bin_centers = np.arange(int(lo), int(hi) + 1)
+        if lo == 0:
+            hist = np.array([np.bincount(row, minlength=nbins) for row in rows])
+        else:
+            #shifting integer values does not need a float copy of the frame; signed values are widened first, as
+            #their range may not fit in their own dtype (e.g. int16 frames with values from -30000 to 30000)
+            if np.issubdtype(rows.dtype, np.signedinteger):
+                hist = np.array([np.bincount(row.astype(np.int64) - lo, minlength=nbins) for row in rows])
+            else:
+                hist = np.array([np.bincount(row - lo, minlength=nbins) for row in rows])
+    else:
+        edges = np.linspace(lo, hi, FLOAT_HISTOGRAM_BINS + 1)
+        bin_centers = (edges[:-1] + edges[1:]) / 2
+        hist = np.array([np.histogram(row, bins=edges)[0] for row in rows])
+    return hist, bin_centers
+
+
+'''
+The function returns scalar for a single frame and the whole array for a stack of frames
+
+Arguments:
+  images - input of the threshold strategy
+  thresholds - array with one threshold per frame
+
+Returns:
+  float or array of floats
+'''
+def _result_for(images, thresholds):
+    if np.ndim(images) == 2:
+        return float(thresholds[0])
+    return thresholds
+
+
+'''
+Threshold equal to a fraction of the brightest pixel value. Needs a single pass over the pixels and no copy of the frame
+
+Arguments:
+  images - single frame or stack of frames
+  fraction - fraction of the maximal value used as threshold
+
+Returns:
+  threshold for a frame, or array of thresholds for a stack
+'''
+def max_fraction_threshold(images, fraction=THRESHOLD_FRACTION):
+    images = np.asarray(images)
+    thresholds = np.max(images, axis=(-2, -1)) * fraction
+    return _result_for(images, np.atleast_1d(thresholds))
+
+
+'''
+Otsu threshold, as used in edges.py, optionally multiplied by a fraction (edges.py used 1/5 of the Otsu value)
+
+Arguments:
+  images - single frame or stack of frames
+  fraction - number by which Otsu threshold is multiplied
+
+Returns:
+  threshold for a frame, or array of thresholds for a stack
+'''
+def otsu_threshold(images, fraction=1.0):
+    rows = _as_frame_rows(images)
+    hist, bin_centers = _frame_histograms(rows)
+    hist = hist.astype(np.float64)
+
+    #class probabilities and means for all possible thresholds, for all frames at once
+    weight1 = np.cumsum(hist, axis=1)
+    weight2 = np.cumsum(hist[:, ::-1], axis=1)[:, ::-1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean1 = np.cumsum(hist * bin_centers, axis=1) / weight1
+        mean2 = (np.cumsum((hist * bin_centers)[:, ::-1], axis=1) / weight2[:, ::-1])[:, ::-1]
+        variance12 = weight1[:, :-1] * weight2[:, 1:] * (mean1[:, :-1] - mean2[:, 1:]) ** 2
+
+    #empty bins before the first pixel of a frame give undefined variances
+    variance12 = np.nan_to_num(variance12, nan=-1.)
+    if variance12.shape[1] == 0:
+        thresholds = np.full(len(rows), float(bin_centers[0]))
+    else:
+        thresholds = bin_centers[np.argmax(variance12, axis=1)].astype(np.float64)
+
+    #frames with a single value have no threshold splitting them, use that value like skimage does
+    frame_min = rows.min(axis=1)
+    constant = frame_min == rows.max(axis=1)
+    thresholds[constant] = frame_min[constant]
+    return _result_for(images, thresholds * fraction)
+
+
+'''
+Threshold equal to the given percentile of pixel values, taken as the smallest value for which at least q percent
+of pixels is not brighter (the inverted cdf definition). Computed from the histogram, without sorting the pixels
+
+Arguments:
+  images - single frame or stack of frames
+  q - percentile, between 0 and 100
+  fraction - number by which the percentile value is multiplied
+
+Returns:
+  threshold for a frame, or array of thresholds for a stack
+'''
+def percentile_threshold(images, q=99.9, fraction=1.0):
+    rows = _as_frame_rows(images)
+    hist, bin_centers = _frame_histograms(rows)
+    cdf = np.cumsum(hist, axis=1)
+    rank = np.ceil(q / 100. * rows.shape[1])
+    idx = np.argmax(cdf >= np.maximum(rank, 1), axis=1)
+    thresholds = bin_centers[idx].astype(np.float64)
+    return _result_for(images, thresholds * fraction)
+
+
+'''
+Threshold placed k standard deviations above the background level. The background level is the most frequent
+pixel value, and the standard deviation is estimated from the histogram as half of the 16-84 percentile range,
+so that streaks and hot pixels do not affect it
+
+Arguments:
+  images - single frame or stack of frames
+  k - number of standard deviations above background
+
+Returns:
+  threshold for a frame, or array of thresholds for a stack
+'''
+def histogram_threshold(images, k=5.0):
+    rows = _as_frame_rows(images)
+    hist, bin_centers = _frame_histograms(rows)
+    cdf = np.cumsum(hist, axis=1) / rows.shape[1]
+    background = bin_centers[np.argmax(hist, axis=1)]
+    p16 = bin_centers[np.argmax(cdf >= 0.16, axis=1)]
+    p84 = bin_centers[np.argmax(cdf >= 0.84, axis=1)]
+    sigma = (p84 - p16) / 2.
+    thresholds = background + k * sigma
+    return _result_for(images, thresholds.astype(np.float64))
+
+
+#dict where key - name of the strategy, value - function computing threshold
+THRESHOLD_STRATEGIES = {
+    'max_fraction': max_fraction_threshold,
+    'otsu': otsu_threshold,
+    'percentile': percentile_threshold,
+    'histogram': histogram_threshold,
+}
+
+
+'''
+The function splits threshold specification into strategy name and its parameters. Specification is the name of
+a strategy, optionally followed by colon and comma separated parameters, e.g. 'max_fraction:fraction=0.1' or
+'percentile:q=99.5,fraction=0.5'
+
+Arguments:
+  spec - threshold specification
+
+Returns:
+  strategy - name of the strategy
+  params - dict where key - parameter name, value - float value
+'''
+def parse_threshold_spec(spec):
+    strategy, params = _parse_threshold_spec(spec)
+    return strategy, dict(params)
+
+
+'''
+The function parses threshold specification like parse_threshold_spec. Results are cached, as thresholds of every
+frame are computed from the same specification
+
+Arguments:
+  spec - threshold specification
+
+Returns:
+  strategy - name of the strategy
+  params - tuple of (parameter name, float value) pairs
+'''
+@functools.lru_cache(maxsize=64)
+def _parse_threshold_spec(spec):
+    strategy, _, param_text = spec.partition(':')
+    strategy = strategy.strip()
+    if strategy not in THRESHOLD_STRATEGIES:
+        raise ValueError('unknown threshold strategy ' + repr(strategy) + ', expected one of: ' +
+                         ', '.join(THRESHOLD_STRATEGIES))
+    accepted = list(inspect.signature(THRESHOLD_STRATEGIES[strategy]).parameters)[1:]
+    params = {}
+    for item in param_text.split(','):
+        if not item.strip():
+            continue
+        name, sep, value = item.partition('=')
+        if not sep:
+            raise ValueError('threshold parameter ' + repr(item) + ' should have form name=value')
+        if name.strip() not in accepted:
+            raise ValueError('strategy ' + repr(strategy) + ' has no parameter ' + repr(name.strip()) +
+                             ', expected one of: ' + ', '.join(accepted))
+        try:
+            params[name.strip()] = float(value)
+        except ValueError:
+            raise ValueError('value of threshold parameter ' + repr(name.strip()) + ' is not a number')
+    return strategy, tuple(params.items())
+
+
+'''
+The function computes threshold of a frame, or thresholds of all frames in a stack, with chosen strategy
+
+Arguments:
+  images - single frame (2D array) or stack of frames (3D array)
+  strategy - threshold specification: name of the strategy, one of THRESHOLD_STRATEGIES keys, optionally with
+  parameters, see parse_threshold_spec
+  params - additional keyword arguments passed to the strategy, they override parameters of the specification
+
+Returns:
+  threshold for a frame, or array of thresholds for a stack
+'''
+def compute_threshold(images, strategy=DEFAULT_THRESHOLD_STRATEGY, **params):
+    strategy, spec_params = parse_threshold_spec(strategy)
+    spec_params.update(params)
+    return THRESHOLD_STRATEGIES[strategy](images, **spec_params)
@@ -0,0 +1,217 @@
+#
+# Module finding regions of very large frames tile by tile, so memory used by masks and labels scales with the size
+# of a tile rather than the size of the frame.
+#
+# Each tile is thresholded and closed together with a halo of HALO pixels taken from its neighbours, so the closing of
+# the tile core is the same as the closing of the whole frame. Cores are labelled separately, regions touching across
+# tile seams are joined with union-find over labels of the pixels lying on both sides of each seam, and regions
+# touching the true frame edge are removed, like clear_border does for the whole frame. Region properties are
+# accumulated as moments of the pieces in each tile and merged, so no labelled image of the whole frame is built.
+# The regions, with their labels, are the same as the ones found by image_processing.find_regions_in_image.
+#
+
+#importing packages for standard mathematical and data operations
+import numpy as np
+
+#importing functions from custom modules
+from measurement import pixel_moments, regions_from_moments, empty_regions
+
+#importing instrumentation of stages
+from instrumentation import stage, count
+
+#constants and default values
+
+#size of tiles, in pixels, used when none is given
+DEFAULT_TILE_SIZE = 2048
+
+#width of the halo around each tile: closing with 3x3 footprint is dilation followed by erosion, each reaching
+#one pixel further
+HALO = 2
+
+
+'''
+The function measures pieces of regions found in one labelled tile
+
+Arguments:
+  labels - labelled core of the tile
+  n - number of labels in the tile
+  r0, c0 - position of the tile in the frame
+  width - width of the frame
+
+Returns:
+  dict returned by measurement.pixel_moments, in frame coordinates, with 'first' - linear index in the frame of
+  the first pixel in raster order - instead of 'first_r' and 'first_c'
+'''
+def measure_pieces(labels, n, r0, c0, width):
+    idx = np.flatnonzero(labels)
+    r, c = np.divmod(idx, labels.shape[1])
+    pieces = pixel_moments(labels.ravel()[idx], r, c, n)
+    for name in ['mean_r', 'min_r', 'max_r']:
+        pieces[name] = pieces[name] + r0
+    for name in ['mean_c', 'min_c', 'max_c']:
+        pieces[name] = pieces[name] + c0
+    pieces['first'] = (pieces.pop('first_r') + r0) * width + pieces.pop('first_c') + c0
+    return pieces
+
+
+'''
+The function returns pairs of labels of 8-connected pixels lying on two sides of a seam
+
+Arguments:
+  a, b - labels of the pixels in the lines on both sides of the seam
+
+Returns:
+  2D array with one pair of different foreground labels per row
+'''
+def seam_pairs(a, b):
+    pairs = np.concatenate([np.stack([a, b], axis=1),
+                            np.stack([a[:-1], b[1:]], axis=1),
+                            np.stack([a[1:], b[:-1]], axis=1)])
+    return pairs[(pairs[:, 0] > 0) & (pairs[:, 1] > 0) & (pairs[:, 0] != pairs[:, 1])]
+
+
+'''
+The function joins labels into groups with union-find
+
+Arguments:
+  n - number of labels, labels are numbered from 1
+  pairs - 2D array with pairs of labels belonging to one region
+
+Returns:
+  array mapping each label (and 0) to the smallest label of its group
+'''
+def union_labels(n, pairs):
+    parent = list(range(n + 1))
+
+    def find(x):
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    for a, b in np.unique(pairs, axis=0).tolist() if len(pairs) else []:
+        ra = find(a)
+        rb = find(b)
+        if ra != rb:
+            parent[max(ra, rb)] = min(ra, rb)
+    return np.array([find(x) for x in range(n + 1)], dtype=np.int64)
+
+
+'''
+The function finds regions of a frame tile by tile. The result is the same as of find_regions_in_image with
+threshold_image, label_image and regionprops run on the whole frame
+
+Arguments:
+  image - array with pixels of the frame, e.g. memory mapped
+  threshold - threshold of the frame, computed for the whole frame
+  tile_size - height and width of tiles, without the halo
+  min_area - minimal area of returned region
+
+Returns:
+  record array of measurement.REGION_DTYPE, ordered by label
+'''
+def find_regions_tiled(image, threshold, tile_size=DEFAULT_TILE_SIZE, min_area=0):
+    from skimage.morphology import closing, square
+    from skimage.measure import label
+
+    height, width = image.shape
+    row_starts = list(range(0, height, tile_size))
+    col_starts = list(range(0, width, tile_size))
+
+    #labels of pixels on both sides of each seam between tiles: rows above and below horizontal seams,
+    #columns left and right of vertical seams
+    above = np.zeros((len(row_starts) - 1, width), dtype=np.int64)
+    below = np.zeros((len(row_starts) - 1, width), dtype=np.int64)
+    left = np.zeros((len(col_starts) - 1, height), dtype=np.int64)
+    right = np.zeros((len(col_starts) - 1, height), dtype=np.int64)
+    edge_labels = []
+    pieces = []
+    labels_count = 0
+
+    for ti, r0 in enumerate(row_starts):
+        r1 = min(r0 + tile_size, height)
+        hr0 = max(r0 - HALO, 0)
+        hr1 = min(r1 + HALO, height)
+        for tj, c0 in enumerate(col_starts):
+            c1 = min(c0 + tile_size, width)
+            hc0 = max(c0 - HALO, 0)
+            hc1 = min(c1 + HALO, width)
+
+            with stage('tile_closing'):
+                closed = closing(image[hr0:hr1, hc0:hc1] > threshold, square(3))
+            with stage('tile_label'):
+                tile_labels, n = label(closed[r0 - hr0:r1 - hr0, c0 - hc0:c1 - hc0], return_num=True)
+            count('tiles')
+            if n == 0:
+                continue
+
+            with stage('tile_measure'):
+                pieces.append(measure_pieces(tile_labels, n, r0, c0, width))
+                tile_labels[tile_labels > 0] += labels_count
+                labels_count += n
+
+            if ti > 0:
+                below[ti - 1, c0:c1] = tile_labels[0]
+            if ti + 1 < len(row_starts):
+                above[ti, c0:c1] = tile_labels[-1]
+            if tj > 0:
+                right[tj - 1, r0:r1] = tile_labels[:, 0]
+            if tj + 1 < len(col_starts):
+                left[tj, r0:r1] = tile_labels[:, -1]
+            for line, on_edge in [(tile_labels[0], r0 == 0), (tile_labels[-1], r1 == height),
+                                  (tile_labels[:, 0], c0 == 0), (tile_labels[:, -1], c1 == width)]:
+                if on_edge:
+                    edge_labels.append(line[line > 0])
+
+    if labels_count == 0:
+        return empty_regions()
+
+    with stage('tile_stitch'):
+        pairs = [seam_pairs(a, b) for a, b in zip(above, below)] + [seam_pairs(a, b) for a, b in zip(left, right)]
+        roots = union_labels(labels_count, np.concatenate(pairs) if pairs else np.zeros((0, 2), np.int64))[1:]
+        regions = merge_pieces({name: np.concatenate([p[name] for p in pieces]) for name in pieces[0]}, roots,
+                               np.unique(roots[np.concatenate(edge_labels) - 1]) if edge_labels else [], min_area)
+    return regions
+
+
+'''
+The function merges pieces of regions lying in different tiles and measures the regions
+
+Arguments:
+  pieces - dict returned by measure_pieces, for all labels of all tiles
+  roots - array with the group (root label) of each label
+  edge_roots - groups touching the frame edge, they are skipped
+  min_area - minimal area of returned region
+
+Returns:
+  record array of measurement.REGION_DTYPE, labelled in the raster order of first pixels of the regions, like
+  skimage.measure.label labels the whole frame
+'''
+def merge_pieces(pieces, roots, edge_roots, min_area=0):
+    groups, group_of = np.unique(roots, return_inverse=True)
+    n = len(groups)
+
+    area = np.bincount(group_of, minlength=n, weights=pieces['area']).astype(np.int64)
+    moments = {'area': area}
+    moments['mean_r'] = np.bincount(group_of, pieces['area'] * pieces['mean_r'], n) / area
+    moments['mean_c'] = np.bincount(group_of, pieces['area'] * pieces['mean_c'], n) / area
+    #central moments of a group: moments of pieces shifted to the common centroid
+    dr = pieces['mean_r'] - moments['mean_r'][group_of]
+    dc = pieces['mean_c'] - moments['mean_c'][group_of]
+    moments['mrr'] = np.bincount(group_of, pieces['mrr'] + pieces['area'] * dr * dr, n)
+    moments['mcc'] = np.bincount(group_of, pieces['mcc'] + pieces['area'] * dc * dc, n)
+    moments['mrc'] = np.bincount(group_of, pieces['mrc'] + pieces['area'] * dr * dc, n)
+
+    largest = np.iinfo(np.int64).max
+    for name, reduce, initial in [('min_r', np.minimum, largest), ('min_c', np.minimum, largest),
+                                  ('first', np.minimum, largest), ('max_r', np.maximum, -1), ('max_c', np.maximum, -1)]:
+        moments[name] = np.full(n, initial, dtype=np.int64)
+        reduce.at(moments[name], group_of, pieces[name])
+
+    #labels are given to all regions not touching the edge, then small ones are skipped
+    keep = np.flatnonzero(~np.isin(groups, edge_roots))
+    keep = keep[np.argsort(moments['first'][keep], kind='stable')]
+    labels = np.arange(1, len(keep) + 1)
+    count('regions_found', len(keep))
+    large = area[keep] >= min_area
+    return regions_from_moments(labels[large], {name: values[keep[large]] for name, values in moments.items()})
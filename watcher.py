@@ -0,0 +1,291 @@
+#
+# Module implementing watch mode: the catalog is monitored for new image files, and each new file is processed as soon
+# as it is completely written, without rescanning the directory. Files are detected with inotify where it is available
+# (Linux), and by polling the directory otherwise.
+#
+
+#importing packages supporting filesystem path walking
+import os
+
+#importing packages for file system notifications, parallel processing and timing
+import ctypes
+import ctypes.util
+import errno
+import select
+import struct
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+#importing functions from custom modules
+from image_processing import find_events_in_file, MIN_STREAK_AREA
+from postprocessing import StreakLengthStats, classify_streak_lengths, write_analytics, SHORT_STREAK, LONG_STREAK
+from results import FileSummary
+from thresholds import DEFAULT_THRESHOLD_STRATEGY
+from region_processing import RenderPool, default_profiles_root
+from results_table import RegionCsvAppender
+from frame_readers import is_frame_file, list_frames, read_frame
+from background_model import prepare_background_model
+from prescreen import record_prescreen
+
+#constants and default values
+
+#inotify event flags: file opened for writing was closed, file was moved into the directory
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+#size of header of inotify event: wd, mask, cookie, len
+INOTIFY_EVENT_HEADER = struct.Struct('iIII')
+
+#interval between directory scans of polling watcher, and between checks of the stop condition, in seconds
+POLL_INTERVAL = 1.0
+
+
+'''
+Watcher reporting files closed after writing, or moved into the directory, using Linux inotify
+
+Arguments:
+  directory - directory to watch
+'''
+class InotifyWatcher:
+    def __init__(self, directory):
+        libc_name = ctypes.util.find_library('c')
+        if libc_name is None:
+            raise OSError('libc not found')
+        libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise OSError('inotify is not available')
+        self.directory = directory
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        wd = libc.inotify_add_watch(self.fd, os.fsencode(directory), IN_CLOSE_WRITE | IN_MOVED_TO)
+        if wd < 0:
+            os.close(self.fd)
+            raise OSError(ctypes.get_errno(), 'inotify_add_watch failed for ' + directory)
+
+    '''
+    The method waits for new files
+
+    Arguments:
+      timeout - maximal time of waiting, in seconds
+
+    Returns:
+      list of paths of new files, empty if none appeared before timeout
+    '''
+    def poll(self, timeout):
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return []
+            raise
+        paths = []
+        offset = 0
+        while offset < len(data):
+            _, mask, _, name_len = INOTIFY_EVENT_HEADER.unpack_from(data, offset)
+            offset += INOTIFY_EVENT_HEADER.size
+            name = data[offset:offset + name_len].rstrip(b'\0')
+            offset += name_len
+            if name:
+                paths.append(os.path.join(self.directory, os.fsdecode(name)))
+        return paths
+
+    def close(self):
+        os.close(self.fd)
+
+
+'''
+Watcher scanning the directory periodically. A file is reported when its size and modification time did not change
+between two consecutive scans, so files still being written are not reported
+
+Arguments:
+  directory - directory to watch
+  interval - time between scans, in seconds
+'''
+class PollingWatcher:
+    def __init__(self, directory, interval=POLL_INTERVAL):
+        self.directory = directory
+        self.interval = interval
+        #files present at start are not new
+        self.reported = set(self._scan())
+        #dict where key - path of file not reported yet, value - (size, mtime) seen in the last scan
+        self.candidates = {}
+        self.last_scan = time.monotonic()
+
+    def _scan(self):
+        result = {}
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    st = entry.stat()
+                    result[entry.path] = (st.st_size, st.st_mtime_ns)
+        return result
+
+    '''
+    The method waits for new files
+
+    Arguments:
+      timeout - maximal time of waiting, in seconds
+
+    Returns:
+      list of paths of new files, empty if none appeared before timeout
+    '''
+    def poll(self, timeout):
+        time.sleep(max(0., min(timeout, self.last_scan + self.interval - time.monotonic())))
+        if time.monotonic() < self.last_scan + self.interval:
+            return []
+        self.last_scan = time.monotonic()
+
+        paths = []
+        candidates = {}
+        for path, signature in self._scan().items():
+            if path in self.reported:
+                continue
+            if self.candidates.get(path) == signature:
+                self.reported.add(path)
+                paths.append(path)
+            else:
+                candidates[path] = signature
+        self.candidates = candidates
+        return sorted(paths)
+
+    def close(self):
+        pass
+
+
+'''
+The function creates watcher of the directory, using inotify if available and polling otherwise
+
+Arguments:
+  directory - directory to watch
+
+Returns:
+  InotifyWatcher or PollingWatcher object
+'''
+def make_watcher(directory):
+    try:
+        return InotifyWatcher(directory)
+    except (OSError, AttributeError):
+        return PollingWatcher(directory)
+
+
+'''
+The function watches catalog and processes each new image file on a bounded pool of worker processes. For each
+processed file, rolling statistics of streak lengths are updated, its streaks are classified against the statistics
+known at that moment, rows are appended to the CSV table of streaks and, if the file has streaks, a line is appended to
+the analytics file, in the format of scan. Each path is processed once, also when it is both listed as existing and
+reported as new
+
+Arguments:
+  catalog - directory to catalog containing images
+  output_filename - name of analytics file, lines are appended to it; the header is written when the file is new
+  table_filename - name of CSV table with one row per streak, rows are appended to it; None disables it
+  workers - number of worker processes
+  threshold_strategy - threshold specification, see thresholds.parse_threshold_spec
+  plots - whether plots of streaks should be drawn
+  max_pending - maximal number of files queued or being processed; watching waits when it is reached
+  stop_after - number of files after which watching stops, None means watching until interrupted
+  process_existing - whether image files already present in the catalog are processed first
+  min_area - minimal area of region to be counted as streak
+  profiles_root - directory where plots are saved, None means default_profiles_root(catalog)
+  tile_size - if given, images are processed in tiles of this size
+  raw_format - shape and type of pixels of raw files, see frame_readers.parse_raw_format; raw files are processed
+  only when it is given
+  prescreen - 'exact' or 'fast' to reject frames without streaks early, None processes every frame
+  artifact_mode - how plots are saved, see region_processing.ARTIFACT_MODES
+  background_filename - path of file caching the background and hot pixel model, built or updated with frames
+  already present in the catalog when watching starts; None processes frames without correction
+
+Returns:
+  StreakLengthStats of all processed streaks
+'''
+def watch_catalog(catalog, output_filename, table_filename=None, workers=1,
+                  threshold_strategy=DEFAULT_THRESHOLD_STRATEGY, plots=True, max_pending=None, stop_after=None,
+                  process_existing=False, min_area=MIN_STREAK_AREA, profiles_root=None,
+                  tile_size=None, raw_format=None, prescreen=None, artifact_mode='plots', background_filename=None):
+    if max_pending is None:
+        max_pending = 2 * workers
+    background = None
+    if background_filename is not None:
+        model = prepare_background_model(background_filename, list_frames(catalog, raw_format),
+                                         lambda f: read_frame(f, raw_format))
+        background = background_filename if model is not None else None
+    stats = StreakLengthStats()
+    lock = threading.Lock()
+    slots = threading.BoundedSemaphore(max_pending)
+    errors = []
+    submitted = set()
+
+    watcher = make_watcher(catalog)
+    if profiles_root is None:
+        profiles_root = default_profiles_root(catalog)
+    render_pool = RenderPool(1, profiles_root=profiles_root, artifact_mode=artifact_mode) if plots else None
+    table = RegionCsvAppender(table_filename) if table_filename is not None else None
+    output = open(output_filename, 'a')
+    if output.tell() == 0:
+        write_analytics(output, [])
+        output.flush()
+    executor = ProcessPoolExecutor(workers)
+
+    def file_done(future):
+        try:
+            file_result = future.result()
+            with lock:
+                records = file_result.pop('render_records')
+                record_prescreen(file_result.pop('prescreen_rejected'))
+                lengths = file_result['lengths']
+                stats.update(lengths)
+                classes = classify_streak_lengths(lengths, stats)
+                if len(lengths) > 0:
+                    write_analytics(output, [FileSummary(file_result['filename'], len(lengths),
+                                                         int((classes == SHORT_STREAK).sum()),
+                                                         int((classes == LONG_STREAK).sum()))], header=False)
+                    output.flush()
+                if table is not None:
+                    table.append(file_result, classes)
+                if render_pool is not None:
+                    render_pool.submit(records)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            slots.release()
+
+    def submit(path):
+        #a file written while the catalog is listed is both listed and reported by the watcher
+        if path in submitted or (stop_after is not None and len(submitted) >= stop_after):
+            return
+        submitted.add(path)
+        slots.acquire()
+        future = executor.submit(find_events_in_file, path, threshold_strategy, plots, min_area, tile_size,
+                                 raw_format, prescreen, background)
+        future.add_done_callback(file_done)
+
+    try:
+        if process_existing:
+            for entry in sorted(os.listdir(catalog)):
+                if is_frame_file(entry, raw_format):
+                    submit(os.path.join(catalog, entry))
+        while (stop_after is None or len(submitted) < stop_after) and not errors:
+            for path in watcher.poll(POLL_INTERVAL):
+                if is_frame_file(path, raw_format):
+                    submit(path)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        executor.shutdown(wait=True)
+        watcher.close()
+        output.close()
+        if table is not None:
+            table.close()
+        if render_pool is not None:
+            render_pool.close()
+
+    if errors:
+        raise errors[0]
+    return stats